@@ -23,6 +23,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'rest_framework',
     'invoices',                     # Your invoice app
 ]
 
@@ -37,7 +38,9 @@ JAZZMIN_SETTINGS = {
 }
 
 MIDDLEWARE = [
+    'invoices.instrumentation.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'invoices.middleware.AsyncWhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -92,12 +95,127 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Fingerprinted file names plus gzip/Brotli copies made by collectstatic, served by WhiteNoise
+# with far-future cache headers. Needs `manage.py collectstatic` after each deploy, so it is off
+# while DEBUG is on.
+INVOICE_STATIC_MANIFEST = config('INVOICE_STATIC_MANIFEST', default=not DEBUG, cast=bool)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage' if INVOICE_STATIC_MANIFEST
+        else 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Bootstrap loads from the jsDelivr CDN, with Subresource Integrity, until `manage.py
+# vendor_assets` has put it in static/vendor/ and it is committed; from then on it is served
+# from the static files like everything else.
+INVOICE_BOOTSTRAP_CDN = config(
+    'INVOICE_BOOTSTRAP_CDN', default=not (BASE_DIR / 'static' / 'vendor' / 'bootstrap-5.1.3').is_dir(), cast=bool,
+)
+
 # Media files (User uploads)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Seconds browsers may reuse a signature/stamp image before revalidating it
+INVOICE_MEDIA_MAX_AGE = config('INVOICE_MEDIA_MAX_AGE', default=3600, cast=int)
+# Resolution of the signature/stamp variants embedded in PDFs (invoices/images.py)
+INVOICE_IMAGE_PRINT_DPI = config('INVOICE_IMAGE_PRINT_DPI', default=300, cast=int)
+# Behind nginx: the internal location that maps to MEDIA_ROOT (e.g. /protected-media/), so the
+# file itself is sent by nginx once Django has checked the login
+INVOICE_MEDIA_ACCEL_REDIRECT = config('INVOICE_MEDIA_ACCEL_REDIRECT', default='')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Sessions are read on every page (require_login_session). The default database backend reads
+# django_session every time. invoices.sessions (opt-in) keeps them in the database but answers
+# reads from the 'sessions' cache below: with the default per-process LocMemCache a logged-out
+# session stays valid in the other workers for up to INVOICE_SESSION_CACHE_TIMEOUT seconds, with
+# a shared cache (INVOICE_SESSION_CACHE_BACKEND/LOCATION, e.g. Redis) a logout takes effect at
+# once. .signed_cookies keeps no server-side state at all (a copied cookie stays valid until it
+# expires, even after logout)
+SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.db')
+SESSION_CACHE_ALIAS = 'sessions'
+# Seconds a worker may serve a session from its cache before re-reading it
+INVOICE_SESSION_CACHE_TIMEOUT = config('INVOICE_SESSION_CACHE_TIMEOUT', default=60, cast=int)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'invoices-default',
+    },
+    'sessions': {
+        'BACKEND': config('INVOICE_SESSION_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('INVOICE_SESSION_CACHE_LOCATION', default='invoices-sessions'),
+    },
+}
+if CACHES['sessions']['BACKEND'].endswith('.LocMemCache'):
+    # Other backends pass OPTIONS on to their client library
+    CACHES['sessions']['OPTIONS'] = {'MAX_ENTRIES': config('INVOICE_SESSION_CACHE_ENTRIES', default=10000, cast=int)}
+
+# Rendered invoice PDF cache (see invoices/pdf_cache.py)
+INVOICE_PDF_CACHE_DIR = config('INVOICE_PDF_CACHE_DIR', default=str(BASE_DIR / 'pdf_cache'))
+INVOICE_PDF_CACHE_MAX_BYTES = config('INVOICE_PDF_CACHE_MAX_BYTES', default=256 * 1024 * 1024, cast=int)
+
+# Pack files of closed financial years (see invoices/archive.py; `manage.py close_financial_year`)
+INVOICE_ARCHIVE_DIR = config('INVOICE_ARCHIVE_DIR', default=str(BASE_DIR / 'archive'))
+
+# Rows per page on the invoice list
+INVOICE_LIST_PAGE_SIZE = config('INVOICE_LIST_PAGE_SIZE', default=50, cast=int)
+
+# JSON API (see invoices/api.py)
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': ['invoices.authentication.LoginSessionAuthentication'],
+    'DEFAULT_PERMISSION_CLASSES': ['invoices.authentication.HasLoginSession'],
+    'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
+    'DEFAULT_PARSER_CLASSES': ['rest_framework.parsers.JSONParser'],
+    'UNAUTHENTICATED_USER': None,
+}
+INVOICE_API_PAGE_SIZE = config('INVOICE_API_PAGE_SIZE', default=50, cast=int)
+INVOICE_API_MAX_PAGE_SIZE = config('INVOICE_API_MAX_PAGE_SIZE', default=500, cast=int)
+# Invoices accepted per batch-create call; the whole batch is one transaction
+INVOICE_API_MAX_BATCH = config('INVOICE_API_MAX_BATCH', default=1000, cast=int)
+
+# Invoices one client statement may hold; the view builds it in memory before sending anything
+INVOICE_STATEMENT_MAX_INVOICES = config('INVOICE_STATEMENT_MAX_INVOICES', default=500, cast=int)
+
+# PDF renderer: invoices.pdf.XHTML2PDFBackend (HTML template) or
+# invoices.pdf_reportlab.ReportLabBackend (direct drawing, several times faster)
+INVOICE_PDF_BACKEND = config('INVOICE_PDF_BACKEND', default='invoices.pdf.XHTML2PDFBackend')
+# Itemised invoices with more lines than this always use the ReportLab renderer; xhtml2pdf
+# slows down quadratically with table length
+INVOICE_PDF_HTML_MAX_LINES = config('INVOICE_PDF_HTML_MAX_LINES', default=100, cast=int)
+
+# Import the PDF renderer and warm its assets at startup instead of on the first download
+INVOICE_PDF_PRELOAD = config('INVOICE_PDF_PRELOAD', default=False, cast=bool)
+
+# Seconds between checks for edited template/CSS/images in the PDF asset bundle (invoices/pdf.py)
+INVOICE_PDF_ASSET_CHECK_INTERVAL = config('INVOICE_PDF_ASSET_CHECK_INTERVAL', default=2.0, cast=float)
+
+# Process pool size for bulk PDF rendering (see invoices/bulk_pdf.py), and ZIP exports that
+# may stream at once from one server process (further ones are answered 503)
+INVOICE_PDF_WORKERS = config('INVOICE_PDF_WORKERS', default=os.cpu_count() or 1, cast=int)
+INVOICE_PDF_EXPORTS = config('INVOICE_PDF_EXPORTS', default=2, cast=int)
+
+# Background PDF pre-rendering (see invoices/pdf_jobs.py; run `manage.py render_pdf_jobs`)
+INVOICE_PDF_PRERENDER = config('INVOICE_PDF_PRERENDER', default=True, cast=bool)
+INVOICE_PDF_JOB_TIMEOUT = config('INVOICE_PDF_JOB_TIMEOUT', default=120, cast=int)
+INVOICE_PDF_JOB_MAX_ATTEMPTS = config('INVOICE_PDF_JOB_MAX_ATTEMPTS', default=3, cast=int)
+
+# PDF renders for downloads that miss the cache (see invoices/pdf_executor.py): 'thread' or
+# 'process' workers, renders allowed to wait for one, and seconds a download waits for its PDF
+INVOICE_PDF_ASYNC_EXECUTOR = config('INVOICE_PDF_ASYNC_EXECUTOR', default='thread')
+INVOICE_PDF_ASYNC_WORKERS = config('INVOICE_PDF_ASYNC_WORKERS', default=2, cast=int)
+INVOICE_PDF_ASYNC_QUEUE = config('INVOICE_PDF_ASYNC_QUEUE', default=8, cast=int)
+INVOICE_PDF_ASYNC_TIMEOUT = config('INVOICE_PDF_ASYNC_TIMEOUT', default=30, cast=float)
+
+# Requests slower than this (ms) are logged with their stage breakdown to the
+# 'invoices.performance' logger (see invoices/instrumentation.py)
+INVOICE_SLOW_REQUEST_MS = config('INVOICE_SLOW_REQUEST_MS', default=1000, cast=int)
+
+# Addresses allowed to scrape /metrics
+INVOICE_METRICS_ALLOWED_IPS = config('INVOICE_METRICS_ALLOWED_IPS', default='127.0.0.1,::1', cast=lambda v: [s.strip() for s in v.split(',')])
+
 # Production Security Settings
 if not DEBUG:
     # Security settings for production
@@ -3,13 +3,12 @@ from django.contrib import admin
 from django.urls import path, include
 
 from django.conf import settings
-from django.conf.urls.static import static
+
+from invoices import views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # Media is only signature/stamp images: served behind the login in every environment
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', views.serve_media, name='serve_media'),
     path('', include('invoices.urls')),
 ]
-
-# ONLY in development (DEBUG=True)
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
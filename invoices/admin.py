@@ -1,19 +1,185 @@
 from django.contrib import admin
-from .models import Invoice, Signature, Stamp
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ORDER_VAR, PAGE_VAR, ChangeList
+
+from . import line_items, search
+from .filters import filter_invoices
+from .models import ArchivedInvoice, GstSummary, Invoice, InvoiceLineItem, InvoiceNumberSequence, PdfRenderJob, Signature, Stamp
+from .pagination import EstimatedCountPaginator, InvalidCursor, KeysetPaginator
+
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
 
 @admin.register(Signature)
 class SignatureAdmin(admin.ModelAdmin):
     list_display = ['name', 'created_at']
     search_fields = ['name']
 
+class InvoiceLineItemInline(admin.TabularInline):
+    model = InvoiceLineItem
+    fields = ['position', 'description', 'sac_code', 'quantity', 'rate', 'gst_rate', 'base_amount', 'cgst_amount', 'sgst_amount', 'igst_amount']
+    readonly_fields = ['base_amount', 'cgst_amount', 'sgst_amount', 'igst_amount']
+    extra = 0
+
+class FinancialYearListFilter(admin.SimpleListFilter):
+    title = 'financial year'
+    parameter_name = 'financial_year'
+
+    def lookups(self, request, model_admin):
+        # The years the GST summary has invoices for: one query over a table of months x states
+        # instead of two over the invoices on every changelist page. Closed years stay listed,
+        # since the summary keeps their totals
+        years = (
+            GstSummary.objects.filter(invoice_count__gt=0).order_by('-financial_year')
+            .values_list('financial_year', flat=True).distinct()
+        )
+        return [(str(year), 'FY %d-%02d' % (year, (year + 1) % 100)) for year in years]
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        if not self.value().isdigit():
+            raise IncorrectLookupParameters(self.value())
+        return filter_invoices(queryset, financial_year=self.value())
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Changelist that pages through the admin's default ordering with keyset cursors,
+    ``?after=`` / ``?before=``, instead of ``?p=N``: the OFFSET behind a page number makes
+    every page slower than the one before it, a cursor page costs the same at any depth.
+    A column ordering, a search (ordered by relevance), "Show all" or an explicit page
+    number falls back to numbered pages.
+    """
+
+    def get_filters_params(self, params=None):
+        params = super().get_filters_params(params)
+        for name in (AFTER_VAR, BEFORE_VAR):
+            params.pop(name, None)
+        return params
+
+    def uses_keyset(self, request):
+        return not (
+            self.show_all or self.query or self.list_editable
+            or ORDER_VAR in self.params or PAGE_VAR in request.GET
+        )
+
+    def get_results(self, request):
+        self.keyset_page = None
+        if not self.uses_keyset(request):
+            return super().get_results(request)
+
+        ordering = self.model_admin.get_ordering(request) or self.opts.ordering
+        keyset = KeysetPaginator(self.queryset, ordering=ordering, per_page=self.list_per_page)
+        try:
+            page = keyset.page(after=request.GET.get(AFTER_VAR), before=request.GET.get(BEFORE_VAR))
+        except InvalidCursor as exc:
+            raise IncorrectLookupParameters(exc)
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+
+        self.keyset_page = page
+        self.result_count = paginator.count
+        self.show_full_result_count = self.model_admin.show_full_result_count
+        self.full_result_count = self.root_queryset.count() if self.show_full_result_count else None
+        self.show_admin_actions = not self.show_full_result_count or bool(self.full_result_count)
+        self.result_list = page.object_list
+        self.can_show_all = self.result_count <= self.list_max_show_all
+        self.multi_page = page.has_next() or page.has_previous()
+        self.paginator = paginator
+
+    def cursor_url(self, **cursor):
+        return self.get_query_string(cursor, remove=[AFTER_VAR, BEFORE_VAR])
+
+    def newest_url(self):
+        return self.cursor_url()
+
+    def newer_url(self):
+        return self.cursor_url(before=self.keyset_page.previous_cursor)
+
+    def older_url(self):
+        return self.cursor_url(after=self.keyset_page.next_cursor)
+
+
 @admin.register(Invoice)
 class InvoiceAdmin(admin.ModelAdmin):
-    list_display = ['invoice_number', 'invoice_date', 'total_amount', 'state', 'created_at']
-    list_filter = ['invoice_date', 'state']
+    list_display = ['invoice_number', 'invoice_date', 'total_amount', 'state', 'pdf_status', 'created_at']
+    list_filter = [FinancialYearListFilter, 'invoice_date', 'state']
+    list_select_related = ['signature', 'stamp']
+    list_per_page = 50
+    # Unique, and matched by the invoice_date_id_idx / invoice_state_date_id_idx indexes
+    ordering = ['-invoice_date', '-id']
+    # Counting is what grows with the table: no second, unfiltered COUNT(*) next to the
+    # filtered one, and EstimatedCountPaginator for that
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
     search_fields = ['invoice_number', 'client_name']
-    readonly_fields = ['invoice_number', 'cgst_amount', 'sgst_amount', 'igst_amount', 'round_off', 'total_amount']
+    readonly_fields = ['invoice_number', 'cgst_amount', 'sgst_amount', 'igst_amount', 'round_off', 'total_amount', 'line_item_count']
+    inlines = [InvoiceLineItemInline]
+    # Past this many lines the inline would render thousands of inputs; such invoices are
+    # edited through line_items.replace_line_items()
+    max_inline_lines = 200
+
+    def get_inlines(self, request, obj):
+        if obj is not None and obj.line_item_count > self.max_inline_lines:
+            return []
+        return self.inlines
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Line amounts depend on the invoice's state, so an itemised invoice is recomputed on
+        # every save, not only when its lines were edited
+        if form.instance.line_item_count or any(formset.has_changed() for formset in formsets):
+            line_items.recalculate(form.instance)
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        # Full-text index instead of LIKE '%term%' scans over the text columns
+        if not search_term:
+            return queryset, False
+        return search.search(queryset, search_term), False
 
 @admin.register(Stamp)
 class StampAdmin(admin.ModelAdmin):
     list_display = ['name', 'created_at']
     search_fields = ['name']
+
+@admin.register(InvoiceNumberSequence)
+class InvoiceNumberSequenceAdmin(admin.ModelAdmin):
+    list_display = ['financial_year', 'last_number']
+
+@admin.register(PdfRenderJob)
+class PdfRenderJobAdmin(admin.ModelAdmin):
+    list_display = ['invoice', 'status', 'attempts', 'run_after', 'updated_at']
+    list_filter = ['status']
+    list_select_related = ['invoice']
+    readonly_fields = ['invoice', 'attempts', 'locked_at', 'last_error', 'created_at', 'updated_at']
+
+@admin.register(GstSummary)
+class GstSummaryAdmin(admin.ModelAdmin):
+    list_display = ['month', 'state', 'invoice_count', 'base_amount', 'cgst_amount', 'sgst_amount', 'igst_amount', 'total_amount']
+    list_filter = ['financial_year', 'state']
+
+    # Maintained by gst_summary.py; edit the invoices or run `manage.py gst_summary --rebuild`
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(ArchivedInvoice)
+class ArchivedInvoiceAdmin(admin.ModelAdmin):
+    list_display = ['invoice_number', 'invoice_date', 'client_name', 'state', 'total_amount', 'archived_at']
+    list_filter = ['financial_year', 'state']
+    search_fields = ['invoice_number']
+
+    # Written by `manage.py close_financial_year`; the PDFs in the pack match these rows
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,75 @@
+"""
+Indian-format (lakh/crore) amount in words, e.g. 123456 -> "One Lakh, Twenty-Three Thousand,
+Four Hundred And Fifty-Six".
+
+Produces exactly what ``num2words(n, lang='en_IN').title()`` did for invoices, without loading
+num2words' language machinery, and memoizes the result since the same totals come up again
+and again in lists, exports and statements.
+"""
+from decimal import Decimal
+from functools import lru_cache
+
+ONES = (
+    'zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+    'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen', 'eighteen', 'nineteen',
+)
+TENS = ('', '', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety')
+
+# Same ceiling as num2words' en_IN converter (999 crore ...)
+MAX_AMOUNT = 10 ** 10
+
+# (value, name) from largest to smallest; the remainder below 100 is handled separately
+GROUPS = ((10 ** 7, 'crore'), (10 ** 5, 'lakh'), (10 ** 3, 'thousand'), (10 ** 2, 'hundred'))
+
+
+def _below_hundred(n):
+    if n < 20:
+        return ONES[n]
+    tens, ones = divmod(n, 10)
+    return TENS[tens] + ('-' + ONES[ones] if ones else '')
+
+
+def _below_thousand(n):
+    hundreds, rest = divmod(n, 100)
+    if not hundreds:
+        return _below_hundred(rest)
+    words = ONES[hundreds] + ' hundred'
+    return words + ' and ' + _below_hundred(rest) if rest else words
+
+
+def _cardinal(n):
+    if n < 100:
+        return _below_hundred(n)
+    parts = []
+    for value, name in GROUPS:
+        count, n = divmod(n, value)
+        if count:
+            parts.append(_below_thousand(count) + ' ' + name)
+    words = ', '.join(parts)
+    # The last two-digit chunk is joined with "and": "one lakh and one"
+    return words + ' and ' + _below_hundred(n) if n else words
+
+
+@lru_cache(maxsize=4096)
+def number_in_words(n):
+    """
+    Title-cased Indian-format words for the integer ``n``.
+    """
+    if abs(n) >= MAX_AMOUNT:
+        raise OverflowError('abs(%s) must be less than %s.' % (n, MAX_AMOUNT))
+    words = _cardinal(abs(n))
+    return ('minus ' + words if n < 0 else words).title()
+
+
+def amount_in_words(amount, paise=False):
+    """
+    Words for a rupee amount. By default the paise are dropped (``int(amount)``) as on the
+    invoice; with ``paise=True`` a non-zero fraction is appended, e.g. "Ten And Fifty Paise".
+    """
+    rupees = int(amount)
+    words = number_in_words(rupees)
+    if paise:
+        fraction = int((abs(Decimal(str(amount))) - abs(rupees)) * 100)
+        if fraction:
+            words = '%s And %s Paise' % (words, number_in_words(fraction))
+    return words
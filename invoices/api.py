@@ -0,0 +1,214 @@
+"""
+JSON API for integrations (the scheduling system) to create and read invoices.
+
+    POST /api/invoices/batch/        create up to INVOICE_API_MAX_BATCH invoices in one call
+    GET  /api/invoices/              cursor-paginated list, with the invoice list's filters
+    GET  /api/invoices/<pk>/         one invoice
+
+Clients log in through /login/ like a browser and send the session cookie plus the CSRF token
+(X-CSRFToken header) with every POST (see authentication.py). Every endpoint takes ``?fields=id,invoice_number,...``
+to return only those fields; the list and detail queries then load only those columns.
+
+A batch goes through the same pipeline as the spreadsheet import (importers.py): each invoice
+is validated with the InvoiceForm rules, the whole batch gets one block of invoice numbers and
+its GST in one pass, and it is inserted with a single bulk_create in one transaction. If any
+invoice is invalid nothing is created and the errors are returned by position in the array.
+
+Invoices of closed financial years have been moved to the archive (archive.py). The detail
+endpoint falls back to it, and the list continues into it after the last invoice of the open
+years: its cursors there start with ARCHIVE_CURSOR, and the archived invoices come newest
+first by invoice date. ``?fields=`` does not narrow the archive query, whose fields are all in
+one JSON column.
+"""
+from django.conf import settings
+from django.shortcuts import get_object_or_404
+from rest_framework import serializers, status
+from rest_framework.decorators import api_view
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from . import archive, importers
+from .forms import InvoiceFilterForm
+from .models import ArchivedInvoice, Invoice
+from .pagination import InvalidCursor, KeysetPaginator
+
+
+class InvoiceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Invoice
+        fields = [
+            'id', 'invoice_number', 'invoice_date', 'sac_code', 'client_name', 'client_address',
+            'contract_no', 'contract_date', 'service_description', 'total_amount', 'state',
+            'cgst_rate', 'sgst_rate', 'igst_rate', 'base_amount', 'cgst_amount', 'sgst_amount',
+            'igst_amount', 'round_off', 'signature', 'include_stamp', 'stamp', 'line_item_count',
+            'pdf_status', 'created_at', 'updated_at',
+        ]
+        read_only_fields = fields
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+def requested_fields(request):
+    """
+    The field names asked for with ``?fields=``, in serializer order, or None for all of them.
+    """
+    value = request.query_params.get('fields')
+    if not value:
+        return None
+    names = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = names - set(InvoiceSerializer.Meta.fields)
+    if unknown:
+        raise ValidationError({'fields': ['Unknown field(s): %s.' % ', '.join(sorted(unknown))]})
+    return [name for name in InvoiceSerializer.Meta.fields if name in names]
+
+
+def _columns(fields, *required):
+    # Model fields to load for ``fields``; signature/stamp are serialized from their ids
+    return list(dict.fromkeys([*required, *fields]))
+
+
+def _page_size(request):
+    default = getattr(settings, 'INVOICE_API_PAGE_SIZE', 50)
+    try:
+        size = int(request.query_params.get('limit', default))
+    except ValueError:
+        raise ValidationError({'limit': ['Must be a whole number.']})
+    return max(1, min(size, getattr(settings, 'INVOICE_API_MAX_PAGE_SIZE', 500)))
+
+
+# Prefix of the list cursors that point into the archive. ``after=a.`` is the first page of
+# the archive and ``before=a.`` the last page of the open years.
+ARCHIVE_CURSOR = 'a.'
+
+
+def _page_url(request, **cursor):
+    query = request.query_params.copy()
+    for param in ('after', 'before'):
+        query.pop(param, None)
+    query.update(cursor)
+    return request.build_absolute_uri('?' + query.urlencode())
+
+
+@api_view(['GET'])
+def invoice_list(request):
+    """
+    Invoices newest first, ``limit`` (default INVOICE_API_PAGE_SIZE) per page, then the archived
+    ones. Follow ``next`` and ``previous``; they carry keyset cursors, so every page costs the
+    same however deep it is. Takes the invoice list's filters: date_from, date_to, state,
+    financial_year, pk, q.
+    """
+    fields = requested_fields(request)
+    invoices = Invoice.objects.all()
+    if fields is not None:
+        invoices = invoices.only(*_columns(fields, 'id', 'created_at'))
+
+    filter_form = InvoiceFilterForm(request.query_params)
+    if not filter_form.is_valid():
+        raise ValidationError(filter_form.errors)
+    invoices = filter_form.filter(invoices)
+
+    archived = filter_form.filter(ArchivedInvoice.objects.all())
+    after, before = request.query_params.get('after'), request.query_params.get('before')
+    in_archive = (after or '').startswith(ARCHIVE_CURSOR) or (before or '').startswith(ARCHIVE_CURSOR)
+    if in_archive and before != ARCHIVE_CURSOR:
+        return _archive_page(request, archived, invoices, after, before, fields)
+
+    paginator = KeysetPaginator(invoices, ordering=Invoice._meta.ordering, per_page=_page_size(request))
+    try:
+        if before == ARCHIVE_CURSOR:
+            page = paginator.page(last=True)
+        else:
+            page = paginator.page(after=after, before=before)
+    except InvalidCursor:
+        raise ValidationError({'cursor': ['Invalid cursor.']})
+    if not page.object_list and not (after or before):
+        # No invoice of an open year matches: start with the archive
+        return _archive_page(request, archived, invoices, None, None, fields)
+
+    if page.has_next():
+        next_url = _page_url(request, after=page.next_cursor)
+    else:
+        next_url = _page_url(request, after=ARCHIVE_CURSOR) if archived.exists() else None
+    return Response({
+        'next': next_url,
+        'previous': _page_url(request, before=page.previous_cursor) if page.has_previous() else None,
+        'results': InvoiceSerializer(page.object_list, many=True, fields=fields).data,
+    })
+
+
+def _archive_page(request, archived, invoices, after, before, fields):
+    """
+    A page of invoice_list() from the archive, for cursors that start with ARCHIVE_CURSOR.
+    """
+    paginator = KeysetPaginator(archived, ordering=ArchivedInvoice._meta.ordering, per_page=_page_size(request))
+    try:
+        page = paginator.page(after=(after or '')[len(ARCHIVE_CURSOR):], before=(before or '')[len(ARCHIVE_CURSOR):])
+    except InvalidCursor:
+        raise ValidationError({'cursor': ['Invalid cursor.']})
+
+    if page.has_previous():
+        previous_url = _page_url(request, before=ARCHIVE_CURSOR + page.previous_cursor)
+    else:
+        previous_url = _page_url(request, before=ARCHIVE_CURSOR) if invoices.exists() else None
+    return Response({
+        'next': _page_url(request, after=ARCHIVE_CURSOR + page.next_cursor) if page.has_next() else None,
+        'previous': previous_url,
+        'results': InvoiceSerializer(
+            [archive.to_invoice(row, check_images=False)[0] for row in page], many=True, fields=fields
+        ).data,
+    })
+
+
+@api_view(['GET'])
+def invoice_detail(request, pk):
+    fields = requested_fields(request)
+    invoices = Invoice.objects.all()
+    if fields is not None:
+        invoices = invoices.only(*_columns(fields, 'id'))
+    try:
+        invoice = invoices.get(pk=pk)
+    except Invoice.DoesNotExist:
+        invoice = archive.to_invoice(get_object_or_404(ArchivedInvoice, pk=pk), check_images=False)[0]
+    return Response(InvoiceSerializer(invoice, fields=fields).data)
+
+
+@api_view(['POST'])
+def invoice_batch_create(request):
+    """
+    Create invoices from a JSON array of objects keyed by the create form's field names
+    (signature and stamp by id or name; invoice_date optional). ``?dry_run=1`` only validates.
+    Answers 201 with the created invoices, or 400 with ``errors``: [{index, errors}].
+    """
+    items = request.data.get('invoices') if isinstance(request.data, dict) else request.data
+    if not isinstance(items, list) or not items:
+        raise ValidationError({'invoices': ['Send a non-empty JSON array of invoices.']})
+    max_batch = getattr(settings, 'INVOICE_API_MAX_BATCH', 1000)
+    if len(items) > max_batch:
+        raise ValidationError({'invoices': ['At most %d invoices per batch.' % max_batch]})
+    fields = requested_fields(request)
+    dry_run = request.query_params.get('dry_run') in ('1', 'true', 'yes')
+
+    errors = [
+        {'index': index, 'errors': {'non_field_errors': ['Expected an object.']}}
+        for index, item in enumerate(items) if not isinstance(item, dict)
+    ]
+    if errors:
+        return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    # One chunk, so one block of invoice numbers and a single INSERT
+    result = importers.import_invoices(enumerate(items), chunk_size=len(items), dry_run=dry_run, keep_created=True)
+    if result.errors:
+        return Response(
+            {'errors': [{'index': index, 'errors': errors} for index, errors in result.errors]},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if dry_run:
+        return Response({'valid': result.valid, 'created': 0})
+    return Response(
+        {'created': result.created, 'results': InvoiceSerializer(result.invoices, many=True, fields=fields).data},
+        status=status.HTTP_201_CREATED,
+    )
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class InvoicesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'invoices'
+
+    def ready(self):
+        from django.conf import settings
+
+        from . import checks, signals  # noqa: F401
+
+        # Workers that serve PDFs can load the renderer up front (e.g. in the gunicorn master
+        # with --preload, so forked workers share it) instead of on the first download
+        if getattr(settings, 'INVOICE_PDF_PRELOAD', False):
+            from .pdf import preload
+            preload()
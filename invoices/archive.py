@@ -0,0 +1,406 @@
+"""
+Archive packs for closed financial years.
+
+``manage.py close_financial_year`` renders every PDF of a finished financial year, appends them
+to one pack file per year in INVOICE_ARCHIVE_DIR and moves the invoices to ArchivedInvoice. The
+hot invoices table then only holds open years, and archived PDFs are never rendered again.
+The preview, the PDF download and the API detail fall back to the archive for ids that are no
+longer in the invoices table; the search, the ledger, the ZIP export, client statements and
+the API list read ArchivedInvoice alongside Invoice.
+
+Pack layout, only ever appended to::
+
+    b'INVPACK1'                      once, at the start of the file
+    <pdf><pdf>...                    the PDFs of one chunk of invoices, back to back
+    <index>                          JSON: [[id, invoice_number, offset, length, sha256], ...]
+    <footer>                         b'INVIDX01', then the offsets of the first PDF and of the
+                                     index and the index length (FOOTER, little-endian u64s)
+    <pdf><pdf>... <index> <footer>   the next chunk, and so on
+
+Readers use the offsets stored on ArchivedInvoice; the index segments make a pack
+self-describing, so verify() can check it (and the rows could be recovered) without the
+database. A chunk is only committed to the database after its footer is on disk; PDFs a
+crashed run wrote without a footer are cut off by the next run. The writer holds an exclusive
+flock on the pack for the whole close, so a second close of the same year fails at once
+instead of cutting off the first one's chunk in progress.
+
+Packs are read through a shared read-only mmap per file, so an archived PDF is never read into
+memory whole: PackSlice copies it out of the mapping one block at a time as the response is
+sent. That is still a copy per block; there is no sendfile path, as the WSGI file wrapper can
+only hand a whole file to sendfile, not a slice of one.
+"""
+import fcntl
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import threading
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import gst_summary
+from .bulk_pdf import iter_rendered_pdfs
+from .line_items import DISPLAY_FIELDS
+from .models import (
+    ArchivedInvoice, Invoice, InvoiceLineItem, Signature, Stamp, financial_year_bounds, financial_year_for,
+)
+from .pdf import PDFRenderError
+
+MAGIC = b'INVPACK1'
+INDEX_MAGIC = b'INVIDX01'
+FOOTER = struct.Struct('<8sQQQ')
+DEFAULT_CHUNK_SIZE = 500
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def get_archive_dir():
+    return str(getattr(settings, 'INVOICE_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archive')))
+
+
+def pack_name(financial_year):
+    return 'fy%d.pack' % financial_year
+
+
+def pack_path(name):
+    return os.path.join(get_archive_dir(), name)
+
+
+def _read_footer(f, end):
+    """
+    ``(start, index_offset, index_length)`` of the segment whose footer ends at ``end``, or None.
+    """
+    if end < len(MAGIC) + FOOTER.size:
+        return None
+    f.seek(end - FOOTER.size)
+    magic, start, offset, length = FOOTER.unpack(f.read(FOOTER.size))
+    if magic != INDEX_MAGIC or offset + length != end - FOOTER.size or not len(MAGIC) <= start <= offset:
+        return None
+    return start, offset, length
+
+
+def _committed_end(f):
+    """
+    Where the last complete segment of an open pack ends.
+    """
+    size = f.seek(0, io.SEEK_END)
+    if size <= len(MAGIC) or _read_footer(f, size):
+        return size
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        position = mapped.rfind(INDEX_MAGIC)
+        while position >= 0:
+            if _read_footer(f, position + FOOTER.size):
+                return position + FOOTER.size
+            position = mapped.rfind(INDEX_MAGIC, 0, position)
+    return len(MAGIC)
+
+
+class PackWriter:
+    """
+    Appends PDFs to a pack, holding an exclusive lock on it until close(). commit() writes the
+    index segment for the PDFs appended since the last one and syncs the file.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        os.makedirs(get_archive_dir(), exist_ok=True)
+        self.file = open(pack_path(name), 'a+b')
+        try:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.close()
+            raise ArchiveError('%s is being written by another process.' % name)
+        if self.file.seek(0, io.SEEK_END) == 0:
+            self.file.write(MAGIC)
+        else:
+            end = _committed_end(self.file)
+            if end != self.file.seek(0, io.SEEK_END):
+                self.file.truncate(end)
+        self.start = self.file.seek(0, io.SEEK_END)
+        self.entries = []
+
+    def append(self, pk, invoice_number, data):
+        """
+        Append one PDF; returns ``(offset, length, sha256)``.
+        """
+        offset = self.file.tell()
+        self.file.write(data)
+        entry = (offset, len(data), hashlib.sha256(data).hexdigest())
+        self.entries.append([pk, invoice_number, *entry])
+        return entry
+
+    def commit(self):
+        if self.entries:
+            index = json.dumps(self.entries, separators=(',', ':')).encode('utf-8')
+            offset = self.file.tell()
+            self.file.write(index)
+            self.file.write(FOOTER.pack(INDEX_MAGIC, self.start, offset, len(index)))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.start = self.file.tell()
+        self.entries = []
+
+    def close(self):
+        # Closing the file releases the lock
+        try:
+            self.commit()
+        finally:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_index(name):
+    """
+    Every ``[id, invoice_number, offset, length, sha256]`` entry of a pack, newest segment first.
+    """
+    with open(pack_path(name), 'rb') as f:
+        end = _committed_end(f)
+        while end > len(MAGIC):
+            footer = _read_footer(f, end)
+            if footer is None:
+                raise ArchiveError('%s: no index segment ends at byte %d' % (name, end))
+            start, offset, length = footer
+            f.seek(offset)
+            yield from json.loads(f.read(length))
+            end = start
+
+
+_maps = {}
+_maps_lock = threading.Lock()
+
+
+def _mapping(name, end):
+    """
+    A read-only mmap of the pack that covers at least ``end`` bytes, remapped after the pack
+    has grown.
+    """
+    with _maps_lock:
+        mapped = _maps.get(name)
+        if mapped is None or len(mapped) < end:
+            with open(pack_path(name), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(mapped) < end:
+                raise ArchiveError('%s is shorter than its index (%d < %d bytes)' % (name, len(mapped), end))
+            # Older maps are left to be closed by the garbage collector once no slice uses them
+            _maps[name] = mapped
+        return mapped
+
+
+class PackSlice(io.RawIOBase):
+    """
+    Read-only file over ``length`` bytes of a pack at ``offset``, backed by the shared mmap.
+    FileResponse streams it block by block, each block copied out of the mapping by readinto().
+    """
+
+    def __init__(self, name, offset, length):
+        super().__init__()
+        self._view = memoryview(_mapping(name, offset + length))[offset:offset + length]
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+def open_pdf(archived):
+    return PackSlice(archived.pack, archived.pack_offset, archived.pack_length)
+
+
+def _read_blocks(archived, block_size=64 * 1024):
+    with open_pdf(archived) as pdf:
+        while block := pdf.read(block_size):
+            yield block
+
+
+def iter_zip_members(archived):
+    """
+    ``(filename, chunks)`` pairs for stream_zip of the ArchivedInvoice rows ``archived``, read
+    from their packs a block at a time.
+    """
+    for invoice in archived:
+        yield '%s.pdf' % invoice.invoice_number, _read_blocks(invoice)
+
+
+# Fields of Invoice kept in ArchivedInvoice.data
+_INVOICE_FIELDS = Invoice._meta.concrete_fields
+
+
+def _archive_data(invoice, lines):
+    data = {field.attname: field.value_from_object(invoice) for field in _INVOICE_FIELDS}
+    data['line_items'] = lines
+    return data
+
+
+def to_invoice(archived, check_images=True):
+    """
+    ``(invoice, line_rows)``: an unsaved Invoice rebuilt from the archive and its line items as
+    display rows, for build_invoice_context(). ``check_images=False`` keeps the signature and
+    stamp ids as archived, without a query for each.
+    """
+    data = dict(archived.data)
+    lines = data.pop('line_items', [])
+    values = {}
+    for field in _INVOICE_FIELDS:
+        if field.attname in data:
+            values[field.attname] = field.to_python(data[field.attname])
+    invoice = Invoice(**values)
+    # The signature or stamp may have been deleted since; the invoice then shows none, like a
+    # live invoice would (on_delete=SET_NULL)
+    if check_images and invoice.signature_id and not Signature.objects.filter(pk=invoice.signature_id).exists():
+        invoice.signature_id = None
+    if check_images and invoice.stamp_id and not Stamp.objects.filter(pk=invoice.stamp_id).exists():
+        invoice.stamp_id = None
+    decimal_fields = {'quantity', 'rate', 'gst_rate', 'base_amount', 'cgst_amount', 'sgst_amount', 'igst_amount'}
+    line_rows = [
+        {key: Decimal(value) if key in decimal_fields else value for key, value in line.items()} for line in lines
+    ]
+    return invoice, line_rows
+
+
+def _line_rows(pks):
+    rows = {}
+    lines = InvoiceLineItem.objects.filter(invoice__in=pks).order_by('invoice', 'position', 'id')
+    for line in lines.values('invoice', *DISPLAY_FIELDS).iterator(chunk_size=2000):
+        rows.setdefault(line.pop('invoice'), []).append(line)
+    return rows
+
+
+def _archive_chunk(financial_year, writer, invoices, workers):
+    """
+    Render and pack one chunk of invoices, then move them to the archive table. Invoices edited
+    while they were rendering are left for the next run. Returns the number archived.
+    """
+    entries = {}
+    errors = []
+    try:
+        for pk, invoice_number, data, error in iter_rendered_pdfs([invoice.pk for invoice in invoices], workers):
+            if error:
+                errors.append('%s (id %s): %s' % (invoice_number or '-', pk, error))
+                continue
+            entries[pk] = writer.append(pk, invoice_number, data)
+    finally:
+        writer.commit()
+    if errors:
+        raise PDFRenderError('; '.join(errors))
+
+    with transaction.atomic():
+        rendered = {invoice.pk: invoice.updated_at for invoice in invoices}
+        current = Invoice.objects.select_for_update().filter(pk__in=list(rendered))
+        current = [invoice for invoice in current if invoice.updated_at == rendered[invoice.pk]]
+        lines = _line_rows([invoice.pk for invoice in current if invoice.line_item_count])
+        ArchivedInvoice.objects.bulk_create([
+            ArchivedInvoice(
+                id=invoice.pk,
+                invoice_number=invoice.invoice_number,
+                invoice_date=invoice.invoice_date,
+                financial_year=financial_year,
+                client_name=invoice.client_name,
+                state=invoice.state,
+                base_amount=invoice.base_amount,
+                cgst_amount=invoice.cgst_amount,
+                sgst_amount=invoice.sgst_amount,
+                igst_amount=invoice.igst_amount,
+                round_off=invoice.round_off,
+                total_amount=invoice.total_amount,
+                data=_archive_data(invoice, lines.get(invoice.pk, [])),
+                pack=writer.name,
+                pack_offset=entries[invoice.pk][0],
+                pack_length=entries[invoice.pk][1],
+                sha256=entries[invoice.pk][2],
+            )
+            for invoice in current
+        ])
+        # The totals stay in the GST summary: they now come from the archive table
+        with gst_summary.suspended():
+            Invoice.objects.filter(pk__in=[invoice.pk for invoice in current]).delete()
+    return len(current)
+
+
+def check_closable(financial_year):
+    if financial_year >= financial_year_for(timezone.now().date()):
+        raise ArchiveError('FY %d is not over yet.' % financial_year)
+
+
+def close_financial_year(financial_year, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """
+    Archive every invoice dated in ``financial_year``, ``chunk_size`` at a time; each chunk is
+    packed and committed on its own, so an interrupted run can simply be repeated. Returns the
+    number of invoices archived; raises ArchiveError while another close of the year is running.
+    """
+    check_closable(financial_year)
+    start, end = financial_year_bounds(financial_year)
+    invoices = Invoice.objects.filter(invoice_date__gte=start, invoice_date__lte=end).order_by('invoice_date', 'id')
+    archived = 0
+    last = None
+    with PackWriter(pack_name(financial_year)) as writer:
+        while True:
+            # Keyset over (invoice_date, id): invoices skipped because they changed are not retried
+            chunk = invoices if last is None else invoices.filter(
+                Q(invoice_date__gt=last.invoice_date) | Q(invoice_date=last.invoice_date, id__gt=last.id)
+            )
+            chunk = list(chunk.only('id', 'invoice_date', 'updated_at')[:chunk_size])
+            if not chunk:
+                return archived
+            archived += _archive_chunk(financial_year, writer, chunk, workers)
+            last = chunk[-1]
+            if progress:
+                progress(archived)
+
+
+def verify(financial_year):
+    """
+    Check the archived PDFs of ``financial_year`` against their checksums and the pack's own
+    index. Returns a list of problems.
+    """
+    problems = []
+    name = pack_name(financial_year)
+    try:
+        # An invoice can be in several segments (e.g. packed again after an interrupted run)
+        indexed = {(entry[0], *entry[2:]) for entry in read_index(name)}
+    except (OSError, ValueError, ArchiveError) as exc:
+        return ['%s: %s' % (name, exc)]
+    rows = ArchivedInvoice.objects.filter(financial_year=financial_year).only(
+        'invoice_number', 'pack', 'pack_offset', 'pack_length', 'sha256'
+    )
+    for archived in rows.iterator(chunk_size=2000):
+        if (archived.pk, archived.pack_offset, archived.pack_length, archived.sha256) not in indexed:
+            problems.append('%s: not in the index of %s' % (archived.invoice_number, name))
+            continue
+        with open_pdf(archived) as pdf:
+            if hashlib.sha256(pdf.read()).hexdigest() != archived.sha256:
+                problems.append('%s: checksum mismatch' % archived.invoice_number)
+    return problems
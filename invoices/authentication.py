@@ -0,0 +1,29 @@
+"""
+API authentication: the same login as the pages.
+
+Kept out of api.py because REST_FRAMEWORK settings name these classes, and DRF imports them
+while api.py itself is still importing rest_framework.
+"""
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.permissions import BasePermission
+
+
+class LoginSessionAuthentication(SessionAuthentication):
+    """
+    Accepts requests from a session logged in through login_view (which sets a session flag
+    instead of logging a Django user in) or from a staff user logged in to the admin, with the
+    same CSRF check as DRF's SessionAuthentication.
+    """
+
+    def authenticate(self, request):
+        session = request._request.session
+        user = getattr(request._request, 'user', None)
+        if not (session.get('is_authenticated') or (user is not None and user.is_staff)):
+            return None
+        self.enforce_csrf(request)
+        return (user, None)
+
+
+class HasLoginSession(BasePermission):
+    def has_permission(self, request, view):
+        return request.successful_authenticator is not None
@@ -0,0 +1,132 @@
+"""
+Helpers shared by the bench_* management commands and the tests.
+"""
+import contextlib
+import random
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+
+from .forms import INDIAN_STATES
+from .gst import apply_amounts, apply_amounts_batch
+from .models import Invoice, Signature, Stamp, financial_year_for, reserve_invoice_numbers
+from .signals import invoices_bulk_created
+
+SIGNATURE_IMAGES = ('signatures/suraj-sign.png', 'signatures/alka-sign.png')
+STAMP_IMAGE = 'stamps/slog-stamp_o5hUP1g.png'
+
+
+def sample_invoice(state='Uttarakhand', **kwargs):
+    """
+    Unsaved invoice with the model defaults and a signature/stamp from media/.
+    """
+    values = dict(
+        invoice_number='SLG-2025-07', invoice_date=date(2025, 6, 1), state=state,
+        total_amount=Decimal('11800'), cgst_rate=Decimal('9.00'), sgst_rate=Decimal('9.00'),
+        igst_rate=Decimal('18.00'), contract_no='GEMC-511687711779995', contract_date=date(2025, 5, 2),
+        include_stamp=True,
+    )
+    values.update(kwargs)
+    invoice = Invoice(**values)
+    for field in ('client_name', 'client_address', 'service_description', 'sac_code'):
+        setattr(invoice, field, Invoice._meta.get_field(field).get_default())
+    invoice.signature = Signature(name='Suraj', image='signatures/suraj-sign.png')
+    invoice.stamp = Stamp(name='Stamp', image='signatures/alka-sign.png')
+    return apply_amounts(invoice)
+
+
+@contextlib.contextmanager
+def throwaway_database(verbosity=0):
+    """
+    Run the block against a freshly migrated test database that is destroyed afterwards,
+    so benchmarks never touch real invoices.
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+def seed_invoices(count, rng=None, chunk_size=1000):
+    """
+    Bulk-insert ``count`` synthetic invoices spread over the last two years: about half billed
+    within Uttarakhand (CGST + SGST) and the rest to other states (IGST), with and without
+    signatures and stamps.
+    """
+    rng = rng or random.Random(0)
+    signatures = [
+        Signature.objects.get_or_create(name='Bench %d' % i, defaults={'image': image})[0]
+        for i, image in enumerate(SIGNATURE_IMAGES)
+    ]
+    stamp = Stamp.objects.get_or_create(name='Bench stamp', defaults={'image': STAMP_IMAGE})[0]
+    other_states = [value for value, _ in INDIAN_STATES if value != 'Uttarakhand']
+    today = date.today()
+
+    created = 0
+    while created < count:
+        by_year = defaultdict(list)
+        for _ in range(min(chunk_size, count - created)):
+            invoice_date = today - timedelta(days=rng.randrange(730))
+            with_stamp = rng.random() < 0.3
+            by_year[financial_year_for(invoice_date)].append(Invoice(
+                invoice_date=invoice_date,
+                client_name='TO: THE COMMANDING OFFICER, UNIT %d,' % rng.randrange(500),
+                contract_no='GEMC-%015d' % rng.randrange(10 ** 15),
+                contract_date=invoice_date - timedelta(days=rng.randrange(60)),
+                total_amount=Decimal(rng.randrange(5000, 5000000)),
+                state='Uttarakhand' if rng.random() < 0.5 else rng.choice(other_states),
+                cgst_rate=Decimal('9.00'), sgst_rate=Decimal('9.00'), igst_rate=Decimal('18.00'),
+                signature=rng.choice(signatures + [None]),
+                include_stamp=with_stamp,
+                stamp=stamp if with_stamp else None,
+            ))
+        with transaction.atomic():
+            for financial_year, invoices in by_year.items():
+                for invoice, number in zip(invoices, reserve_invoice_numbers(len(invoices), financial_year)):
+                    invoice.invoice_number = number
+                Invoice.objects.bulk_create(apply_amounts_batch(invoices))
+                invoices_bulk_created.send(sender=Invoice, instances=invoices)
+                created += len(invoices)
+    return created
+
+
+def percentile(sorted_values, p):
+    """
+    Linear-interpolated percentile (0-100) of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * p / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(latencies):
+    """
+    p50/p95/p99/mean latency in milliseconds and throughput for a list of durations in seconds.
+    """
+    values = sorted(latencies)
+    total = sum(values)
+    return {
+        'requests': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'mean_ms': round(total / len(values) * 1000, 3),
+        'throughput_per_s': round(len(values) / total, 2) if total else None,
+    }
+
+
+def time_calls(func, repeat):
+    latencies = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - started)
+    return latencies
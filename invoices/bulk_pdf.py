@@ -0,0 +1,225 @@
+"""
+Render many invoice PDFs in parallel across a process pool.
+
+xhtml2pdf is pure Python and CPU bound, so threads would serialise on the GIL; each worker
+process sets Django up once and then renders invoices by pk through the same cached pipeline
+as download_invoice_pdf. At most ``2 * workers`` renders of an export are in flight, so memory
+stays flat however many invoices are exported.
+
+Downloads (ZipExport) share one pool of INVOICE_PDF_WORKERS processes, started on the first
+export and kept for the life of the server process, and at most INVOICE_PDF_EXPORTS of them
+stream at once; beyond that ZipExport refuses with ExportBusy. The management command starts
+a pool of its own.
+"""
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from itertools import chain
+
+from django.conf import settings
+
+from .streaming import stream_zip
+
+# Nothing that touches the app registry may be imported at module level: spawned workers
+# unpickle render_invoice (and import this module) before _init_worker has set Django up.
+
+
+# Seconds a refused export is told to wait before asking again
+RETRY_AFTER = 30
+
+
+class ExportBusy(Exception):
+    """
+    INVOICE_PDF_EXPORTS exports are already streaming.
+    """
+
+
+def get_worker_count(workers=None):
+    if workers is None:
+        workers = getattr(settings, 'INVOICE_PDF_WORKERS', None) or os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def _new_pool(workers):
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+    )
+
+
+def _init_worker():
+    import django
+    from django.db import connections
+
+    django.setup()
+    connections.close_all()
+
+    from .pdf import preload
+
+    preload()
+
+
+def render_invoice(pk):
+    """
+    Render one invoice by pk; returns ``(pk, invoice_number, pdf_bytes, error)``.
+    Runs inside pool workers, so it only takes and returns picklable values.
+    """
+    from . import pdf_cache
+    from .models import Invoice
+    from .pdf import PDFRenderError
+
+    try:
+        invoice = Invoice.objects.select_related('signature', 'stamp').get(pk=pk)
+    except Invoice.DoesNotExist:
+        return pk, None, None, 'Invoice does not exist'
+    try:
+        return pk, invoice.invoice_number, pdf_cache.get_or_render(invoice), None
+    except PDFRenderError as exc:
+        return pk, invoice.invoice_number, None, str(exc)
+
+
+def prerender_invoice(pk):
+    """
+    Render one invoice into the PDF cache unless it is already there; returns ``(pk, error)``.
+    Used by the background job worker (pdf_jobs.py).
+    """
+    from . import pdf_cache
+    from .models import Invoice
+    from .pdf import render_invoice_pdf
+
+    try:
+        invoice = Invoice.objects.select_related('signature', 'stamp').get(pk=pk)
+    except Invoice.DoesNotExist:
+        # Deleted since it was queued; nothing to render
+        return pk, None
+    key = pdf_cache.invoice_cache_key(invoice)
+    try:
+        if not pdf_cache.exists(pk, key):
+            # Unlike get_or_render, a cache write error fails the job so it is retried
+            pdf_cache.put(pk, key, render_invoice_pdf(invoice))
+    except Exception as exc:
+        return pk, '%s: %s' % (type(exc).__name__, exc)
+    return pk, None
+
+
+def iter_rendered_pdfs(pks, workers=None, executor=None):
+    """
+    Yield ``render_invoice`` results for ``pks`` in order, rendered on ``executor`` (sized for
+    ``workers``) or, without one, on a pool started for this call and shut down at the end. With a single worker and no
+    executor everything is rendered in-process, which is also what tests and small exports use.
+    """
+    workers = get_worker_count(workers)
+    if executor is None and workers == 1:
+        for pk in pks:
+            yield render_invoice(pk)
+        return
+
+    window = workers * 2
+    own_pool = executor is None
+    if own_pool:
+        executor = _new_pool(workers)
+    pending = deque()
+    try:
+        for pk in pks:
+            pending.append(executor.submit(render_invoice, pk))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Also reached when the client disconnects mid-download: drop queued work
+        if own_pool:
+            executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            for future in pending:
+                future.cancel()
+
+
+def iter_zip_members(pks, workers=None, executor=None):
+    """
+    ``(filename, bytes)`` pairs for stream_zip; failed renders are listed in errors.txt.
+    """
+    errors = []
+    for pk, invoice_number, data, error in iter_rendered_pdfs(pks, workers, executor):
+        if error:
+            errors.append('%s (id %s): %s' % (invoice_number or '-', pk, error))
+            continue
+        yield '%s.pdf' % invoice_number, data
+    if errors:
+        yield 'errors.txt', ('\n'.join(errors) + '\n').encode('utf-8')
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_export_slots = None
+
+
+def get_shared_pool():
+    """
+    The process pool of this server process for export downloads, or None when
+    INVOICE_PDF_WORKERS is 1 (exports then render in the request's thread).
+    """
+    global _pool
+    workers = get_worker_count()
+    if workers == 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = _new_pool(workers)
+        return _pool
+
+
+def _discard_pool(pool):
+    # A worker process died (e.g. killed for memory); the next export starts a new pool
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+
+
+def _get_export_slots():
+    global _export_slots
+    with _pool_lock:
+        if _export_slots is None:
+            _export_slots = threading.BoundedSemaphore(max(getattr(settings, 'INVOICE_PDF_EXPORTS', 2), 1))
+        return _export_slots
+
+
+class ZipExport:
+    """
+    The ZIP of the invoices ``pks`` for a download: an iterator of chunks, rendered on the
+    shared pool. ``archived`` adds ``(filename, data)`` members that need no rendering, such
+    as archive.iter_zip_members(); they come first. Raises ExportBusy without waiting when INVOICE_PDF_EXPORTS exports are
+    already streaming. The slot is given back by close(), which the response calls when the
+    download ends, fails or is abandoned, whether or not it was started.
+    """
+
+    def __init__(self, pks, archived=()):
+        self._slots = _get_export_slots()
+        if not self._slots.acquire(blocking=False):
+            raise ExportBusy()
+        self._pool = get_shared_pool()
+        self._chunks = stream_zip(chain(archived, iter_zip_members(pks, executor=self._pool)))
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BrokenExecutor:
+            _discard_pool(self._pool)
+            raise
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._chunks.close()
+        finally:
+            self._slots.release()
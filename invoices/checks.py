@@ -0,0 +1,49 @@
+"""
+System checks for the invoices app.
+"""
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.checks import Error, Tags, Warning, register
+
+from .templatetags.invoice_extras import BOOTSTRAP_CSS, BOOTSTRAP_JS
+
+
+def _missing_bootstrap(level, check_id):
+    # Every page loads Bootstrap from static/ unless INVOICE_BOOTSTRAP_CDN is set; without the
+    # files the pages are unstyled and, with the manifest storage, fail to render
+    if getattr(settings, 'INVOICE_BOOTSTRAP_CDN', False):
+        return []
+    missing = [path for path in (BOOTSTRAP_CSS, BOOTSTRAP_JS) if finders.find(path) is None]
+    if not missing:
+        return []
+    return [level(
+        'Bootstrap is missing from the static files: %s.' % ', '.join(missing),
+        hint='Run `manage.py vendor_assets` and commit static/vendor/, or set INVOICE_BOOTSTRAP_CDN = True.',
+        id=check_id,
+    )]
+
+
+@register(Tags.staticfiles)
+def check_bootstrap_vendored(app_configs, **kwargs):
+    return _missing_bootstrap(Warning, 'invoices.W001')
+
+
+@register(Tags.staticfiles, deploy=True)
+def check_bootstrap_deployed(app_configs, **kwargs):
+    return _missing_bootstrap(Error, 'invoices.E001')
+
+
+@register(Tags.security, deploy=True)
+def check_session_cache_shared(app_configs, **kwargs):
+    if settings.SESSION_ENGINE != 'invoices.sessions':
+        return []
+    backend = settings.CACHES.get(getattr(settings, 'SESSION_CACHE_ALIAS', 'default'), {}).get('BACKEND', '')
+    if not backend.endswith('.LocMemCache'):
+        return []
+    return [Warning(
+        'invoices.sessions caches sessions per process, so a logged-out session stays valid in the '
+        'other workers for up to INVOICE_SESSION_CACHE_TIMEOUT seconds.',
+        hint='Point the sessions cache at a shared backend (INVOICE_SESSION_CACHE_BACKEND), or use '
+             'django.contrib.sessions.backends.db.',
+        id='invoices.W002',
+    )]
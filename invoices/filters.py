@@ -0,0 +1,24 @@
+from .models import financial_year_bounds
+from .search import search
+
+
+def filter_invoices(queryset, date_from=None, date_to=None, state=None, financial_year=None, pks=None, query=None):
+    """
+    Narrow an Invoice queryset by invoice date range, GST state, financial year, explicit pks
+    and/or a full-text search query (which also orders the result by relevance).
+    Shared by the bulk exports and the invoice list so every screen filters the same way.
+    """
+    if date_from:
+        queryset = queryset.filter(invoice_date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(invoice_date__lte=date_to)
+    if state:
+        queryset = queryset.filter(state=state)
+    if financial_year:
+        start, end = financial_year_bounds(int(financial_year))
+        queryset = queryset.filter(invoice_date__gte=start, invoice_date__lte=end)
+    if pks:
+        queryset = queryset.filter(pk__in=pks)
+    if query:
+        queryset = search(queryset, query)
+    return queryset
@@ -1,5 +1,8 @@
 from django import forms
-from .models import Invoice, Signature
+from django.utils import timezone
+from .filters import filter_invoices
+from .models import Invoice, InvoiceLineItem, Signature, financial_year_for
+from .statements import check_size, list_clients
 
 INDIAN_STATES = [
     ('Andhra Pradesh', 'Andhra Pradesh'),
@@ -102,3 +105,189 @@ class InvoiceForm(forms.ModelForm):
         labels = {
             'total_amount': 'Total Amount (Including GST)',
         }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Not needed when the invoice has line items; create_invoice checks for one or the other
+        self.fields['total_amount'].required = False
+
+
+class InvoiceLineItemForm(forms.ModelForm):
+    class Meta:
+        model = InvoiceLineItem
+        fields = ['description', 'sac_code', 'quantity', 'rate', 'gst_rate']
+        widgets = {
+            'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 1, 'placeholder': 'Batch / service'}),
+            'sac_code': forms.TextInput(attrs={'class': 'form-control'}),
+            'quantity': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
+            'rate': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01', 'placeholder': 'Excl. GST'}),
+            'gst_rate': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
+        }
+
+
+# Blank rows the user leaves untouched are skipped
+InvoiceLineItemFormSet = forms.formset_factory(InvoiceLineItemForm, extra=3)
+
+
+class InvoiceFilterForm(forms.Form):
+    date_from = forms.DateField(required=False, widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}))
+    date_to = forms.DateField(required=False, widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}))
+    state = forms.ChoiceField(
+        choices=[('', 'All states')] + INDIAN_STATES, required=False,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    financial_year = forms.IntegerField(
+        required=False, min_value=2000, max_value=2100,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'FY (e.g. 2025)'})
+    )
+    pk = forms.CharField(required=False, widget=forms.HiddenInput)
+    q = forms.CharField(
+        required=False, max_length=200,
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Search client, address, contract no, description'})
+    )
+
+    def clean_pk(self):
+        value = self.cleaned_data['pk']
+        if not value:
+            return []
+        try:
+            return [int(pk) for pk in value.split(',') if pk.strip()]
+        except ValueError:
+            raise forms.ValidationError('Invoice ids must be a comma separated list of numbers.')
+
+    def filter(self, queryset):
+        """
+        Apply the cleaned filters to ``queryset``; call only after is_valid().
+        """
+        data = self.cleaned_data
+        return filter_invoices(
+            queryset,
+            date_from=data.get('date_from'),
+            date_to=data.get('date_to'),
+            state=data.get('state'),
+            financial_year=data.get('financial_year'),
+            pks=data.get('pk'),
+            query=data.get('q'),
+        )
+
+
+class InvoiceImportForm(InvoiceForm):
+    """
+    Validates one spreadsheet row with the same rules as InvoiceForm.
+
+    Columns that are missing from the sheet fall back to the model defaults, an optional
+    ``invoice_date`` column is accepted, and signature/stamp may be given by id or name. They
+    are resolved against dicts preloaded once per import instead of one query per row.
+    """
+    invoice_date = forms.DateField(required=False)
+    signature = forms.CharField(required=False)
+    stamp = forms.CharField(required=False)
+
+    class Meta(InvoiceForm.Meta):
+        fields = InvoiceForm.Meta.fields + ['invoice_date']
+
+    def __init__(self, signatures, stamps, data=None, **kwargs):
+        super().__init__(**kwargs)
+        # Imported invoices are never itemised, so the total is always needed
+        self.fields['total_amount'].required = True
+        self._lookups = {'signature': signatures, 'stamp': stamps}
+        self._defaults = {}
+        for name in self.base_fields:
+            try:
+                model_field = Invoice._meta.get_field(name)
+            except Exception:
+                continue
+            if model_field.has_default():
+                self._defaults[name] = model_field.get_default()
+        if data is not None:
+            self.bind(data)
+
+    def bind(self, data):
+        """
+        Re-use this form for the next row. Constructing a form deep-copies every field and
+        widget, which costs far more than validating a row, so an import builds just one.
+        """
+        data = dict(data)
+        for name, default in self._defaults.items():
+            if data.get(name) in (None, ''):
+                data[name] = default
+        self.data = data
+        self.is_bound = True
+        self.instance = Invoice()
+        self._errors = None
+        self._bound_fields_cache = {}
+        return self
+
+    def _lookup(self, name):
+        value = self.cleaned_data.get(name)
+        if not value:
+            return None
+        value = str(value).strip()
+        obj = self._lookups[name].get(value) or self._lookups[name].get(value.lower())
+        if obj is None:
+            raise forms.ValidationError('Unknown %s "%s".' % (name, value))
+        return obj
+
+    def clean_signature(self):
+        return self._lookup('signature')
+
+    def clean_stamp(self):
+        return self._lookup('stamp')
+
+    def clean_invoice_date(self):
+        return self.cleaned_data.get('invoice_date') or timezone.now().date()
+
+
+class InvoiceImportUploadForm(forms.Form):
+    file = forms.FileField(
+        help_text='CSV or Excel (.xlsx) file with one invoice per row and the form field names as headers.',
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.xlsx'})
+    )
+    dry_run = forms.BooleanField(required=False, label='Only validate, do not create invoices')
+    skip_invalid = forms.BooleanField(required=False, label='Import valid rows even if some rows have errors')
+
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if not upload.name.lower().endswith(('.csv', '.xlsx')):
+            raise forms.ValidationError('Upload a .csv or .xlsx file.')
+        return upload
+
+
+class StatementForm(forms.Form):
+    client = forms.ChoiceField(widget=forms.Select(attrs={'class': 'form-control'}))
+    date_from = forms.DateField(widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}))
+    date_to = forms.DateField(widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}))
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Clients are (name, address) pairs; the choice value is statements.client_key()
+        self.clients = {key: (name, address) for key, name, address in list_clients()}
+        self.fields['client'].choices = [('', 'Select client')] + [
+            (key, '%s %s' % (name.strip(), ' '.join(address.split())[:80]))
+            for key, (name, address) in self.clients.items()
+        ]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from, date_to = cleaned_data.get('date_from'), cleaned_data.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            raise forms.ValidationError('The period must end after it starts.')
+        if cleaned_data.get('client'):
+            cleaned_data['client_name'], cleaned_data['client_address'] = self.clients[cleaned_data['client']]
+            if date_from and date_to and date_from <= date_to:
+                check_size(cleaned_data['client_name'], cleaned_data['client_address'], date_from, date_to)
+        return cleaned_data
+
+
+class GstReportForm(forms.Form):
+    financial_year = forms.IntegerField(
+        required=False, min_value=2000, max_value=2100,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'FY (e.g. 2025)'})
+    )
+    state = forms.ChoiceField(
+        choices=[('', 'All states')] + INDIAN_STATES, required=False,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+
+    def clean_financial_year(self):
+        return self.cleaned_data['financial_year'] or financial_year_for(timezone.now().date())
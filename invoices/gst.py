@@ -0,0 +1,124 @@
+"""
+GST arithmetic for invoices.
+
+The user enters the GST-inclusive total and everything else is derived from it, exactly as
+``Invoice.save`` always did; keeping it here lets the batch paths (imports, recomputes) run the
+same maths over many invoices without saving them one by one.
+
+Itemised invoices work the other way round: each line's taxable value and GST are computed from
+its quantity, rate and GST rate, and the invoice amounts are the sums over the lines.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+AMOUNT_FIELDS = ('base_amount', 'cgst_amount', 'sgst_amount', 'igst_amount', 'round_off', 'total_amount')
+LINE_AMOUNT_FIELDS = ('base_amount', 'cgst_amount', 'sgst_amount', 'igst_amount')
+PAISE = Decimal('0.01')
+
+
+def _decimal(value):
+    if value is None or value == '':
+        return Decimal(0)
+    if isinstance(value, Decimal):
+        return value
+    # str() first so floats such as the 9.00 model defaults do not drag in binary noise
+    return Decimal(str(value))
+
+
+def is_intra_state(state):
+    # Supplies within Uttarakhand (our registration) pay CGST + SGST, everything else IGST
+    return bool(state) and state.lower() == 'uttarakhand'
+
+
+def calculate_amounts(total_amount, state, cgst_rate, sgst_rate, igst_rate):
+    """
+    Split a GST-inclusive total into base, CGST/SGST or IGST and round-off.
+    Returns a dict keyed by AMOUNT_FIELDS; ``total_amount`` comes back rounded to whole rupees.
+    """
+    total_amount = _decimal(total_amount)
+    cgst_rate, sgst_rate, igst_rate = _decimal(cgst_rate), _decimal(sgst_rate), _decimal(igst_rate)
+
+    # Calculate base amount from total (reverse calculation)
+    # Total = Base + GST, so Base = Total / (1 + GST_Rate)
+    if is_intra_state(state):
+        # Total GST rate = CGST + SGST
+        total_gst_rate = cgst_rate + sgst_rate
+        base_amount = total_amount / (1 + (total_gst_rate / 100))
+        cgst_amount = (base_amount * cgst_rate) / 100
+        sgst_amount = (base_amount * sgst_rate) / 100
+        igst_amount = 0
+    else:
+        # IGST for other states
+        base_amount = total_amount / (1 + (igst_rate / 100))
+        cgst_amount = 0
+        sgst_amount = 0
+        igst_amount = (base_amount * igst_rate) / 100
+
+    # Round off calculation
+    subtotal = base_amount + cgst_amount + sgst_amount + igst_amount
+    rounded_total = round(subtotal)
+    return {
+        'base_amount': base_amount,
+        'cgst_amount': cgst_amount,
+        'sgst_amount': sgst_amount,
+        'igst_amount': igst_amount,
+        'round_off': rounded_total - subtotal,
+        'total_amount': rounded_total,
+    }
+
+
+def apply_amounts(invoice):
+    """
+    Set the derived amount fields on ``invoice`` in place (does not save).
+    """
+    amounts = calculate_amounts(
+        invoice.total_amount, invoice.state, invoice.cgst_rate, invoice.sgst_rate, invoice.igst_rate
+    )
+    for field, value in amounts.items():
+        setattr(invoice, field, value)
+    return invoice
+
+
+def apply_amounts_batch(invoices):
+    """
+    apply_amounts over a whole batch in a single pass; returns the list.
+    """
+    invoices = list(invoices)
+    for invoice in invoices:
+        apply_amounts(invoice)
+    return invoices
+
+
+def _paise(value):
+    return value.quantize(PAISE, rounding=ROUND_HALF_UP)
+
+
+def calculate_line_amounts(quantity, rate, gst_rate, state):
+    """
+    Taxable value (quantity x rate) and CGST/SGST or IGST of one invoice line, in paise.
+    Returns a dict keyed by LINE_AMOUNT_FIELDS.
+    """
+    base_amount = _paise(_decimal(quantity) * _decimal(rate))
+    gst_rate = _decimal(gst_rate)
+    if is_intra_state(state):
+        # Half the rate each for CGST and SGST
+        half = _paise(base_amount * gst_rate / 200)
+        return {'base_amount': base_amount, 'cgst_amount': half, 'sgst_amount': half, 'igst_amount': Decimal(0)}
+    return {
+        'base_amount': base_amount,
+        'cgst_amount': Decimal(0),
+        'sgst_amount': Decimal(0),
+        'igst_amount': _paise(base_amount * gst_rate / 100),
+    }
+
+
+def line_invoice_amounts(line_sums):
+    """
+    Invoice amounts from the sums of its lines' LINE_AMOUNT_FIELDS: the same dict as
+    calculate_amounts(), with the total rounded to whole rupees.
+    """
+    amounts = {field: line_sums.get(field, Decimal(0)) for field in LINE_AMOUNT_FIELDS}
+    subtotal = sum(amounts.values())
+    rounded_total = round(subtotal)
+    amounts['round_off'] = rounded_total - subtotal
+    amounts['total_amount'] = rounded_total
+    return amounts
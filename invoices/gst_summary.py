@@ -0,0 +1,234 @@
+"""
+Monthly GST totals per state, maintained incrementally.
+
+Every write to an invoice turns into a delta on the ``GstSummary`` row of its (month, state):
+a new invoice adds its amounts, a deleted one subtracts them, and an edit subtracts the old
+amounts and adds the new ones. The old amounts are those the instance was loaded with (see
+Invoice.from_db), so an edit costs no extra query; only instances loaded without them, or
+refreshed, have the row read back in pre_save. An invoice edited by someone else between
+loading and saving would leave the summary off by the other edit, which check() reports.
+The deltas are applied with F() updates in the same transaction as the write, so the summary
+follows the invoices and monthly or financial-year reports read a few dozen rows at most.
+Saves with ``update_fields`` that leave out every summed column are skipped.
+
+Amounts are summed as they appear on the invoices, rounded to two decimal places.
+``rebuild()`` recomputes the table from the invoices and ``check()`` reports any drift, e.g.
+after rows were changed with raw SQL or queryset.update(). Archived invoices (archive.py) still
+count: moving an invoice to the archive does not change the summary, and rebuild() and check()
+add up both tables.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.backends.utils import format_number
+from django.db.models import F
+
+from .gst import AMOUNT_FIELDS
+from .models import (
+    SUMMARY_FIELDS, ArchivedInvoice, GstSummary, Invoice, financial_year_bounds, financial_year_for,
+)
+
+VALUE_FIELDS = ('invoice_count',) + AMOUNT_FIELDS
+
+# Models whose rows the summary adds up
+SOURCES = (Invoice, ArchivedInvoice)
+
+_invoice_date = Invoice._meta.get_field('invoice_date')
+_local = threading.local()
+
+
+@contextmanager
+def suspended():
+    """
+    Ignore invoice saves and deletes in this thread while the block runs. For moves that keep
+    the totals, such as archiving: the deleted invoices stay in the summary.
+    """
+    previous = getattr(_local, 'suspended', False)
+    _local.suspended = True
+    try:
+        yield
+    finally:
+        _local.suspended = previous
+
+
+def is_suspended():
+    return getattr(_local, 'suspended', False)
+
+
+def month_of(invoice_date):
+    # An unsaved invoice may still hold the timezone.now() default, a datetime
+    return _invoice_date.to_python(invoice_date).replace(day=1)
+
+
+def stored_value(field, value):
+    # The amount as it reads back from the database and appears on the invoice, rounded to
+    # the field's decimal places; freshly saved instances still hold the unrounded results
+    # of calculate_amounts()
+    field = Invoice._meta.get_field(field)
+    return Decimal(format_number(Decimal(str(value or 0)), field.max_digits, field.decimal_places))
+
+
+def contribution(invoice):
+    """
+    ``((month, state), values)`` an invoice adds to the summary.
+    """
+    values = (1,) + tuple(stored_value(field, getattr(invoice, field)) for field in AMOUNT_FIELDS)
+    return (month_of(invoice.invoice_date), invoice.state), values
+
+
+def collect(invoices, sign=1):
+    """
+    Sum the contributions of ``invoices`` into a ``{(month, state): [values]}`` delta.
+    """
+    deltas = defaultdict(lambda: [0] * len(VALUE_FIELDS))
+    for invoice in invoices:
+        key, values = contribution(invoice)
+        totals = deltas[key]
+        for i, value in enumerate(values):
+            totals[i] += sign * value
+    return deltas
+
+
+def merge(*deltas):
+    merged = defaultdict(lambda: [0] * len(VALUE_FIELDS))
+    for delta in deltas:
+        for key, values in delta.items():
+            totals = merged[key]
+            for i, value in enumerate(values):
+                totals[i] += value
+    return merged
+
+
+def apply(deltas, using='default'):
+    """
+    Add ``deltas`` to the summary rows, creating rows for months/states seen for the first time.
+    """
+    for (month, state), values in deltas.items():
+        if not any(values):
+            continue
+        changes = {field: F(field) + value for field, value in zip(VALUE_FIELDS, values)}
+        rows = GstSummary.objects.using(using).filter(month=month, state=state)
+        if rows.update(**changes):
+            continue
+        try:
+            with transaction.atomic(using=using):
+                GstSummary.objects.using(using).create(
+                    month=month, state=state, financial_year=financial_year_for(month),
+                    **dict(zip(VALUE_FIELDS, values))
+                )
+        except IntegrityError:
+            # Another transaction created the row first
+            rows.update(**changes)
+
+
+def affects_summary(update_fields):
+    return update_fields is None or not set(update_fields).isdisjoint(SUMMARY_FIELDS)
+
+
+def remember_previous(invoice, using='default'):
+    """
+    Called before an invoice is saved: keep the stored version's contribution so the save
+    can be turned into a delta.
+    """
+    invoice._gst_previous = None
+    if invoice.pk is None:
+        return
+    stored = getattr(invoice, '_gst_stored', None)
+    if stored is not None and stored[0] == using:
+        invoice._gst_previous = Invoice(**stored[1])
+    else:
+        invoice._gst_previous = Invoice.objects.using(using).filter(pk=invoice.pk).only(*SUMMARY_FIELDS).first()
+
+
+def record_save(invoice, using='default', update_fields=None):
+    previous = getattr(invoice, '_gst_previous', None)
+    invoice._gst_previous = None
+    # After a full save the instance holds what is stored, so its next save reads nothing
+    invoice._gst_stored = None
+    if update_fields is None:
+        invoice._gst_stored = (using, {field: getattr(invoice, field) for field in SUMMARY_FIELDS})
+    if is_suspended():
+        return
+    delta = collect([invoice])
+    if previous is not None:
+        delta = merge(delta, collect([previous], sign=-1))
+    apply(delta, using=using)
+
+
+def record_delete(invoice, using='default'):
+    if is_suspended():
+        return
+    apply(collect([invoice], sign=-1), using=using)
+
+
+def _aggregate_invoices(using='default'):
+    # Summed here rather than with SUM(): the database may store more decimal places than the
+    # invoice shows (SQLite does), and the summary adds up the amounts as printed
+    totals = merge(*(
+        collect(model.objects.using(using).order_by().only(*SUMMARY_FIELDS).iterator(chunk_size=2000))
+        for model in SOURCES
+    ))
+    return {key: tuple(values) for key, values in totals.items()}
+
+
+def _stored(using='default'):
+    return {
+        (row['month'], row['state']): tuple(row[field] for field in VALUE_FIELDS)
+        for row in GstSummary.objects.using(using).values('month', 'state', *VALUE_FIELDS)
+        if row['invoice_count'] or any(row[field] for field in AMOUNT_FIELDS)
+    }
+
+
+def rebuild(using='default'):
+    """
+    Recompute the whole summary from the invoices and archived invoices; returns the number of
+    rows written.
+    """
+    totals = _aggregate_invoices(using)
+    with transaction.atomic(using=using):
+        GstSummary.objects.using(using).all().delete()
+        GstSummary.objects.using(using).bulk_create([
+            GstSummary(month=month, state=state, financial_year=financial_year_for(month), **dict(zip(VALUE_FIELDS, values)))
+            for (month, state), values in totals.items()
+        ])
+    return len(totals)
+
+
+def check(using='default'):
+    """
+    Compare the summary with a fresh aggregate of the invoices and archived invoices. Returns a list of
+    ``(month, state, field, stored, actual)`` for every value that differs.
+    """
+    actual, stored = _aggregate_invoices(using), _stored(using)
+    zero = (0,) * len(VALUE_FIELDS)
+    differences = []
+    for key in sorted(set(actual) | set(stored)):
+        for field, stored_value, actual_value in zip(VALUE_FIELDS, stored.get(key, zero), actual.get(key, zero)):
+            if stored_value != actual_value:
+                differences.append(key + (field, stored_value, actual_value))
+    return differences
+
+
+def report(financial_year, state=None):
+    """
+    The summary rows of ``financial_year`` grouped by month, with per-month and FY totals:
+    ``{'months': [{'month', 'rows', 'totals'}], 'totals'}``.
+    """
+    rows = GstSummary.objects.filter(financial_year=financial_year, invoice_count__gt=0)
+    if state:
+        rows = rows.filter(state=state)
+
+    months = []
+    totals = dict.fromkeys(VALUE_FIELDS, 0)
+    for row in rows.order_by('month', 'state'):
+        if not months or months[-1]['month'] != row.month:
+            months.append({'month': row.month, 'rows': [], 'totals': dict.fromkeys(VALUE_FIELDS, 0)})
+        months[-1]['rows'].append(row)
+        for field in VALUE_FIELDS:
+            months[-1]['totals'][field] += getattr(row, field)
+            totals[field] += getattr(row, field)
+    start, end = financial_year_bounds(financial_year)
+    return {'financial_year': financial_year, 'start': start, 'end': end, 'months': months, 'totals': totals}
@@ -0,0 +1,163 @@
+"""
+Signature and stamp images: content-addressed storage and downscaled variants.
+
+Uploads are stored under the SHA-256 of their bytes (``stamps/<hash>.png``), so uploading the
+same image twice keeps one file. The storage names each file from the content it is given, however
+it is saved (model form, ``image.save()``, the admin), and the model reads ``content_hash`` back
+from that name. Two variants are made from each image with Pillow when it is saved and written
+under ``variants/`` by a plain storage, since their names follow the original's hash:
+
+* ``print``: the size the image is printed at in the PDF, at INVOICE_IMAGE_PRINT_DPI;
+* ``web``: twice the size it is shown at on the invoice preview, for high-density screens.
+
+Both are reduced to a 256-colour palette (with transparency) and saved as optimised PNGs;
+a scanned stamp goes from about 1.4 MB to under 40 KB. The PDF backends and the preview use
+the variants and fall back to the original when one is missing (``manage.py image_variants``
+builds them for images uploaded before this existed).
+"""
+import hashlib
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+VARIANT_DIR = 'variants'
+VARIANT_KINDS = ('print', 'web')
+# CSS pixels per inch; the invoice stylesheet sizes images in px
+CSS_DPI = 96
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Media storage that names every file it saves after the SHA-256 of its content, keeping the
+    directory and extension it was given: ``stamps/scan.PNG`` becomes ``stamps/<hash>.png``. A
+    name that already exists holds the same bytes, so it is reused instead of being saved again.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        name = os.path.join(directory, content_hash(content) + (os.path.splitext(filename)[1].lower() or '.png'))
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+
+storage = ContentAddressedStorage()
+variant_storage = FileSystemStorage()
+_HASH_LENGTH = len(hashlib.sha256().hexdigest())
+
+
+def content_hash(file):
+    """
+    SHA-256 hex digest of an open file or FieldFile, read in chunks; the position is restored.
+    """
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks() if hasattr(file, 'chunks') else iter(lambda: file.read(65536), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def name_hash(name):
+    """
+    The content hash a stored name carries, or '' for files saved before content addressing.
+    """
+    stem = os.path.splitext(os.path.basename(name or ''))[0]
+    if len(stem) == _HASH_LENGTH and all(char in '0123456789abcdef' for char in stem):
+        return stem
+    return ''
+
+
+def upload_to(instance, filename):
+    """
+    ``<upload_dir>/<filename>``; the storage replaces the file name with the content hash.
+    """
+    return '%s/%s' % (instance.upload_dir, os.path.basename(filename))
+
+
+def get_print_dpi():
+    return getattr(settings, 'INVOICE_IMAGE_PRINT_DPI', 300)
+
+
+def variant_size(asset, kind):
+    """
+    ``(max width, max height)`` in pixels of an asset's ``kind`` variant.
+    """
+    width, height = asset.display_size
+    scale = get_print_dpi() / CSS_DPI if kind == 'print' else 2
+    return round(width * scale), round(height * scale)
+
+
+def variant_name(asset, kind):
+    return '%s/%s-%s.png' % (VARIANT_DIR, asset.content_hash, kind)
+
+
+def make_variant(file, size):
+    """
+    PNG bytes of the image in ``file`` scaled down to fit ``size`` and reduced to a palette.
+    """
+    from PIL import Image
+
+    file.seek(0)
+    with Image.open(file) as image:
+        image = image.convert('RGBA')
+    image.thumbnail(size, Image.Resampling.LANCZOS)
+    image = image.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+    output = io.BytesIO()
+    image.save(output, 'PNG', optimize=True)
+    return output.getvalue()
+
+
+def ensure_variants(asset, force=False):
+    """
+    Write the missing variants of ``asset`` (all of them with ``force``); returns the names
+    written. Variants are shared by every upload of the same image.
+    """
+    if not asset.image or not asset.content_hash:
+        return []
+    written = []
+    with asset.image.open('rb') as file:
+        for kind in VARIANT_KINDS:
+            name = variant_name(asset, kind)
+            if variant_storage.exists(name):
+                if not force:
+                    continue
+                variant_storage.delete(name)
+            variant_storage.save(name, ContentFile(make_variant(file, variant_size(asset, kind))))
+            written.append(name)
+    return written
+
+
+def variant_path(asset, kind):
+    """
+    Filesystem path of the image to use for ``kind``: the variant if it has been made,
+    otherwise the original. None without an image.
+    """
+    if not asset or not asset.image:
+        return None
+    if asset.content_hash:
+        path = variant_storage.path(variant_name(asset, kind))
+        if os.path.exists(path):
+            return path
+    return asset.image.path
+
+
+def variant_url(asset, kind):
+    """
+    Media URL of the image to use for ``kind``, like variant_path().
+    """
+    if not asset or not asset.image:
+        return None
+    if asset.content_hash:
+        name = variant_name(asset, kind)
+        if variant_storage.exists(name):
+            return variant_storage.url(name)
+    return asset.image.url
@@ -0,0 +1,135 @@
+"""
+Bulk invoice import from CSV or Excel.
+
+Rows are read one at a time (csv module / openpyxl read-only mode), validated with
+InvoiceImportForm, and collected into chunks. Each chunk gets a block of invoice numbers per
+financial year of its invoice dates and its GST amounts in one pass, then goes into the database with a single bulk_create. The whole
+import runs in one transaction, so by default a file with any invalid row creates nothing.
+"""
+import csv
+import io
+import os
+from datetime import datetime
+
+from django.db import transaction
+
+from .forms import InvoiceImportForm
+from .gst import apply_amounts_batch
+from .models import Invoice, Signature, Stamp, assign_invoice_numbers
+from .signals import invoices_bulk_created
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.valid = 0
+        self.errors = []  # [(row_number, {field: [messages]})]
+        self.dry_run = False
+        self.invoices = []  # the created invoices, when asked for with keep_created
+
+
+def iter_csv_rows(fileobj):
+    """
+    Yield ``(row_number, {header: value})`` from a CSV file opened in binary or text mode.
+    Row numbers match the spreadsheet, with the header on row 1.
+    """
+    if not isinstance(fileobj, io.TextIOBase):
+        fileobj = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(fileobj)
+    for row_number, row in enumerate(reader, start=2):
+        yield row_number, {(k or '').strip(): v for k, v in row.items()}
+
+
+def iter_xlsx_rows(fileobj):
+    """
+    Yield ``(row_number, {header: value})`` from the first sheet of an .xlsx workbook.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = [str(h).strip() if h is not None else '' for h in next(rows, ())]
+        for row_number, values in enumerate(rows, start=2):
+            if all(v in (None, '') for v in values):
+                continue
+            row = {}
+            for header, value in zip(headers, values):
+                if isinstance(value, datetime):
+                    value = value.date()
+                row[header] = '' if value is None else value
+            yield row_number, row
+    finally:
+        workbook.close()
+
+
+def iter_rows(fileobj, filename):
+    if os.path.splitext(filename)[1].lower() == '.xlsx':
+        return iter_xlsx_rows(fileobj)
+    return iter_csv_rows(fileobj)
+
+
+def _lookup_table(model):
+    table = {}
+    for obj in model.objects.all():
+        table[str(obj.pk)] = obj
+        table[obj.name.strip().lower()] = obj
+    return table
+
+
+def _insert_chunk(invoices):
+    assign_invoice_numbers(invoices)
+    apply_amounts_batch(invoices)
+    created = Invoice.objects.bulk_create(invoices)
+    invoices_bulk_created.send(sender=Invoice, instances=created)
+    return created
+
+
+def _record_created(result, created, keep_created):
+    result.created += len(created)
+    if keep_created:
+        result.invoices.extend(created)
+
+
+def import_invoices(rows, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False, skip_invalid=False, keep_created=False):
+    """
+    Validate and insert invoices from ``rows`` (as produced by iter_rows).
+
+    Nothing is written when ``dry_run`` is set, or when any row is invalid unless
+    ``skip_invalid`` is set. Returns an ImportResult with per-row errors, and with the created
+    invoices in ``invoices`` if ``keep_created`` is set.
+    """
+    result = ImportResult()
+    result.dry_run = dry_run
+    form = InvoiceImportForm(signatures=_lookup_table(Signature), stamps=_lookup_table(Stamp))
+
+    with transaction.atomic():
+        chunk = []
+        for row_number, data in rows:
+            result.rows += 1
+            if not form.bind(data).is_valid():
+                result.errors.append((row_number, {
+                    field: [error['message'] for error in errors]
+                    for field, errors in form.errors.get_json_data().items()
+                }))
+                continue
+            result.valid += 1
+            if dry_run or (result.errors and not skip_invalid):
+                # The import is going to be rolled back; only keep validating
+                chunk = []
+                continue
+            chunk.append(form.instance)
+            if len(chunk) >= chunk_size:
+                _record_created(result, _insert_chunk(chunk), keep_created)
+                chunk = []
+        if chunk and not dry_run and (skip_invalid or not result.errors):
+            _record_created(result, _insert_chunk(chunk), keep_created)
+
+        if result.errors and not skip_invalid:
+            transaction.set_rollback(True)
+            result.created = 0
+            result.invoices = []
+    return result
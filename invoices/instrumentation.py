@@ -0,0 +1,186 @@
+"""
+Per-request performance instrumentation.
+
+``ServerTimingMiddleware`` times every request, counts and times its database queries and
+collects the stages recorded with ``stage()`` (ORM lookups, template rendering, amount in
+words, asset loading, PDF rendering ...). The breakdown is returned in a ``Server-Timing``
+header, exported as Prometheus histograms on ``/metrics`` and logged for requests slower than
+INVOICE_SLOW_REQUEST_MS.
+
+Stages may nest (``pdf`` contains ``template`` for the xhtml2pdf backend), so their durations do
+not add up to the total.
+"""
+import contextlib
+import logging
+import os
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Histogram, generate_latest, REGISTRY
+from prometheus_client import multiprocess
+
+logger = logging.getLogger('invoices.performance')
+
+REQUEST_SECONDS = Histogram(
+    'invoice_request_duration_seconds', 'Request latency by view.', ['view', 'method'],
+)
+REQUEST_QUERIES = Histogram(
+    'invoice_request_queries', 'Database queries per request by view.', ['view'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500),
+)
+STAGE_SECONDS = Histogram(
+    'invoice_stage_duration_seconds', 'Time spent in each instrumented stage.', ['stage'],
+)
+
+_timings = ContextVar('invoice_request_timings', default=None)
+
+
+class RequestTimings:
+    """
+    Stage durations (seconds, accumulated per stage name) and query statistics of one request.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def __call__(self, execute, sql, params, many, context):
+        # Count and time every query of the request (see count_queries)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - started
+
+    def breakdown(self, total):
+        entries = [('db', self.query_seconds, '%d queries' % self.queries)]
+        entries += [(name, seconds, None) for name, seconds in self.stages.items()]
+        entries.append(('total', total, None))
+        return entries
+
+    def server_timing(self, total):
+        parts = []
+        for name, seconds, description in self.breakdown(total):
+            part = '%s;dur=%.1f' % (name, seconds * 1000)
+            if description:
+                part += ';desc="%s"' % description
+            parts.append(part)
+        return ', '.join(parts)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Time the enclosed block as ``name``. Outside a request (management commands, pool workers)
+    only the Prometheus histogram is updated.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.labels(name).observe(seconds)
+        timings = _timings.get()
+        if timings is not None:
+            timings.add(name, seconds)
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every database connection: adds the query to the timings of
+    the request being served in this context, if any. Wrapping the connections per request
+    would miss the queries of async views, which Django runs in another thread on that
+    thread's own connection; the context variable follows them there.
+    """
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+class ServerTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            # Under ASGI the whole chain stays on the event loop; a sync-only middleware here
+            # would push every request through Django's single sync thread
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        with self._collect(timings):
+            response = self.get_response(request)
+        return self._finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        with self._collect(timings):
+            response = await self.get_response(request)
+        return self._finish(request, response, timings)
+
+    @contextlib.contextmanager
+    def _collect(self, timings):
+        token = _timings.set(timings)
+        try:
+            yield
+        finally:
+            _timings.reset(token)
+
+    def _finish(self, request, response, timings):
+        # For streaming responses this covers the time to first byte only
+        total = timings.total()
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        REQUEST_SECONDS.labels(view, request.method).observe(total)
+        REQUEST_QUERIES.labels(view).observe(timings.queries)
+        response['Server-Timing'] = timings.server_timing(total)
+
+        threshold = getattr(settings, 'INVOICE_SLOW_REQUEST_MS', 1000)
+        if threshold is not None and total * 1000 >= threshold:
+            logger.warning(
+                'Slow request %s %s (%s): %.1f ms; %s', request.method, request.path, view, total * 1000,
+                ', '.join('%s=%.1fms' % (name, seconds * 1000) for name, seconds, _ in timings.breakdown(total)[:-1]),
+                extra={'view': view, 'duration_ms': total * 1000, 'queries': timings.queries},
+            )
+        return response
+
+
+def metrics(request):
+    """
+    Prometheus metrics of this process (or of all workers when PROMETHEUS_MULTIPROC_DIR is set),
+    for scrapers connecting from INVOICE_METRICS_ALLOWED_IPS.
+    """
+    allowed = getattr(settings, 'INVOICE_METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+    if request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
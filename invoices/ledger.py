@@ -0,0 +1,188 @@
+"""
+Invoice ledger export (CSV and XLSX) for auditors.
+
+Rows are read with ``values_list().iterator()`` in chunks and written out as they are read, so
+an export of any size starts downloading at once and the worker holds only one chunk of rows.
+The views pass the matching archived invoices of closed years (archive.py) too; both are read
+in (invoice_date, id) order and merged into one ledger.
+The XLSX file is written as raw SpreadsheetML through stream_zip(); openpyxl's write-only
+workbook would keep everything back until the final ``save()``.
+"""
+import csv
+import heapq
+import re
+from datetime import date
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from .models import ArchivedInvoice
+from .streaming import stream_zip
+
+# (header, field) in column order
+LEDGER_COLUMNS = (
+    ('Invoice No', 'invoice_number'),
+    ('Invoice Date', 'invoice_date'),
+    ('Client', 'client_name'),
+    ('Contract No', 'contract_no'),
+    ('State', 'state'),
+    ('Base Amount', 'base_amount'),
+    ('CGST', 'cgst_amount'),
+    ('SGST', 'sgst_amount'),
+    ('IGST', 'igst_amount'),
+    ('Round Off', 'round_off'),
+    ('Total', 'total_amount'),
+)
+CHUNK_SIZE = 2000
+
+
+def ledger_queryset(queryset):
+    fields = [field for _, field in LEDGER_COLUMNS]
+    if queryset.model is ArchivedInvoice:
+        # Archived invoices keep the columns they do not index in ``data``
+        columns = {field.name for field in ArchivedInvoice._meta.concrete_fields}
+        fields = [field if field in columns else 'data__' + field for field in fields]
+    # The id last, for merging; iter_ledger_rows drops it
+    return queryset.order_by('invoice_date', 'id').values_list(*fields, 'id')
+
+
+def iter_ledger_rows(*querysets):
+    rows = heapq.merge(
+        *(ledger_queryset(queryset).iterator(chunk_size=CHUNK_SIZE) for queryset in querysets),
+        key=lambda row: (row[1], row[-1]),
+    )
+    for row in rows:
+        # A zero round-off can come back as -0.00
+        yield [value + 0 if isinstance(value, Decimal) else value for value in row[:-1]]
+
+
+class Echo:
+    """
+    File-like object whose write() returns what it was given, so csv.writer produces the
+    encoded line for a StreamingHttpResponse instead of buffering it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def _csv_text(value):
+    # Keep spreadsheet apps from evaluating text cells such as "=HYPERLINK(...)" as formulas
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+
+def stream_csv(*querysets):
+    writer = csv.writer(Echo())
+    # UTF-8 BOM so Excel opens the rupee sign and Devanagari names correctly
+    yield '\ufeff' + writer.writerow([header for header, _ in LEDGER_COLUMNS])
+    for row in iter_ledger_rows(*querysets):
+        yield writer.writerow([
+            value.isoformat() if isinstance(value, date) else _csv_text(value if value is not None else '')
+            for value in row
+        ])
+
+
+# --- XLSX ---------------------------------------------------------------------------------
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+CONTENT_TYPES = XML_HEADER + (
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+ROOT_RELS = XML_HEADER + (
+    '<Relationships xmlns="%s">'
+    '<Relationship Id="rId1" Type="%s/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>' % (PKG_REL_NS, REL_NS)
+)
+WORKBOOK = XML_HEADER + (
+    '<workbook xmlns="%s" xmlns:r="%s">'
+    '<sheets><sheet name="Invoices" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>' % (MAIN_NS, REL_NS)
+)
+WORKBOOK_RELS = XML_HEADER + (
+    '<Relationships xmlns="%s">'
+    '<Relationship Id="rId1" Type="%s/worksheet" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="%s/styles" Target="styles.xml"/>'
+    '</Relationships>' % (PKG_REL_NS, REL_NS, REL_NS)
+)
+# Cell styles: 0 default, 1 date dd/mm/yyyy, 2 amount "#,##0.00" (built-in format 4), 3 bold header
+STYLE_DATE, STYLE_AMOUNT, STYLE_HEADER = 1, 2, 3
+STYLES = XML_HEADER + (
+    '<styleSheet xmlns="%s">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="dd/mm/yyyy"/></numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="4">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>' % MAIN_NS
+)
+
+# Characters XML 1.0 does not allow, even escaped
+_ILLEGAL_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_EXCEL_EPOCH = date(1899, 12, 30)
+
+
+def _text_cell(value, style=0):
+    text = escape(_ILLEGAL_XML.sub('', str(value)))
+    style_attr = ' s="%d"' % style if style else ''
+    return '<c t="inlineStr"%s><is><t xml:space="preserve">%s</t></is></c>' % (style_attr, text)
+
+
+def _cell(value):
+    if value is None or value == '':
+        return '<c/>'
+    if isinstance(value, date):
+        return '<c s="%d"><v>%d</v></c>' % (STYLE_DATE, (value - _EXCEL_EPOCH).days)
+    if isinstance(value, str):
+        return _text_cell(value)
+    return '<c s="%d"><v>%s</v></c>' % (STYLE_AMOUNT, value)
+
+
+def _iter_sheet(querysets):
+    parts = [
+        XML_HEADER,
+        '<worksheet xmlns="%s"><sheetViews><sheetView workbookViewId="0">'
+        '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>'
+        '<sheetData>' % MAIN_NS,
+        '<row>%s</row>' % ''.join(_text_cell(header, STYLE_HEADER) for header, _ in LEDGER_COLUMNS),
+    ]
+    for row in iter_ledger_rows(*querysets):
+        parts.append('<row>%s</row>' % ''.join(_cell(value) for value in row))
+        if len(parts) >= 500:
+            yield ''.join(parts).encode('utf-8')
+            parts = []
+    parts.append('</sheetData></worksheet>')
+    yield ''.join(parts).encode('utf-8')
+
+
+def stream_xlsx(*querysets):
+    return stream_zip([
+        ('[Content_Types].xml', CONTENT_TYPES.encode('utf-8')),
+        ('_rels/.rels', ROOT_RELS.encode('utf-8')),
+        ('xl/workbook.xml', WORKBOOK.encode('utf-8')),
+        ('xl/_rels/workbook.xml.rels', WORKBOOK_RELS.encode('utf-8')),
+        ('xl/styles.xml', STYLES.encode('utf-8')),
+        ('xl/worksheets/sheet1.xml', _iter_sheet(querysets)),
+    ])
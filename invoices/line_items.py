@@ -0,0 +1,114 @@
+"""
+Itemised invoices.
+
+An invoice can bill several lines (one per training batch, say) instead of a single
+GST-inclusive total. Each line's taxable value and GST are computed in Python in one pass over
+the lines and written with bulk_create / bulk_update in chunks of CHUNK_SIZE. The invoice
+stores the totals and ``line_item_count``, so the list, reports, GST summary, search and ledger
+never read the lines; only the preview and the PDF do.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+
+from .gst import LINE_AMOUNT_FIELDS, calculate_line_amounts, line_invoice_amounts
+from .models import InvoiceLineItem
+
+CHUNK_SIZE = 1000
+# Columns the preview and the PDF show, in order
+DISPLAY_FIELDS = ('position', 'description', 'sac_code', 'quantity', 'rate', 'gst_rate') + LINE_AMOUNT_FIELDS
+
+
+def apply_line_amounts(line, state):
+    """
+    Set the calculated amount fields of ``line`` in place; returns whether any of them changed.
+    """
+    amounts = calculate_line_amounts(line.quantity, line.rate, line.gst_rate, state)
+    changed = any(getattr(line, field) != value for field, value in amounts.items())
+    for field, value in amounts.items():
+        setattr(line, field, value)
+    return changed
+
+
+class _Totals:
+    def __init__(self):
+        self.count = 0
+        self.sums = dict.fromkeys(LINE_AMOUNT_FIELDS, Decimal(0))
+
+    def add(self, line):
+        self.count += 1
+        for field in LINE_AMOUNT_FIELDS:
+            self.sums[field] += getattr(line, field)
+
+    def store_on(self, invoice):
+        invoice.line_item_count = self.count
+        if not self.count:
+            # No lines (any more): Invoice.save() derives the amounts from total_amount again
+            return
+        for field, value in line_invoice_amounts(self.sums).items():
+            setattr(invoice, field, value)
+
+
+def replace_line_items(invoice, lines):
+    """
+    Make ``lines`` (unsaved InvoiceLineItem instances, or dicts of their fields) the lines of
+    ``invoice``, numbered in the order given, and save the invoice with their totals. Works for
+    new invoices too: the invoice is saved once, already carrying its totals.
+    """
+    lines = [line if isinstance(line, InvoiceLineItem) else InvoiceLineItem(**line) for line in lines]
+    totals = _Totals()
+    for position, line in enumerate(lines, 1):
+        line.position = position
+        apply_line_amounts(line, invoice.state)
+        totals.add(line)
+
+    with transaction.atomic():
+        totals.store_on(invoice)
+        invoice.save()
+        InvoiceLineItem.objects.filter(invoice=invoice).delete()
+        for line in lines:
+            line.invoice = invoice
+        InvoiceLineItem.objects.bulk_create(lines, batch_size=CHUNK_SIZE)
+    return lines
+
+
+def recalculate(invoice):
+    """
+    Recompute every line of a saved invoice, e.g. after its state changed or lines were edited
+    in the admin, and save the invoice with the new totals. Lines are read and updated
+    CHUNK_SIZE at a time; lines without a position are numbered after the existing ones.
+    """
+    totals = _Totals()
+    with transaction.atomic():
+        last_position = max(
+            invoice.line_items.order_by('-position').values_list('position', flat=True)[:1], default=0
+        )
+        last_id = 0
+        while True:
+            chunk = list(invoice.line_items.filter(id__gt=last_id).order_by('id')[:CHUNK_SIZE])
+            if not chunk:
+                break
+            changed = []
+            for line in chunk:
+                renumbered = not line.position
+                if renumbered:
+                    last_position += 1
+                    line.position = last_position
+                if apply_line_amounts(line, invoice.state) or renumbered:
+                    changed.append(line)
+                totals.add(line)
+            if changed:
+                InvoiceLineItem.objects.bulk_update(changed, ('position',) + LINE_AMOUNT_FIELDS)
+            last_id = chunk[-1].id
+
+        totals.store_on(invoice)
+        invoice.save()
+    return totals.count
+
+
+def display_rows(invoice):
+    """
+    The lines of ``invoice`` for the preview and the PDF: dicts of DISPLAY_FIELDS, fetched in
+    chunks rather than as model instances.
+    """
+    return invoice.line_items.order_by('position', 'id').values(*DISPLAY_FIELDS).iterator(chunk_size=CHUNK_SIZE)
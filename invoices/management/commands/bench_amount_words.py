@@ -0,0 +1,44 @@
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from invoices.amount_words import MAX_AMOUNT, number_in_words
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark invoices.amount_words against num2words(lang="en_IN").'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--amounts', type=int, default=2000, help='Distinct amounts per round.')
+        parser.add_argument('--rounds', type=int, default=5, help='Passes over the same amounts.')
+
+    def handle(self, *args, **options):
+        from num2words import num2words
+
+        rng = random.Random(0)
+        amounts = [rng.randrange(10 ** rng.randrange(1, 10)) for _ in range(options['amounts'])]
+        amounts = [n for n in amounts if n < MAX_AMOUNT]
+        calls = len(amounts) * options['rounds']
+
+        def run_num2words():
+            for n in amounts:
+                num2words(n, lang='en_IN').title()
+
+        def run_cold():
+            number_in_words.cache_clear()
+            for n in amounts:
+                number_in_words(n)
+
+        def run_warm():
+            for n in amounts:
+                number_in_words(n)
+
+        results = [
+            ('num2words', timeit.timeit(run_num2words, number=options['rounds'])),
+            ('amount_words (cold cache)', timeit.timeit(run_cold, number=options['rounds'])),
+            ('amount_words (memoized)', timeit.timeit(run_warm, number=options['rounds'])),
+        ]
+        baseline = results[0][1]
+        for name, seconds in results:
+            self.stdout.write('%-28s %8.2f us/call  %6.1fx' % (name, seconds / calls * 1e6, baseline / seconds))
@@ -0,0 +1,204 @@
+import json
+import platform
+import random
+import tempfile
+from datetime import date
+from decimal import Decimal
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from invoices import pdf_cache
+from invoices.benchmarking import seed_invoices, summarize, throwaway_database, time_calls
+from invoices.models import Invoice
+from invoices.pagination import encode_cursor
+from invoices.pdf import get_pdf_backend
+
+
+def parse_sizes(value):
+    try:
+        sizes = sorted({int(size) for size in value.split(',') if size.strip()})
+    except ValueError:
+        raise CommandError('--sizes must be a comma-separated list of integers.')
+    if not sizes or sizes[0] < 1:
+        raise CommandError('--sizes must be positive.')
+    return sizes
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway database with synthetic invoices and measure latency (p50/p95/p99), '
+        'throughput and queries per request of the main invoice pages at several data sizes. '
+        'Prints JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,10000', help='Comma-separated invoice counts to measure at.')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per scenario.')
+        parser.add_argument('--pdf-requests', type=int, default=5, help='Requests per uncached PDF scenario.')
+        parser.add_argument(
+            '--session-engines',
+            help='Comma-separated SESSION_ENGINE values to run every scenario under (default: the configured one), '
+                 'e.g. django.contrib.sessions.backends.db,invoices.sessions to compare queries per request.',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic data.')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        sizes = parse_sizes(options['sizes'])
+        self.rng = random.Random(options['seed'])
+        self.repeat = options['requests']
+        self.pdf_repeat = options['pdf_requests']
+        engines = [engine.strip() for engine in (options['session_engines'] or settings.SESSION_ENGINE).split(',')
+                   if engine.strip()]
+
+        report = {
+            'meta': {
+                'started_at': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'pdf_backend': get_pdf_backend().name,
+                'requests': self.repeat,
+                'pdf_requests': self.pdf_repeat,
+                'session_engines': engines,
+                'seed': options['seed'],
+            },
+            'results': [],
+        }
+
+        # DEBUG off so Django does not log every query, and the PDF cache in a scratch directory
+        with tempfile.TemporaryDirectory() as cache_dir, override_settings(
+            DEBUG=False, ALLOWED_HOSTS=['testserver'], INVOICE_PDF_CACHE_DIR=cache_dir
+        ), throwaway_database():
+            seeded = 0
+            for size in sizes:
+                seeded += seed_invoices(size - seeded, rng=self.rng)
+                self.pks = list(Invoice.objects.values_list('pk', flat=True))
+                # A page 90% of the way down the admin changelist
+                deep = Invoice.objects.order_by('-invoice_date', '-id').values_list('invoice_date', 'id')[len(self.pks) * 9 // 10]
+                self.deep_cursor = encode_cursor(list(deep))
+                for engine in engines:
+                    with override_settings(SESSION_ENGINE=engine):
+                        self.client = self.logged_in_client()
+                        self.admin_client = self.logged_in_admin_client()
+                        for scenario, func, repeat in self.scenarios():
+                            result = {'size': size, 'scenario': scenario, 'session_engine': engine}
+                            result.update(self.measure(func, repeat))
+                            report['results'].append(result)
+                            if options['verbosity'] > 1:
+                                self.stderr.write(
+                                    '%(size)7d %(scenario)-28s p50 %(p50_ms)9.2f ms  p95 %(p95_ms)9.2f ms  '
+                                    '%(queries)3d queries  %(session_engine)s' % result
+                                )
+                # Invoices created by the scenarios count towards the next size
+                seeded = Invoice.objects.count()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def scenarios(self):
+        return [
+            ('invoice_list', lambda i: self.get(reverse('invoice_list')), self.repeat),
+            ('invoice_list_filtered', lambda i: self.get(reverse('invoice_list') + '?state=Uttarakhand'), self.repeat),
+            ('invoice_preview', lambda i: self.get(reverse('invoice_preview', args=[self.random_pk()])), self.repeat),
+            ('download_invoice_pdf', self.download_uncached, self.pdf_repeat),
+            ('download_invoice_pdf_cached', lambda i: self.get(reverse('download_invoice_pdf', args=[self.pks[0]])), self.repeat),
+            ('create_invoice', self.create_invoice, self.repeat),
+            ('invoice_save', self.save_invoice, self.repeat),
+            ('admin_changelist', lambda i: self.get_admin(''), self.repeat),
+            ('admin_changelist_state', lambda i: self.get_admin('?state=Uttarakhand'), self.repeat),
+            ('admin_changelist_fy', lambda i: self.get_admin('?financial_year=2025'), self.repeat),
+            ('admin_changelist_deep', lambda i: self.get_admin('?after=' + self.deep_cursor), self.repeat),
+        ]
+
+    def logged_in_client(self):
+        client = Client()
+        session = client.session
+        session['is_authenticated'] = True
+        session.save()
+        # Signed-cookie sessions get a new key on every save
+        client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+        return client
+
+    def logged_in_admin_client(self):
+        user = User.objects.filter(username='bench-admin').first()
+        if user is None:
+            user = User.objects.create_superuser('bench-admin', '', None)
+        client = Client()
+        client.force_login(user)
+        return client
+
+    def measure(self, func, repeat):
+        # One untimed call warms caches and counts the queries a single request issues
+        with CaptureQueriesContext(connection) as queries:
+            func(-1)
+        query_count = len(queries)
+        result = summarize(time_calls(func, repeat))
+        result['queries'] = query_count
+        return result
+
+    def random_pk(self):
+        return self.rng.choice(self.pks)
+
+    def get(self, url, status=200):
+        response = self.client.get(url)
+        if response.status_code != status:
+            raise CommandError('GET %s returned %s' % (url, response.status_code))
+        if getattr(response, 'streaming', False):
+            b''.join(response.streaming_content)
+        return response
+
+    def get_admin(self, query):
+        url = reverse('admin:invoices_invoice_changelist') + query
+        response = self.admin_client.get(url)
+        if response.status_code != 200:
+            raise CommandError('GET %s returned %s' % (url, response.status_code))
+        return response
+
+    def download_uncached(self, i):
+        pk = self.random_pk()
+        pdf_cache.invalidate(pk)
+        return self.get(reverse('download_invoice_pdf', args=[pk]))
+
+    def create_invoice(self, i):
+        response = self.client.post(reverse('create_invoice'), {
+            'sac_code': '999293',
+            'client_name': 'TO: THE COMMANDING OFFICER,',
+            'client_address': '21 CGSR (A), BAIRAGARH, BHOPAL',
+            'contract_no': 'GEMC-%015d' % self.rng.randrange(10 ** 15),
+            'contract_date': '2025-05-02',
+            'service_description': 'Bench service',
+            'total_amount': str(self.rng.randrange(5000, 5000000)),
+            'state': self.rng.choice(['Uttarakhand', 'Madhya Pradesh']),
+            'cgst_rate': '9.00',
+            'sgst_rate': '9.00',
+            'igst_rate': '18.00',
+            # No line items
+            'lines-TOTAL_FORMS': '0',
+            'lines-INITIAL_FORMS': '0',
+        })
+        if response.status_code != 302:
+            raise CommandError('POST create_invoice returned %s' % response.status_code)
+        return response
+
+    def save_invoice(self, i):
+        invoice = Invoice(
+            contract_no='GEMC-%015d' % self.rng.randrange(10 ** 15),
+            contract_date=date(2025, 5, 2),
+            total_amount=Decimal(self.rng.randrange(5000, 5000000)),
+            state=self.rng.choice(['Uttarakhand', 'Madhya Pradesh']),
+        )
+        invoice.save()
+        return invoice
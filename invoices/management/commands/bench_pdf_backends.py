@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from invoices.pdf import get_pdf_backend
+from invoices.benchmarking import sample_invoice
+
+BACKENDS = ('invoices.pdf.XHTML2PDFBackend', 'invoices.pdf_reportlab.ReportLabBackend')
+
+
+class Command(BaseCommand):
+    help = 'Compare PDF render throughput of the xhtml2pdf and ReportLab backends.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--renders', type=int, default=20, help='Renders per backend.')
+        parser.add_argument('--with-stamp', action='store_true', help='Include the stamp image in the invoice.')
+
+    def handle(self, *args, **options):
+        invoice = sample_invoice(include_stamp=options['with_stamp'])
+        renders = options['renders']
+        results = []
+        for path in BACKENDS:
+            backend = get_pdf_backend(path)
+            size = len(backend.render(invoice))  # warm the asset bundle
+            started = time.perf_counter()
+            for _ in range(renders):
+                backend.render(invoice)
+            results.append((backend.name, (time.perf_counter() - started) / renders, size))
+
+        baseline = results[0][1]
+        for name, seconds, size in results:
+            self.stdout.write('%-10s %8.1f ms/render %7.1f renders/s %8d bytes  %5.1fx' % (
+                name, seconds * 1000, 1 / seconds, size, baseline / seconds
+            ))
@@ -0,0 +1,75 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter: what a gunicorn worker does on boot, then on its first request
+PROBE = '''
+import json, sys, time
+import psutil
+process = psutil.Process()
+started = time.perf_counter()
+import invoice_project.wsgi
+booted = time.perf_counter()
+wsgi_rss = process.memory_info().rss
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({
+    'import_ms': (booted - started) * 1000,
+    'urlconf_ms': (time.perf_counter() - booted) * 1000,
+    'wsgi_rss': wsgi_rss,
+    'rss': process.memory_info().rss,
+    'modules': sorted(name for name in %r if name in sys.modules),
+}))
+'''
+
+HEAVY_MODULES = ('xhtml2pdf', 'reportlab', 'PIL', 'openpyxl', 'num2words', 'pypdf', 'prometheus_client')
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the cold start of a worker: time to import invoice_project.wsgi and load the '
+        'URLconf, resident memory, and which heavy libraries got imported, with and without '
+        'INVOICE_PDF_PRELOAD.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per mode.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        results = {}
+        for mode, preload in (('lazy', 'False'), ('preload', 'True')):
+            samples = [self.probe(preload) for _ in range(options['runs'])]
+            results[mode] = {
+                'import_ms': round(statistics.median(s['import_ms'] for s in samples), 1),
+                'urlconf_ms': round(statistics.median(s['urlconf_ms'] for s in samples), 1),
+                'wsgi_rss_mb': round(statistics.median(s['wsgi_rss'] for s in samples) / 2 ** 20, 1),
+                'rss_mb': round(statistics.median(s['rss'] for s in samples) / 2 ** 20, 1),
+                'modules': samples[-1]['modules'],
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for mode, result in results.items():
+            self.stdout.write(
+                '%-8s import %7.1f ms  urlconf %6.1f ms  rss %6.1f MB (%6.1f MB after urlconf)  loaded: %s' % (
+                    mode, result['import_ms'], result['urlconf_ms'], result['wsgi_rss_mb'], result['rss_mb'],
+                    ', '.join(result['modules']) or '-',
+                )
+            )
+
+    def probe(self, preload):
+        env = dict(os.environ, INVOICE_PDF_PRELOAD=preload)
+        process = subprocess.run(
+            [sys.executable, '-c', PROBE % (HEAVY_MODULES,)],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if process.returncode:
+            raise CommandError('Worker probe failed:\n%s' % process.stderr)
+        return json.loads(process.stdout.strip().splitlines()[-1])
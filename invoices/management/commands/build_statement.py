@@ -0,0 +1,55 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices.bulk_pdf import get_worker_count
+from invoices.statements import build_statement, list_clients
+
+
+class Command(BaseCommand):
+    help = (
+        "Write one client's invoices for a period to a single PDF, after a summary cover page. "
+        'Cached PDFs are reused and the rest are rendered in parallel.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', nargs='?', help='Path of the PDF file to write.')
+        parser.add_argument(
+            '--client',
+            help='Client key (see --list-clients) or text found in exactly one client name/address.',
+        )
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, help='First invoice date (YYYY-MM-DD).')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat, help='Last invoice date (YYYY-MM-DD).')
+        parser.add_argument('--workers', type=int, help='Render processes (default: INVOICE_PDF_WORKERS).')
+        parser.add_argument('--list-clients', action='store_true', help='Print the clients and their keys, then exit.')
+
+    def handle(self, *args, **options):
+        clients = list_clients()
+        if options['list_clients']:
+            for key, name, address in clients:
+                self.stdout.write('%s  %s %s' % (key, name.strip(), ' '.join(address.split())))
+            return
+        if not (options['output'] and options['client'] and options['date_from'] and options['date_to']):
+            raise CommandError('output, --client, --from and --to are required.')
+
+        text = options['client'].strip().lower()
+        matches = [client for client in clients if client[0] == text]
+        if not matches:
+            matches = [client for client in clients if text in client[1].lower() or text in client[2].lower()]
+        if len(matches) != 1:
+            raise CommandError(
+                '--client matches %d clients; use a key from --list-clients.' % len(matches)
+            )
+        key, name, address = matches[0]
+
+        workers = get_worker_count(options['workers'])
+        with open(options['output'], 'wb') as f:
+            count, errors = build_statement(name, address, options['date_from'], options['date_to'], f, workers)
+        if not count:
+            raise CommandError('The client has no invoices in this period.')
+        if errors:
+            raise CommandError(
+                'Wrote %d invoice(s) to %s, %d of them as error pages:\n%s'
+                % (count, options['output'], len(errors), '\n'.join(errors))
+            )
+        self.stdout.write(self.style.SUCCESS('Wrote %d invoice(s) to %s' % (count, options['output'])))
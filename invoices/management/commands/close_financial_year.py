@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices import archive
+from invoices.bulk_pdf import get_worker_count
+from invoices.models import ArchivedInvoice, Invoice, financial_year_bounds
+from invoices.pdf import PDFRenderError
+
+
+class Command(BaseCommand):
+    help = (
+        "Close a finished financial year: render all of its invoice PDFs into the year's pack file "
+        'and move the invoices to the archive table. Previews and PDF downloads keep working.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('financial_year', type=int, help='Financial year, e.g. 2024 for 2024-25.')
+        parser.add_argument('--workers', type=int, help='Render processes (default: INVOICE_PDF_WORKERS).')
+        parser.add_argument('--chunk-size', type=int, default=archive.DEFAULT_CHUNK_SIZE,
+                            help='Invoices packed and committed together.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the invoices that would be archived.')
+        parser.add_argument('--verify', action='store_true',
+                            help="Check the year's archived PDFs against the pack index and their checksums.")
+
+    def handle(self, *args, **options):
+        financial_year = options['financial_year']
+        if options['verify']:
+            problems = archive.verify(financial_year)
+            for problem in problems:
+                self.stderr.write(problem)
+            if problems:
+                raise CommandError('%d problem(s) in the FY %d archive.' % (len(problems), financial_year))
+            count = ArchivedInvoice.objects.filter(financial_year=financial_year).count()
+            self.stdout.write(self.style.SUCCESS('%d archived invoice(s) verified' % count))
+            return
+
+        try:
+            archive.check_closable(financial_year)
+        except archive.ArchiveError as exc:
+            raise CommandError(str(exc))
+        start, end = financial_year_bounds(financial_year)
+        pending = Invoice.objects.filter(invoice_date__gte=start, invoice_date__lte=end).count()
+        if options['dry_run'] or not pending:
+            self.stdout.write('%d invoice(s) of FY %d to archive' % (pending, financial_year))
+            return
+
+        workers = get_worker_count(options['workers'])
+        self.stdout.write('Archiving %d invoice(s) with %d worker(s)...' % (pending, workers))
+        progress = None
+        if options['verbosity'] > 1:
+            progress = lambda done: self.stdout.write('  %d archived' % done)
+        try:
+            archived = archive.close_financial_year(
+                financial_year, workers=workers, chunk_size=options['chunk_size'], progress=progress
+            )
+        except (archive.ArchiveError, PDFRenderError) as exc:
+            raise CommandError(str(exc))
+        left = pending - archived
+        self.stdout.write(self.style.SUCCESS(
+            'Archived %d invoice(s) to %s' % (archived, archive.pack_path(archive.pack_name(financial_year)))
+        ))
+        if left > 0:
+            self.stdout.write('%d invoice(s) changed while archiving; run the command again.' % left)
@@ -0,0 +1,41 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices.bulk_pdf import get_worker_count, iter_zip_members
+from invoices.filters import filter_invoices
+from invoices.models import Invoice
+from invoices.streaming import stream_zip
+
+
+class Command(BaseCommand):
+    help = 'Render the PDFs of the selected invoices in parallel and write them to a ZIP file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the ZIP file to write.')
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, help='First invoice date (YYYY-MM-DD).')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat, help='Last invoice date (YYYY-MM-DD).')
+        parser.add_argument('--state', help='Only invoices billed to this state.')
+        parser.add_argument('--fy', dest='financial_year', type=int, help='Financial year, e.g. 2025 for 2025-26.')
+        parser.add_argument('--pk', dest='pks', type=int, action='append', help='Invoice id; may be repeated.')
+        parser.add_argument('--workers', type=int, help='Render processes (default: INVOICE_PDF_WORKERS).')
+
+    def handle(self, *args, **options):
+        queryset = filter_invoices(
+            Invoice.objects.all(),
+            date_from=options['date_from'],
+            date_to=options['date_to'],
+            state=options['state'],
+            financial_year=options['financial_year'],
+            pks=options['pks'],
+        )
+        pks = list(queryset.values_list('pk', flat=True))
+        if not pks:
+            raise CommandError('No invoices match the given filters.')
+
+        workers = get_worker_count(options['workers'])
+        self.stdout.write('Rendering %d invoice(s) with %d worker(s)...' % (len(pks), workers))
+        with open(options['output'], 'wb') as f:
+            for chunk in stream_zip(iter_zip_members(pks, workers)):
+                f.write(chunk)
+        self.stdout.write(self.style.SUCCESS('Wrote %s' % options['output']))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from invoices import gst_summary
+from invoices.models import financial_year_for
+
+
+class Command(BaseCommand):
+    help = 'Print the GST summary of a financial year, or rebuild/check the summary table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fy', type=int, help='Financial year to print (default: the current one).')
+        parser.add_argument('--state', help='Only this state.')
+        parser.add_argument('--rebuild', action='store_true', help='Recompute the summary table from the invoices.')
+        parser.add_argument('--check', action='store_true',
+                            help='Compare the summary table with the invoices; fails if they differ.')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            rows = gst_summary.rebuild()
+            self.stdout.write(self.style.SUCCESS('Rebuilt %d summary row(s)' % rows))
+        if options['check']:
+            differences = gst_summary.check()
+            for month, state, field, stored, actual in differences:
+                self.stderr.write('%s %s %s: summary %s, invoices %s' % (month.strftime('%Y-%m'), state, field, stored, actual))
+            if differences:
+                raise CommandError('GST summary differs from the invoices; run with --rebuild to fix it.')
+            self.stdout.write(self.style.SUCCESS('GST summary matches the invoices'))
+        if options['rebuild'] or options['check']:
+            return
+
+        report = gst_summary.report(options['fy'] or financial_year_for(timezone.now().date()), state=options['state'])
+        header = '%-8s %-24s %8s %14s %12s %12s %12s %9s %14s'
+        self.stdout.write(header % ('Month', 'State', 'Invoices', 'Base', 'CGST', 'SGST', 'IGST', 'Round', 'Total'))
+        line = '%-8s %-24s %8d %14.2f %12.2f %12.2f %12.2f %9.2f %14.2f'
+        for month in report['months']:
+            for row in month['rows']:
+                self.stdout.write(line % (
+                    row.month.strftime('%Y-%m'), row.state[:24], row.invoice_count, row.base_amount, row.cgst_amount,
+                    row.sgst_amount, row.igst_amount, row.round_off, row.total_amount,
+                ))
+        totals = report['totals']
+        self.stdout.write(line % (
+            'FY %d' % report['financial_year'], '', totals['invoice_count'], totals['base_amount'], totals['cgst_amount'],
+            totals['sgst_amount'], totals['igst_amount'], totals['round_off'], totals['total_amount'],
+        ))
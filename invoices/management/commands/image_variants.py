@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+
+from invoices import images
+from invoices.models import Signature, Stamp
+
+
+class Command(BaseCommand):
+    help = (
+        'Move signature and stamp images to their content-addressed names, dropping duplicate '
+        'files, and make their print and web variants.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild variants that already exist.')
+        parser.add_argument('--keep-originals', action='store_true',
+                            help='Keep the old files after moving images to their new names.')
+
+    def handle(self, *args, **options):
+        moved = processed = 0
+        old_names = set()
+        for model in (Signature, Stamp):
+            for asset in model.objects.exclude(image=''):
+                try:
+                    with asset.image.open('rb') as file:
+                        # Named after its content; an image already stored that way is left alone
+                        name = images.storage.save(asset.image.name, file)
+                except OSError as exc:
+                    self.stderr.write('%s "%s": %s' % (model._meta.verbose_name, asset, exc))
+                    continue
+                digest = images.name_hash(name)
+                if name != asset.image.name or digest != asset.content_hash:
+                    if name != asset.image.name:
+                        old_names.add(asset.image.name)
+                        moved += 1
+                    asset.image.name = name
+                    asset.content_hash = digest
+                    # post_save makes the variants and re-queues the invoices' PDFs
+                    asset.save(update_fields=['image', 'content_hash'])
+                images.ensure_variants(asset, force=options['force'])
+                processed += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write('  %s: %s' % (asset, ', '.join(
+                        '%s %d bytes' % (kind, images.variant_storage.size(images.variant_name(asset, kind)))
+                        for kind in images.VARIANT_KINDS
+                    )))
+
+        removed = 0
+        if not options['keep_originals']:
+            in_use = set(Signature.objects.values_list('image', flat=True)) | set(Stamp.objects.values_list('image', flat=True))
+            for name in old_names - in_use:
+                images.storage.delete(name)
+                removed += 1
+        self.stdout.write(self.style.SUCCESS(
+            '%d image(s) with variants, %d moved to content-addressed names, %d old file(s) removed'
+            % (processed, moved, removed)
+        ))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices.importers import DEFAULT_CHUNK_SIZE, import_invoices, iter_rows
+
+
+class Command(BaseCommand):
+    help = 'Create invoices in bulk from a CSV or Excel (.xlsx) file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or .xlsx file with one invoice per row.')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Rows per bulk insert.')
+        parser.add_argument('--dry-run', action='store_true', help='Validate only; create nothing.')
+        parser.add_argument('--skip-invalid', action='store_true', help='Import the valid rows even if some rows fail.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            with open(options['path'], 'rb') as f:
+                result = import_invoices(
+                    iter_rows(f, options['path']),
+                    chunk_size=options['chunk_size'],
+                    dry_run=options['dry_run'],
+                    skip_invalid=options['skip_invalid'],
+                )
+        except OSError as exc:
+            raise CommandError(exc)
+
+        for row_number, errors in result.errors:
+            for field, messages in errors.items():
+                self.stderr.write('Row %d: %s: %s' % (row_number, field, ' '.join(messages)))
+
+        elapsed = time.perf_counter() - started
+        summary = '%d row(s) read, %d valid, %d created in %.2fs' % (result.rows, result.valid, result.created, elapsed)
+        if result.errors and not result.created:
+            raise CommandError(summary + '; nothing was imported.')
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from invoices import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the invoice full-text search index from the invoices table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to rebuild.')
+
+    def handle(self, *args, **options):
+        kind = search.backend(connections[options['database']])
+        if kind == 'like':
+            self.stdout.write('This database has no full-text index; searches use icontains lookups.')
+            return
+        indexed = search.rebuild(options['database'])
+        if kind == 'postgres':
+            self.stdout.write(self.style.SUCCESS('Reindexed %s' % search.POSTGRES_INDEX))
+        else:
+            self.stdout.write(self.style.SUCCESS('Indexed %d invoice(s)' % indexed))
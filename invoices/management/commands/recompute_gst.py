@@ -0,0 +1,82 @@
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices import recompute
+from invoices.filters import filter_invoices
+from invoices.models import Invoice
+
+
+def _rate(value):
+    try:
+        rate = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(value)
+    if not rate.is_finite() or rate < 0 or rate >= 1000:
+        raise ValueError(value)
+    return rate
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalculate the GST amounts of the selected invoices, optionally after setting new GST '
+        'rates or a new state on them, and save only the invoices whose amounts change.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, help='First invoice date (YYYY-MM-DD).')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat, help='Last invoice date (YYYY-MM-DD).')
+        parser.add_argument('--state', help='Only invoices billed to this state.')
+        parser.add_argument('--fy', dest='financial_year', type=int, help='Financial year, e.g. 2025 for 2025-26.')
+        parser.add_argument('--pk', dest='pks', type=int, action='append', help='Invoice id; may be repeated.')
+        parser.add_argument('--set-cgst', dest='cgst_rate', type=_rate, help='New CGST rate in percent.')
+        parser.add_argument('--set-sgst', dest='sgst_rate', type=_rate, help='New SGST rate in percent.')
+        parser.add_argument('--set-igst', dest='igst_rate', type=_rate, help='New IGST rate in percent.')
+        parser.add_argument('--set-state', dest='new_state', help='New state to bill the invoices to.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would change.')
+        parser.add_argument('--chunk-size', type=int, default=recompute.DEFAULT_CHUNK_SIZE,
+                            help='Invoices read and updated together.')
+        parser.add_argument('--show', type=int, default=20,
+                            help='List the changes of this many invoices (default 20).')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+        queryset = filter_invoices(
+            Invoice.objects.all(),
+            date_from=options['date_from'],
+            date_to=options['date_to'],
+            state=options['state'],
+            financial_year=options['financial_year'],
+            pks=options['pks'],
+        )
+        updates = {field: options[field] for field in recompute.RATE_FIELDS if options[field] is not None}
+        if options['new_state']:
+            updates['state'] = options['new_state']
+
+        progress = None
+        if options['verbosity'] > 1:
+            progress = lambda result: self.stdout.write('  %d scanned, %d changed' % (result.scanned, result.changed))
+        result = recompute.recompute(
+            queryset, updates, dry_run=options['dry_run'], chunk_size=options['chunk_size'],
+            keep_changes=max(options['show'], 0), progress=progress,
+        )
+
+        for invoice_number, diff in result.changes:
+            self.stdout.write(invoice_number)
+            for field, (old, new) in diff.items():
+                self.stdout.write('  %s: %s -> %s' % (field, old, new))
+        if result.changed > len(result.changes):
+            self.stdout.write('... and %d more' % (result.changed - len(result.changes)))
+        if result.skipped:
+            self.stdout.write('%d itemised invoice(s) left alone; their amounts come from their lines.' % result.skipped)
+
+        summary = '%d invoice(s) scanned, %d %s' % (
+            result.scanned, result.changed, 'would change' if result.dry_run else 'updated',
+        )
+        if result.itemised:
+            summary += ', %d itemised invoice(s) %s from their lines' % (
+                result.itemised, 'would be recalculated' if result.dry_run else 'recalculated',
+            )
+        self.stdout.write(self.style.SUCCESS(summary))
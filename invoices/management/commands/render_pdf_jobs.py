@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from invoices import pdf_jobs
+from invoices.models import Invoice
+
+
+class Command(BaseCommand):
+    help = 'Render queued invoice PDFs into the PDF cache in the background.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Render processes (default: INVOICE_PDF_WORKERS).')
+        parser.add_argument('--batch-size', type=int, help='Jobs claimed at a time (default: 4 per worker).')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty instead of polling.')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between polls of an empty queue.')
+        parser.add_argument('--enqueue-missing', action='store_true',
+                            help='First queue every invoice that has no render job yet (e.g. after upgrading).')
+
+    def handle(self, *args, **options):
+        if options['enqueue_missing']:
+            pks = list(Invoice.objects.filter(pdf_job__isnull=True).values_list('pk', flat=True))
+            pdf_jobs.enqueue(pks)
+            self.stdout.write('Queued %d invoice(s)' % len(pks))
+
+        processed = pdf_jobs.run(
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            once=options['once'],
+            poll_interval=options['poll_interval'],
+            stdout=self.stdout if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS('Processed %d PDF job(s)' % processed))
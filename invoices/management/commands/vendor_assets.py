@@ -0,0 +1,71 @@
+import base64
+import hashlib
+import os
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices.templatetags.invoice_extras import (
+    BOOTSTRAP_CDN, BOOTSTRAP_CSS, BOOTSTRAP_CSS_INTEGRITY, BOOTSTRAP_JS, BOOTSTRAP_JS_INTEGRITY,
+)
+
+# (path under the source, path under static/, Subresource Integrity hash published by Bootstrap)
+ASSETS = (
+    ('css/bootstrap.min.css', BOOTSTRAP_CSS, BOOTSTRAP_CSS_INTEGRITY),
+    ('js/bootstrap.bundle.min.js', BOOTSTRAP_JS, BOOTSTRAP_JS_INTEGRITY),
+    # The files end with a sourceMappingURL comment, which the manifest storage follows
+    ('css/bootstrap.min.css.map', BOOTSTRAP_CSS + '.map', None),
+    ('js/bootstrap.bundle.min.js.map', BOOTSTRAP_JS + '.map', None),
+)
+
+
+def integrity(data):
+    return 'sha384-' + base64.b64encode(hashlib.sha384(data).digest()).decode('ascii')
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy Bootstrap 5.1.3 into static/vendor/, where the pages load it from. The files are '
+        'checked against the published integrity hashes; commit them afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source', default=BOOTSTRAP_CDN,
+            help='Base URL, or a local copy of the dist/ directory for machines without internet access.',
+        )
+        parser.add_argument('--check', action='store_true', help='Only verify the files already in static/.')
+
+    def handle(self, *args, **options):
+        static_dir = os.path.join(settings.BASE_DIR, 'static')
+        for source_path, static_path, expected in ASSETS:
+            target = os.path.join(static_dir, static_path)
+            if options['check']:
+                if not os.path.exists(target):
+                    raise CommandError('%s is missing; run vendor_assets' % static_path)
+                with open(target, 'rb') as f:
+                    data = f.read()
+            else:
+                data = self.fetch(options['source'], source_path)
+            if expected and integrity(data) != expected:
+                raise CommandError('%s does not match its published hash %s' % (source_path, expected))
+            if not options['check']:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, 'wb') as f:
+                    f.write(data)
+            self.stdout.write('%s  %s (%d bytes)' % ('ok' if expected else '--', static_path, len(data)))
+        self.stdout.write(self.style.SUCCESS('Bootstrap is vendored under static/vendor/'))
+
+    def fetch(self, source, path):
+        if source.startswith(('http://', 'https://')):
+            try:
+                with urllib.request.urlopen(source.rstrip('/') + '/' + path, timeout=30) as response:
+                    return response.read()
+            except OSError as exc:
+                raise CommandError('Could not download %s: %s' % (path, exc))
+        try:
+            with open(os.path.join(source, path), 'rb') as f:
+                return f.read()
+        except OSError as exc:
+            raise CommandError('Could not read %s: %s' % (path, exc))
@@ -0,0 +1,40 @@
+"""
+Static file serving that works on both sides of Django's handler.
+
+WhiteNoiseMiddleware is sync-only, so under ASGI Django runs it, and every middleware below
+it, in the single thread it keeps for sync code: requests would queue behind each other there
+no matter how the views are written. This subclass is also async-capable. Static files are
+looked up in memory on the event loop and read in worker threads. Every other request goes
+straight on to the rest of the chain.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .streaming import stream_file_response
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is None:
+            return await self.get_response(request)
+
+        response = await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return stream_file_response(request, response)
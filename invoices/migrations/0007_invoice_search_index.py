@@ -0,0 +1,59 @@
+from django.db import migrations
+
+# The index as of this migration. Written out here rather than taken from invoices/search.py,
+# so later changes to the search code cannot break migrating a database from scratch.
+FTS_TABLE = 'invoices_invoice_fts'
+POSTGRES_INDEX = 'invoice_search_idx'
+SEARCH_FIELDS = ('invoice_number', 'client_name', 'client_address', 'contract_no', 'service_description')
+
+
+def _postgres_search_vector():
+    from django.contrib.postgres.search import SearchVector
+
+    return (
+        SearchVector('invoice_number', 'contract_no', weight='A', config='simple')
+        + SearchVector('client_name', weight='B', config='simple')
+        + SearchVector('client_address', weight='C', config='simple')
+        + SearchVector('service_description', weight='D', config='simple')
+    )
+
+
+def create_search_index(apps, schema_editor):
+    Invoice = apps.get_model('invoices', 'Invoice')
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, tokenize='unicode61 remove_diacritics 2', "
+                "prefix='2 3')" % (FTS_TABLE, ', '.join(SEARCH_FIELDS))
+            )
+        except Exception:
+            # SQLite built without FTS5: search falls back to icontains lookups
+            return
+        schema_editor.execute('INSERT INTO %s (rowid, %s) SELECT id, %s FROM %s' % (
+            FTS_TABLE, ', '.join(SEARCH_FIELDS),
+            ', '.join("COALESCE(%s, '')" % field for field in SEARCH_FIELDS), Invoice._meta.db_table,
+        ))
+    elif connection.vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+
+        schema_editor.add_index(Invoice, GinIndex(_postgres_search_vector(), name=POSTGRES_INDEX))
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % POSTGRES_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0006_pdf_render_jobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
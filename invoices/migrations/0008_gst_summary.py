@@ -0,0 +1,70 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:35
+
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from django.db import migrations, models
+
+
+# The amounts summarized as of this migration. Written out here rather than taken from
+# invoices/gst_summary.py, so later changes to that module cannot break migrating from scratch.
+AMOUNT_FIELDS = ('base_amount', 'cgst_amount', 'sgst_amount', 'igst_amount', 'round_off', 'total_amount')
+
+
+def summarize_existing_invoices(apps, schema_editor):
+    Invoice = apps.get_model('invoices', 'Invoice')
+    GstSummary = apps.get_model('invoices', 'GstSummary')
+    using = schema_editor.connection.alias
+
+    # Summed in Python rather than with SUM(): the database may store more decimal places than
+    # the invoice shows (SQLite does), and the summary adds up the amounts as printed
+    places = {field: Decimal(1).scaleb(-Invoice._meta.get_field(field).decimal_places) for field in AMOUNT_FIELDS}
+    totals = {}
+    rows = Invoice.objects.using(using).order_by().values_list('invoice_date', 'state', *AMOUNT_FIELDS)
+    for invoice_date, state, *amounts in rows.iterator(chunk_size=2000):
+        key = (invoice_date.replace(day=1), state)
+        values = totals.setdefault(key, [0] + [Decimal(0)] * len(AMOUNT_FIELDS))
+        values[0] += 1
+        for i, (field, amount) in enumerate(zip(AMOUNT_FIELDS, amounts), start=1):
+            values[i] += Decimal(str(amount or 0)).quantize(places[field], rounding=ROUND_HALF_EVEN)
+
+    GstSummary.objects.using(using).bulk_create([
+        GstSummary(
+            month=month, state=state,
+            # Indian financial years run from April to March
+            financial_year=month.year if month.month >= 4 else month.year - 1,
+            invoice_count=values[0], **dict(zip(AMOUNT_FIELDS, values[1:]))
+        )
+        for (month, state), values in totals.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0007_invoice_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GstSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('financial_year', models.PositiveIntegerField()),
+                ('state', models.CharField(max_length=100)),
+                ('invoice_count', models.IntegerField(default=0)),
+                ('base_amount', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('cgst_amount', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('sgst_amount', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('igst_amount', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('round_off', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+            ],
+            options={
+                'ordering': ['month', 'state'],
+                'indexes': [models.Index(fields=['financial_year', 'state'], name='gst_summary_fy_state_idx')],
+                'constraints': [models.UniqueConstraint(fields=('month', 'state'), name='gst_summary_month_state_uniq')],
+            },
+        ),
+        migrations.RunPython(summarize_existing_invoices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0008_gst_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='line_item_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='InvoiceLineItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(default=0)),
+                ('description', models.TextField()),
+                ('sac_code', models.CharField(default='999293', max_length=10)),
+                ('quantity', models.DecimalField(decimal_places=2, default=1, max_digits=12)),
+                ('rate', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('gst_rate', models.DecimalField(decimal_places=2, default=18.0, max_digits=5)),
+                ('base_amount', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12)),
+                ('cgst_amount', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12)),
+                ('sgst_amount', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12)),
+                ('igst_amount', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='line_items', to='invoices.invoice')),
+            ],
+            options={
+                'ordering': ['position', 'id'],
+                'indexes': [models.Index(fields=['invoice', 'position'], name='line_item_invoice_pos_idx')],
+            },
+        ),
+    ]
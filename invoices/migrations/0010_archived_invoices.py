@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:11
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0009_invoice_line_items'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedInvoice',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('invoice_number', models.CharField(max_length=50, unique=True)),
+                ('invoice_date', models.DateField()),
+                ('financial_year', models.PositiveIntegerField()),
+                ('client_name', models.TextField()),
+                ('state', models.CharField(max_length=100)),
+                ('base_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('cgst_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('sgst_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('igst_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('round_off', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('pack', models.CharField(max_length=100)),
+                ('pack_offset', models.BigIntegerField()),
+                ('pack_length', models.PositiveIntegerField()),
+                ('sha256', models.CharField(max_length=64)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-invoice_date', '-id'],
+                'indexes': [models.Index(fields=['financial_year', 'invoice_date'], name='archived_fy_date_idx')],
+            },
+        ),
+    ]
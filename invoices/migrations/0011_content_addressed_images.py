@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:37
+
+import invoices.images
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0010_archived_invoices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='signature',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='stamp',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='signature',
+            name='image',
+            field=models.ImageField(storage=invoices.images.ContentAddressedStorage(), upload_to=invoices.images.upload_to),
+        ),
+        migrations.AlterField(
+            model_name='stamp',
+            name='image',
+            field=models.ImageField(storage=invoices.images.ContentAddressedStorage(), upload_to=invoices.images.upload_to),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0011_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='invoice',
+            name='invoice_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='invoice',
+            name='invoice_state_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['-invoice_date', '-id'], name='invoice_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['state', '-invoice_date', '-id'], name='invoice_state_date_id_idx'),
+        ),
+    ]
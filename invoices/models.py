@@ -1,24 +1,177 @@
-from django.db import models
-from django.utils import timezone
+from collections import defaultdict
 from datetime import datetime
 
-class Signature(models.Model):
-    name = models.CharField(max_length=100)
-    image = models.ImageField(upload_to='signatures/')
-    created_at = models.DateTimeField(auto_now_add=True)
-    
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import images
+from .gst import AMOUNT_FIELDS, apply_amounts
+
+
+# The invoice columns the GST summary adds up (gst_summary.py)
+SUMMARY_FIELDS = ('invoice_date', 'state') + AMOUNT_FIELDS
+
+
+def financial_year_for(date):
+    """
+    Indian financial years run April to March; FY 2025 is 1 Apr 2025 - 31 Mar 2026.
+    """
+    return date.year if date.month >= 4 else date.year - 1
+
+
+def financial_year_bounds(financial_year):
+    return datetime(financial_year, 4, 1).date(), datetime(financial_year + 1, 3, 31).date()
+
+def format_invoice_number(financial_year, number):
+    return f"SLG-{financial_year}-{number:02d}"
+
+
+def reserve_invoice_numbers(count=1, financial_year=None):
+    """
+    Reserve ``count`` consecutive invoice numbers in ``financial_year`` (default: the current one)
+    and return them formatted. Call inside the transaction that saves the invoices, so a failed
+    save gives the numbers back.
+    """
+    if financial_year is None:
+        financial_year = financial_year_for(timezone.now().date())
+    first = InvoiceNumberSequence.reserve(financial_year, count)
+    return [format_invoice_number(financial_year, n) for n in range(first, first + count)]
+
+
+def assign_invoice_numbers(invoices):
+    """
+    Number unsaved ``invoices`` in the financial years of their invoice dates, reserving one
+    block per year. Same transaction rule as reserve_invoice_numbers().
+    """
+    by_year = defaultdict(list)
+    for invoice in invoices:
+        by_year[financial_year_for(invoice.invoice_date)].append(invoice)
+    for financial_year, group in by_year.items():
+        for invoice, number in zip(group, reserve_invoice_numbers(len(group), financial_year)):
+            invoice.invoice_number = number
+
+
+class InvoiceNumberSequence(models.Model):
+    """
+    Last invoice number handed out in each financial year.
+
+    Numbers are allocated by incrementing ``last_number`` in place: the UPDATE locks the row
+    (the whole database on SQLite) until the surrounding transaction commits, so concurrent
+    workers queue up instead of computing the same number, and deleted invoices never give
+    their numbers back.
+    """
+    financial_year = models.PositiveIntegerField(unique=True)
+    last_number = models.PositiveIntegerField(default=0)
+
     def __str__(self):
-        return self.name
+        return f"FY {self.financial_year}: {self.last_number}"
+
+    @classmethod
+    def reserve(cls, financial_year, count=1):
+        """
+        Atomically advance the counter by ``count`` and return the first number of the block.
+        """
+        last_number = cls._advance(financial_year, count)
+        if last_number is None:
+            last_number = cls._highest_issued_number(financial_year) + count
+            try:
+                with transaction.atomic():
+                    cls.objects.create(financial_year=financial_year, last_number=last_number)
+            except IntegrityError:
+                # Another worker created this year's row first; take the next block after theirs
+                last_number = cls._advance(financial_year, count)
+        return last_number - count + 1
+
+    @classmethod
+    def _advance(cls, financial_year, count):
+        # The year's counter after adding ``count``, or None when the year has no row yet
+        connection = connections[router.db_for_write(cls)]
+        if connection.vendor == 'postgresql' or (
+            connection.vendor == 'sqlite' and connection.features.can_return_columns_from_insert
+        ):
+            # UPDATE ... RETURNING: one statement, no savepoint
+            qn = connection.ops.quote_name
+            with connection.cursor() as cursor:
+                cursor.execute('UPDATE %s SET %s = %s + %%s WHERE %s = %%s RETURNING %s' % (
+                    qn(cls._meta.db_table), qn('last_number'), qn('last_number'), qn('financial_year'),
+                    qn('last_number'),
+                ), [count, financial_year])
+                row = cursor.fetchone()
+            return row[0] if row else None
+        with transaction.atomic():
+            if not cls.objects.filter(financial_year=financial_year).update(last_number=F('last_number') + count):
+                return None
+            return cls.objects.filter(financial_year=financial_year).values_list('last_number', flat=True).get()
+
+    @staticmethod
+    def _highest_issued_number(financial_year):
+        # Seeds a year's counter from invoices numbered before the sequence table existed
+        prefix = format_invoice_number(financial_year, 0)[:-2]
+        highest = 0
+        numbers = Invoice.objects.filter(invoice_number__startswith=prefix).values_list('invoice_number', flat=True)
+        for invoice_number in numbers.iterator():
+            suffix = invoice_number[len(prefix):]
+            if suffix.isdigit():
+                highest = max(highest, int(suffix))
+        return highest
 
-class Stamp(models.Model):
+
+class ImageAsset(models.Model):
+    """
+    An uploaded signature or stamp image, stored under its content hash (images.py) with
+    print and web variants made from it on save.
+    """
     name = models.CharField(max_length=100)
-    image = models.ImageField(upload_to='stamps/')
+    image = models.ImageField(upload_to=images.upload_to, storage=images.storage)
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Subclasses set the upload directory and the largest size, in CSS pixels, the invoice
+    # shows the image at
+    upload_dir = None
+    display_size = None
+
+    class Meta:
+        abstract = True
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self.image and not self.image._committed:
+            # Stored before the row, as FileField.pre_save would, so the hash can be read
+            # from the name the storage gives the file
+            self.image.save(self.image.name, self.image.file, save=False)
+        self.content_hash = images.name_hash(self.image.name) if self.image else ''
+        super().save(*args, **kwargs)
+
+    @property
+    def print_url(self):
+        return images.variant_url(self, 'print')
+
+    @property
+    def web_url(self):
+        return images.variant_url(self, 'web')
+
+
+class Signature(ImageAsset):
+    upload_dir = 'signatures'
+    display_size = (160, 320)
+
+
+class Stamp(ImageAsset):
+    upload_dir = 'stamps'
+    display_size = (140, 120)
+
 class Invoice(models.Model):
+    class PdfStatus(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        RENDERING = 'rendering', 'Rendering'
+        READY = 'ready', 'Ready'
+        FAILED = 'failed', 'Failed'
+
     # Header Section
     invoice_number = models.CharField(max_length=50, unique=True, editable=False)
     invoice_date = models.DateField(default=timezone.now)
@@ -70,55 +223,188 @@ Type of training partner: Training institute"""
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    # State of the background pre-render (see pdf_jobs.py). Only ever changed with
+    # queryset.update() outside save(), so it does not bump updated_at and the PDF cache key
+    pdf_status = models.CharField(max_length=10, choices=PdfStatus.choices, default=PdfStatus.PENDING, editable=False)
+
+    # Number of InvoiceLineItem rows; kept by line_items.py so pages and the PDF renderer can
+    # tell an itemised invoice without counting its lines
+    line_item_count = models.PositiveIntegerField(default=0, editable=False)
     
     class Meta:
-        ordering = ['-created_at']
+        # id breaks ties between invoices created in the same instant, so the ordering is
+        # unique and the list can be keyset-paginated on it
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='invoice_created_id_idx'),
+            # With id, so the admin's (-invoice_date, -id) pages, filtered by date, financial
+            # year or state, are read in index order without sorting
+            models.Index(fields=['-invoice_date', '-id'], name='invoice_date_id_idx'),
+            models.Index(fields=['state', '-invoice_date', '-id'], name='invoice_state_date_id_idx'),
+        ]
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The stored values the GST summary needs to turn a save into a delta without reading
+        # the row back (gst_summary.remember_previous); not kept for deferred loads
+        loaded = dict(zip(field_names, values))
+        if all(field in loaded for field in SUMMARY_FIELDS):
+            instance._gst_stored = (db, {field: loaded[field] for field in SUMMARY_FIELDS})
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        # Perhaps only some fields were reloaded; the next save reads the row instead
+        self._gst_stored = None
+
     def save(self, *args, **kwargs):
-        if not self.invoice_number:
-            self.invoice_number = self.generate_invoice_number()
-        
-        # Calculate base amount from total (reverse calculation)
-        # Total = Base + GST, so Base = Total / (1 + GST_Rate)
-        if self.state and self.state.lower() == 'uttarakhand':
-            # Total GST rate = CGST + SGST
-            total_gst_rate = (self.cgst_rate or 0) + (self.sgst_rate or 0)
-            self.base_amount = self.total_amount / (1 + (total_gst_rate / 100))
-            self.cgst_amount = (self.base_amount * (self.cgst_rate or 0)) / 100
-            self.sgst_amount = (self.base_amount * (self.sgst_rate or 0)) / 100
-            self.igst_amount = 0
-        else:
-            # IGST for other states
-            self.base_amount = self.total_amount / (1 + ((self.igst_rate or 0) / 100))
-            self.cgst_amount = 0
-            self.sgst_amount = 0
-            self.igst_amount = (self.base_amount * (self.igst_rate or 0)) / 100
-        
-        # Round off calculation
-        subtotal = (self.base_amount or 0) + (self.cgst_amount or 0) + (self.sgst_amount or 0) + (self.igst_amount or 0)
-        rounded_total = round(subtotal)
-        self.round_off = rounded_total - subtotal
-        self.total_amount = rounded_total
-        
-        super().save(*args, **kwargs)
+        # Number allocation and the insert share one transaction, so a failed save gives the number back
+        with transaction.atomic():
+            if not self.invoice_number:
+                self.invoice_number = self.generate_invoice_number()
+            
+            # Derive base, CGST/SGST or IGST and round-off from the GST-inclusive total; an
+            # itemised invoice already carries the totals of its lines (see line_items.py)
+            if not self.line_item_count:
+                apply_amounts(self)
+
+            # Any edit changes the PDF; the post_save signal queues a new render
+            self.pdf_status = self.PdfStatus.PENDING
+            
+            super().save(*args, **kwargs)
     
     def generate_invoice_number(self):
-        today = timezone.now().date()
-        
-        if today.month >= 4:
-            financial_year = today.year
-        else:
-            financial_year = today.year - 1
-        
-        financial_year_start = datetime(financial_year, 4, 1).date()
-        financial_year_end = datetime(financial_year + 1, 3, 31).date()
-        
-        count = Invoice.objects.filter(
-            invoice_date__gte=financial_year_start,
-            invoice_date__lte=financial_year_end
-        ).count() + 1
-        
-        return f"SLG-{financial_year}-{count:02d}"
+        # From the invoice's own date, so a back-dated invoice is numbered in its year
+        return reserve_invoice_numbers(1, financial_year_for(self.invoice_date))[0]
     
     def __str__(self):
         return self.invoice_number
+
+
+class InvoiceLineItem(models.Model):
+    """
+    One billed line of an itemised invoice. Amounts exclude GST: the taxable value is quantity
+    x rate, and the line's GST rate is split into CGST + SGST or charged as IGST by the
+    invoice's state. The invoice's amount fields hold the totals over its lines.
+    """
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='line_items')
+    position = models.PositiveIntegerField(default=0)
+    description = models.TextField()
+    sac_code = models.CharField(max_length=10, default='999293')
+    quantity = models.DecimalField(max_digits=12, decimal_places=2, default=1)
+    rate = models.DecimalField(max_digits=12, decimal_places=2)
+    gst_rate = models.DecimalField(max_digits=5, decimal_places=2, default=18.00)
+
+    # Calculated fields
+    base_amount = models.DecimalField(max_digits=12, decimal_places=2, editable=False, default=0)
+    cgst_amount = models.DecimalField(max_digits=12, decimal_places=2, editable=False, default=0)
+    sgst_amount = models.DecimalField(max_digits=12, decimal_places=2, editable=False, default=0)
+    igst_amount = models.DecimalField(max_digits=12, decimal_places=2, editable=False, default=0)
+
+    class Meta:
+        ordering = ['position', 'id']
+        indexes = [
+            models.Index(fields=['invoice', 'position'], name='line_item_invoice_pos_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.invoice_id} #{self.position}: {self.description[:40]}"
+
+
+class ArchivedInvoice(models.Model):
+    """
+    An invoice of a closed financial year, moved out of the invoices table by
+    ``manage.py close_financial_year`` (see archive.py). It keeps the invoice's id, so the
+    preview and PDF URLs keep working, and the columns the GST summary adds up; everything else
+    (including the line items) is in ``data``. The rendered PDF is ``pack_length`` bytes at
+    ``pack_offset`` in the year's pack file.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    invoice_number = models.CharField(max_length=50, unique=True)
+    invoice_date = models.DateField()
+    financial_year = models.PositiveIntegerField()
+    client_name = models.TextField()
+    state = models.CharField(max_length=100)
+    base_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    cgst_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    sgst_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    igst_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    round_off = models.DecimalField(max_digits=10, decimal_places=2)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    pack = models.CharField(max_length=100)
+    pack_offset = models.BigIntegerField()
+    pack_length = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-invoice_date', '-id']
+        indexes = [
+            models.Index(fields=['financial_year', 'invoice_date'], name='archived_fy_date_idx'),
+        ]
+
+    def __str__(self):
+        return self.invoice_number
+
+
+class PdfRenderJob(models.Model):
+    """
+    Queued background render of one invoice's PDF into the PDF cache, processed by
+    ``manage.py render_pdf_jobs``. There is at most one job per invoice: saving the invoice
+    again resets its job to pending.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+
+    invoice = models.OneToOneField(Invoice, on_delete=models.CASCADE, related_name='pdf_job')
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='pdfjob_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f"PDF job for invoice {self.invoice_id}: {self.status}"
+
+
+class GstSummary(models.Model):
+    """
+    Running GST totals of the invoices dated in one month for one state, kept up to date by
+    gst_summary.py as invoices are saved, deleted or bulk-created, so reports never have to
+    scan the invoices table.
+    """
+    month = models.DateField(help_text='First day of the month')
+    financial_year = models.PositiveIntegerField()
+    state = models.CharField(max_length=100)
+    invoice_count = models.IntegerField(default=0)
+    base_amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    cgst_amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    sgst_amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    igst_amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    round_off = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    total_amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['month', 'state']
+        constraints = [
+            models.UniqueConstraint(fields=['month', 'state'], name='gst_summary_month_state_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['financial_year', 'state'], name='gst_summary_fy_state_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%b %Y} {self.state}: {self.invoice_count} invoices"
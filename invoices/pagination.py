@@ -0,0 +1,201 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':'), default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor(token)
+    if not isinstance(values, list):
+        raise InvalidCursor(token)
+    return values
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Cursor ("seek") pagination over a unique ordering such as ('-created_at', '-id').
+
+    Each page is a range scan that starts right after the last row of the previous one, so
+    fetching page 1000 costs the same as page 1 as long as an index matches the ordering,
+    unlike OFFSET pagination which has to walk past every earlier row.
+    """
+
+    def __init__(self, queryset, ordering=('-created_at', '-id'), per_page=50):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.fields = [f.lstrip('-') for f in self.ordering]
+        self.per_page = per_page
+
+    def _cursor_for(self, obj):
+        return encode_cursor([getattr(obj, field) for field in self.fields])
+
+    def _decode(self, token):
+        """
+        The values of a cursor as the ordering fields' Python types. A cursor that decodes but
+        holds values the fields cannot take (``["abc", 1]``) is invalid too, rather than an
+        error once the query is built.
+        """
+        values = decode_cursor(token)
+        if len(values) != len(self.fields):
+            raise InvalidCursor(token)
+        opts = self.queryset.model._meta
+        try:
+            values = [opts.get_field(field).to_python(value) for field, value in zip(self.fields, values)]
+        except (ValidationError, ValueError, TypeError):
+            raise InvalidCursor(token)
+        if any(value is None for value in values):
+            raise InvalidCursor(token)
+        return values
+
+    def _seek(self, values, forward):
+        """
+        Q selecting rows strictly after (forward) or before ``values`` in the ordering.
+        """
+        if len(values) != len(self.fields):
+            raise InvalidCursor(values)
+        condition = Q()
+        for i, ordering in enumerate(self.ordering):
+            descending = ordering.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            term = Q(**{'%s__%s' % (self.fields[i], lookup): values[i]})
+            for j in range(i):
+                term &= Q(**{self.fields[j]: values[j]})
+            condition |= term
+        return condition
+
+    def _rows_query(self, after, before, last=False):
+        # One row more than a page, to tell whether there is another page beyond it
+        queryset = self.queryset
+        if before or last:
+            reverse_ordering = [f[1:] if f.startswith('-') else '-' + f for f in self.ordering]
+            if before:
+                queryset = queryset.filter(self._seek(self._decode(before), forward=False))
+            return queryset.order_by(*reverse_ordering)[:self.per_page + 1]
+        if after:
+            queryset = queryset.filter(self._seek(self._decode(after), forward=True))
+        return queryset.order_by(*self.ordering)[:self.per_page + 1]
+
+    def _make_page(self, rows, after, before, last=False):
+        if before or last:
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return KeysetPage(
+                rows,
+                next_cursor=self._cursor_for(rows[-1]) if rows and not last else None,
+                previous_cursor=self._cursor_for(rows[0]) if rows and has_previous else None,
+            )
+
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        return KeysetPage(
+            rows,
+            next_cursor=self._cursor_for(rows[-1]) if rows and has_next else None,
+            previous_cursor=self._cursor_for(rows[0]) if rows and after else None,
+        )
+
+    def page(self, after=None, before=None, last=False):
+        """
+        The page following the ``after`` cursor, preceding the ``before`` cursor, the last page
+        (``last``) or the first page.
+        """
+        return self._make_page(list(self._rows_query(after, before, last)), after, before, last)
+
+    async def apage(self, after=None, before=None, last=False):
+        """
+        Async version of page(), for async views.
+        """
+        return self._make_page([row async for row in self._rows_query(after, before, last)], after, before, last)
+
+
+ESTIMATE_SQL = {
+    'postgresql': 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+    'mysql': 'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+}
+
+
+def table_size_estimate(model, using='default'):
+    """
+    Approximate number of rows in ``model``'s table without counting them: the planner
+    statistics on PostgreSQL and MySQL, the id range on SQLite (exact until rows are deleted).
+    None if no estimate is available.
+    """
+    connection = connections[using]
+    if connection.vendor in ESTIMATE_SQL:
+        with connection.cursor() as cursor:
+            cursor.execute(ESTIMATE_SQL[connection.vendor], [model._meta.db_table])
+            row = cursor.fetchone()
+        # reltuples is -1 for a table that has never been analysed
+        return row[0] if row and row[0] is not None and row[0] >= 0 else None
+    if model._meta.pk.get_internal_type() not in ('AutoField', 'BigAutoField', 'BigIntegerField'):
+        return None
+    # Two lookups at the ends of the primary key; SQLite scans the table for MIN() and MAX() together
+    pks = model._default_manager.using(using).values_list('pk', flat=True)
+    low, high = pks.order_by('pk').first(), pks.order_by('-pk').first()
+    return 0 if low is None else high - low + 1
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never counts more than ``exact_limit`` rows. They are counted with a COUNT
+    over a LIMIT subquery, which stops there; past it an unfiltered queryset reports
+    table_size_estimate() and a filtered one reports ``exact_limit + 1`` (so the last pages
+    shown are the ones within the limit). ``estimated`` says which of the counts is not exact.
+    """
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, exact_limit=10000):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.exact_limit = exact_limit
+        self.estimated = False
+        self.capped = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            return super().count
+        counted = queryset.order_by()[:self.exact_limit + 1].count()
+        if counted <= self.exact_limit:
+            return counted
+        self.estimated = True
+        if not queryset.query.has_filters():
+            estimate = table_size_estimate(queryset.model, queryset.db)
+            if estimate is not None:
+                return max(estimate, counted)
+        self.capped = True
+        return counted
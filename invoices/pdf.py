@@ -0,0 +1,354 @@
+import base64
+import hashlib
+import io
+import mimetypes
+import os
+import threading
+import time
+import urllib.request
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.template import engines
+from django.template.loader import get_template
+from django.utils.module_loading import import_string
+
+from . import images, line_items
+from .amount_words import amount_in_words
+from .instrumentation import stage
+
+INVOICE_TEMPLATE = 'invoices/invoice_preview.html'
+# Seconds before a remote resource that could not be fetched is tried again
+REMOTE_RETRY_SECONDS = 300
+
+
+class PDFRenderError(Exception):
+    """Raised when xhtml2pdf reports errors while generating an invoice PDF."""
+
+
+def build_invoice_context(invoice, line_rows=None, image_kind='web'):
+    """
+    Context shared by the HTML preview and the PDF download. ``line_rows`` replaces the line
+    items read from the database (archived invoices bring their own); ``image_kind`` picks the
+    signature/stamp variant (images.py), 'print' for PDFs.
+    """
+    with stage('words'):
+        words = amount_in_words(invoice.total_amount)
+    if line_rows is None and invoice.line_item_count:
+        line_rows = line_items.display_rows(invoice)
+    return {
+        'invoice': invoice,
+        'amount_in_words': words,
+        'line_items': line_rows,
+        'signature_url': images.variant_url(invoice.signature, image_kind),
+        'stamp_url': images.variant_url(invoice.stamp, image_kind) if invoice.include_stamp else None,
+    }
+
+
+def get_css_path():
+    return os.path.join(settings.BASE_DIR, 'static', 'css', 'styles.css')
+
+
+def resolve_path(uri):
+    """
+    Convert HTML URIs to absolute system paths so xhtml2pdf can access static/media files.
+    """
+    # If uri is a media url, map to MEDIA_ROOT
+    if uri.startswith(settings.MEDIA_URL):
+        path = uri.replace(settings.MEDIA_URL, '')
+        return os.path.join(settings.MEDIA_ROOT, path)
+
+    # If uri is a static url, map to STATIC_ROOT if available, otherwise to project static folder
+    if uri.startswith(settings.STATIC_URL):
+        path = uri.replace(settings.STATIC_URL, '')
+        # Fingerprinted names (manifest storage) only exist in STATIC_ROOT after collectstatic;
+        # without it, find the source file in static/ or an app's static/ directory
+        if getattr(settings, 'STATIC_ROOT', None) and os.path.exists(os.path.join(settings.STATIC_ROOT, path)):
+            return os.path.join(settings.STATIC_ROOT, path)
+        found = finders.find(path)
+        if found:
+            return found
+        # fallback to static folder in BASE_DIR
+        return os.path.join(settings.BASE_DIR, 'static', path)
+
+    # return unchanged for absolute paths or external URLs
+    return uri
+
+
+def vendored_uri(uri):
+    """
+    The static URI of our copy of a file the templates could also load from a CDN (Bootstrap,
+    see templatetags/invoice_extras.py); other URIs are returned unchanged. PDF renders never go
+    to the network for these, which may not be reachable.
+    """
+    from .templatetags.invoice_extras import BOOTSTRAP_CDN, BOOTSTRAP_DIR
+
+    if uri.startswith(BOOTSTRAP_CDN):
+        return settings.STATIC_URL + BOOTSTRAP_DIR + uri[len(BOOTSTRAP_CDN):]
+    return uri
+
+
+def _is_bootstrap(uri):
+    from .templatetags.invoice_extras import BOOTSTRAP_DIR
+
+    return uri.startswith(settings.STATIC_URL + BOOTSTRAP_DIR)
+
+
+def _stat_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class RenderAssets:
+    """
+    Everything an invoice render reads besides the invoice itself, loaded once per worker
+    process: the inlined stylesheet, the compiled template and every image or stylesheet the
+    template links to, kept as ready-made ``data:`` URIs so xhtml2pdf never opens a file.
+
+    Source files are re-stat()ed at most every INVOICE_PDF_ASSET_CHECK_INTERVAL seconds and
+    reloaded when their mtime or size changed; between checks a warm render does no I/O.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._template_path = None
+        self._template = None
+        self._css = ''
+        self._fingerprint = None
+        self._source_keys = None
+        # uri -> (stat key, bytes, data URI); remote URIs use a None stat key and are fetched once
+        self._resources = {}
+        # remote uri -> time.monotonic() of its last failed fetch
+        self._failed = {}
+
+    def _check_interval(self):
+        return getattr(settings, 'INVOICE_PDF_ASSET_CHECK_INTERVAL', 2.0)
+
+    def _due_for_check(self):
+        return self._checked_at is None or time.monotonic() - self._checked_at >= self._check_interval()
+
+    def _refresh(self):
+        if not self._due_for_check():
+            return
+        with self._lock, stage('assets'):
+            if not self._due_for_check():
+                return
+            if self._template_path is None:
+                self._template_path = get_template(INVOICE_TEMPLATE).origin.name
+            paths = (self._template_path, get_css_path())
+            keys = tuple(_stat_key(path) for path in paths)
+            if keys != self._source_keys:
+                self._load_sources(paths)
+                self._source_keys = keys
+            # Linked files are revalidated lazily: drop the ones whose file changed
+            for uri, (key, _, _) in list(self._resources.items()):
+                if key is not None and _stat_key(resolve_path(uri)) != key:
+                    del self._resources[uri]
+            self._checked_at = time.monotonic()
+
+    def _load_sources(self, paths):
+        template_path, css_path = paths
+        with open(template_path, encoding='utf-8') as f:
+            template_source = f.read()
+        css = ''
+        # xhtml2pdf cannot reliably fetch CSS over HTTP, so the stylesheet is inlined
+        if os.path.exists(css_path):
+            try:
+                with open(css_path, 'r', encoding='utf-8') as f:
+                    css = f.read()
+            except Exception:
+                css = ''
+        self._template = engines['django'].from_string(template_source)
+        self._css = css
+        self._fingerprint = hashlib.sha256(
+            template_source.encode('utf-8') + b'\0' + css.encode('utf-8')
+        ).hexdigest()
+
+    @property
+    def template(self):
+        self._refresh()
+        return self._template
+
+    @property
+    def css(self):
+        self._refresh()
+        return self._css
+
+    @property
+    def fingerprint(self):
+        """
+        Hash of the template and stylesheet; part of the PDF cache key.
+        """
+        self._refresh()
+        return self._fingerprint
+
+    def _load(self, uri):
+        """
+        ``(bytes, data URI)`` for ``uri``, from memory when possible; None if it cannot be read.
+        """
+        self._refresh()
+        cached = self._resources.get(uri)
+        if cached is not None:
+            return cached[1:]
+
+        with stage('assets'):
+            if uri.startswith(('http://', 'https://')):
+                failed_at = self._failed.get(uri)
+                if failed_at is not None and time.monotonic() - failed_at < REMOTE_RETRY_SECONDS:
+                    return None
+                data, key = self._fetch(uri), None
+                if data is None:
+                    self._failed[uri] = time.monotonic()
+                    return None
+                self._failed.pop(uri, None)
+            else:
+                key = _stat_key(resolve_path(uri))
+                if key is None:
+                    return None
+                with open(resolve_path(uri), 'rb') as f:
+                    data = f.read()
+        mime_type = mimetypes.guess_type(uri.split('?', 1)[0])[0] or 'application/octet-stream'
+        data_uri = 'data:%s;base64,%s' % (mime_type, base64.b64encode(data).decode('ascii'))
+        self._resources[uri] = (key, data, data_uri)
+        return data, data_uri
+
+    def read(self, uri):
+        """
+        Raw bytes of a static/media file (or remote resource), or None if it cannot be read.
+        """
+        loaded = self._load(vendored_uri(uri))
+        return loaded[0] if loaded else None
+
+    def resolve(self, uri):
+        """
+        link_callback for xhtml2pdf: an in-memory ``data:`` URI for anything we can load.
+        """
+        if uri.startswith('data:'):
+            return uri
+        uri = vendored_uri(uri)
+        loaded = self._load(uri)
+        if loaded:
+            return loaded[1]
+        if uri.startswith(('http://', 'https://')) or _is_bootstrap(uri):
+            # Left out rather than fetched again by xhtml2pdf. The PDF is styled by styles.css;
+            # a Bootstrap that is not vendored would only make xhtml2pdf log a parse error
+            return 'data:%s;base64,' % (mimetypes.guess_type(uri.split('?', 1)[0])[0] or 'application/octet-stream')
+        return resolve_path(uri)
+
+    def _fetch(self, uri):
+        # Remote resources are fetched once per worker instead of on every render. When the
+        # network is unavailable they are left out, and tried again after REMOTE_RETRY_SECONDS
+        # rather than making every render wait for the timeout
+        try:
+            with urllib.request.urlopen(uri, timeout=5) as response:
+                return response.read()
+        except Exception:
+            return None
+
+    def preload(self):
+        """
+        Warm the bundle, including the static assets the template always links to.
+        """
+        self._refresh()
+        self.resolve(settings.STATIC_URL + 'css/styles.css')
+        return self
+
+
+_assets = RenderAssets()
+
+
+def get_assets():
+    return _assets
+
+
+# Helper for xhtml2pdf to find static and media files
+def link_callback(uri, rel):
+    """
+    Resolve URIs in the invoice HTML to in-memory resources from the asset bundle.
+    """
+    return _assets.resolve(uri)
+
+
+def _pisa():
+    # xhtml2pdf pulls in ReportLab, html5lib and Pillow (about a second and 60 MB), so it is
+    # only imported by processes that actually render PDFs
+    from xhtml2pdf import pisa
+    return pisa
+
+
+class XHTML2PDFBackend:
+    """
+    Renders the preview template to PDF with xhtml2pdf (pisa), with static/css/styles.css
+    inlined so the PDF matches the browser preview.
+    """
+    name = 'xhtml2pdf'
+
+    def preload(self):
+        _pisa()
+
+    def render(self, invoice):
+        context = build_invoice_context(invoice, image_kind='print')
+        with stage('template'):
+            html = _assets.template.render(context)
+        html_with_css = '<style>%s</style>\n%s' % (_assets.css, html)
+
+        result = io.BytesIO()
+        with stage('pdf'):
+            pdf_status = _pisa().CreatePDF(
+                src=io.BytesIO(html_with_css.encode('utf-8')),
+                dest=result,
+                link_callback=link_callback
+            )
+        if pdf_status.err:
+            raise PDFRenderError(pdf_status.err)
+        return result.getvalue()
+
+
+_backends = {}
+
+
+def get_pdf_backend(path=None):
+    """
+    The PDF backend named by INVOICE_PDF_BACKEND (a dotted path to a class with a ``name``
+    attribute and a ``render(invoice) -> bytes`` method), instantiated once per process.
+    """
+    path = path or getattr(settings, 'INVOICE_PDF_BACKEND', 'invoices.pdf.XHTML2PDFBackend')
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+def get_pdf_backend_for(invoice):
+    """
+    The backend that renders ``invoice``: the configured one, except that invoices with more
+    than INVOICE_PDF_HTML_MAX_LINES line items always go to ReportLab. xhtml2pdf lays out long
+    tables in quadratic time (about 16 s for 1,000 rows and 2 minutes for 3,000).
+    """
+    backend = get_pdf_backend()
+    if backend.name != 'reportlab' and invoice.line_item_count > getattr(settings, 'INVOICE_PDF_HTML_MAX_LINES', 100):
+        return get_pdf_backend('invoices.pdf_reportlab.ReportLabBackend')
+    return backend
+
+
+def preload():
+    """
+    Import the configured PDF backend with its renderer and warm the asset bundle, so the first
+    download in a worker is as fast as the following ones. Called from AppConfig.ready() when
+    INVOICE_PDF_PRELOAD is set, and by the bulk render pool workers.
+    """
+    backend = get_pdf_backend()
+    if hasattr(backend, 'preload'):
+        backend.preload()
+    _assets.preload()
+    return backend
+
+
+def render_invoice_pdf(invoice):
+    """
+    Render ``invoice`` to PDF bytes with the configured backend.
+    """
+    return get_pdf_backend_for(invoice).render(invoice)
@@ -0,0 +1,213 @@
+"""
+On-disk cache of rendered invoice PDFs.
+
+Entries are keyed on the invoice pk, the PDF backend, ``Invoice.updated_at``, a hash of the
+invoice template and stylesheet, and the identity of the signature/stamp images, so any change
+that would alter the PDF produces a new key. Stale entries are removed when an invoice is saved or deleted, and the
+least recently used files are evicted once the cache grows past INVOICE_PDF_CACHE_MAX_BYTES.
+"""
+import glob
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+
+from . import images
+from .models import Invoice
+from .instrumentation import stage
+from .pdf import get_assets, get_pdf_backend_for, render_invoice_pdf
+
+
+def get_cache_dir():
+    return str(getattr(settings, 'INVOICE_PDF_CACHE_DIR', os.path.join(settings.BASE_DIR, 'pdf_cache')))
+
+
+def _image_identity(asset):
+    # The file the PDF embeds: the print variant once it has been made
+    path = images.variant_path(asset, 'print')
+    if not path:
+        return ''
+    try:
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return path
+    return '%s:%d:%d' % (os.path.basename(path), stat.st_size, stat.st_mtime_ns)
+
+
+def invoice_cache_key(invoice):
+    """
+    Cache key (also used as the ETag) for the rendered PDF of ``invoice``.
+    """
+    signature = invoice.signature
+    stamp = invoice.stamp if invoice.include_stamp else None
+    parts = [
+        str(invoice.pk),
+        get_pdf_backend_for(invoice).name,
+        invoice.updated_at.isoformat() if invoice.updated_at else '',
+        get_assets().fingerprint,
+        _image_identity(signature),
+        _image_identity(stamp),
+    ]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def _entry_path(pk, key):
+    return os.path.join(get_cache_dir(), '%s-%s.pdf' % (pk, key))
+
+
+def get(pk, key):
+    """
+    Return the cached PDF bytes for ``key``, or None on a miss. Hits refresh the entry's mtime,
+    which is what LRU eviction orders on.
+    """
+    path = _entry_path(pk, key)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return data
+
+
+def exists(pk, key):
+    return os.path.exists(_entry_path(pk, key))
+
+
+def open_entry(pk, key):
+    """
+    Open the cached PDF for ``key`` for streaming (e.g. with FileResponse), or return None on a
+    miss. Like get(), a hit refreshes the entry's mtime.
+    """
+    path = _entry_path(pk, key)
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return f
+
+
+def put(pk, key, data):
+    cache_dir = get_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary file and rename so concurrent readers never see a partial PDF
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, _entry_path(pk, key))
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    evict()
+
+
+def get_or_render(invoice, key=None, record=True):
+    """
+    Return the PDF bytes for ``invoice``, rendering and caching them on a miss. A fresh render
+    marks the invoice ready unless ``record`` is false, which leaves that to the caller (the
+    async download view, so the write happens on the request's own connection rather than a
+    pool thread's).
+    """
+    key = key or invoice_cache_key(invoice)
+    with stage('cache'):
+        data = get(invoice.pk, key)
+    if data is None:
+        data = render_invoice_pdf(invoice)
+        try:
+            put(invoice.pk, key, data)
+        except OSError:
+            # A read-only or full cache directory must never break the download itself
+            pass
+        else:
+            if record:
+                mark_ready(invoice)
+    return data
+
+
+def mark_ready(invoice):
+    """
+    Record that the PDF of ``invoice`` is in the cache, unless the invoice was saved again
+    since this instance was read (its PDF then has a new key and a new job is queued).
+    """
+    if invoice.pk is None or invoice.updated_at is None:
+        return
+    Invoice.objects.filter(pk=invoice.pk, updated_at=invoice.updated_at).exclude(
+        pdf_status=Invoice.PdfStatus.READY,
+    ).update(pdf_status=Invoice.PdfStatus.READY)
+
+
+def invalidate(pk):
+    """
+    Remove every cached PDF of the invoice with primary key ``pk``.
+    """
+    for path in glob.glob(os.path.join(glob.escape(get_cache_dir()), '%s-*.pdf' % pk)):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def invalidate_many(pks):
+    """
+    Like invalidate() for many invoices, in one pass over the cache directory.
+    """
+    pks = {str(pk) for pk in pks}
+    if not pks:
+        return
+    try:
+        with os.scandir(get_cache_dir()) as it:
+            paths = [
+                entry.path for entry in it
+                if entry.name.endswith('.pdf') and entry.name.partition('-')[0] in pks
+            ]
+    except OSError:
+        return
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def evict(max_bytes=None):
+    """
+    Delete least recently used entries until the cache fits in ``max_bytes``.
+    """
+    if max_bytes is None:
+        max_bytes = getattr(settings, 'INVOICE_PDF_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+    entries = []
+    total = 0
+    try:
+        with os.scandir(get_cache_dir()) as it:
+            for entry in it:
+                if not entry.name.endswith('.pdf'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+    except OSError:
+        return
+    if total <= max_bytes:
+        return
+    entries.sort()
+    for _, size, path in entries:
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        if total <= max_bytes:
+            break
@@ -0,0 +1,161 @@
+"""
+Bounded executor for the PDF renders of the async download view.
+
+A PDF cache miss costs a few hundred milliseconds of CPU, which must not run on the event loop.
+Rendering every miss at once would not work either: a burst of downloads would queue minutes
+of work, and each one holds a connection open. Renders are therefore handed to a fixed pool
+of INVOICE_PDF_ASYNC_WORKERS workers. At most INVOICE_PDF_ASYNC_QUEUE more renders may wait
+for a worker, and beyond that ``submit()`` refuses at once with RenderQueueFull. A caller
+waits INVOICE_PDF_ASYNC_TIMEOUT seconds at most (queueing included) before RenderTimeout. The
+render itself carries on and puts its PDF in the cache, so a retry is a cache hit. Concurrent
+requests for the same PDF share one render.
+
+The workers are threads by default (INVOICE_PDF_ASYNC_EXECUTOR = 'thread'). Renders hold the
+GIL, so light requests still slow down somewhat while PDFs render next to them. 'process' runs
+them in a pool of processes set up like the bulk export's (bulk_pdf.py). That keeps the
+server's own process free, at the cost of a Django instance in memory per worker.
+"""
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import bulk_pdf, pdf_cache
+from .pdf import PDFRenderError
+
+EXECUTOR_KINDS = ('thread', 'process')
+# Seconds a refused or timed-out download is told to wait before asking again
+RETRY_AFTER = 5
+
+
+class RenderQueueFull(Exception):
+    """
+    Every worker is busy and INVOICE_PDF_ASYNC_QUEUE renders are already waiting.
+    """
+
+
+class RenderTimeout(Exception):
+    """
+    The PDF was not ready within INVOICE_PDF_ASYNC_TIMEOUT; it is still being rendered.
+    """
+
+
+def _render_in_thread(invoice, key):
+    # Pool threads are not request threads, so nothing else closes their connections.
+    # render() marks the invoice ready from the caller's thread instead of writing here.
+    close_old_connections()
+    try:
+        return pdf_cache.get_or_render(invoice, key=key, record=False)
+    finally:
+        close_old_connections()
+
+
+class RenderExecutor:
+    def __init__(self, kind='thread', workers=2, queue=8, timeout=30):
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError('Unknown PDF executor %r; expected one of %s' % (kind, ', '.join(EXECUTOR_KINDS)))
+        self.kind = kind
+        self.workers = max(workers, 1)
+        self.timeout = timeout
+        # One slot per render running or waiting
+        self._slots = threading.BoundedSemaphore(self.workers + max(queue, 0))
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.kind == 'process':
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=bulk_pdf._init_worker,
+                )
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='invoice-pdf')
+        return self._pool
+
+    def submit(self, invoice, key):
+        """
+        Start rendering ``invoice`` into the cache entry ``key``, or join the render of that
+        entry already under way; returns a concurrent.futures.Future. Raises RenderQueueFull
+        without waiting when there is no slot left.
+        """
+        entry = (invoice.pk, key)
+        with self._lock:
+            future = self._pending.get(entry)
+            if future is not None:
+                return future
+            if not self._slots.acquire(blocking=False):
+                raise RenderQueueFull()
+            try:
+                if self.kind == 'process':
+                    future = self._get_pool().submit(bulk_pdf.render_invoice, invoice.pk)
+                else:
+                    future = self._get_pool().submit(_render_in_thread, invoice, key)
+            except BaseException:
+                self._slots.release()
+                raise
+            self._pending[entry] = future
+        future.add_done_callback(partial(self._finished, entry))
+        return future
+
+    def _finished(self, entry, future):
+        with self._lock:
+            self._pending.pop(entry, None)
+            if not future.cancelled() and isinstance(future.exception(), BrokenExecutor):
+                # A worker process died (e.g. killed for memory); start a new pool next time
+                self._pool = None
+        self._slots.release()
+
+    async def render(self, invoice, key):
+        """
+        The PDF bytes of ``invoice``, rendered off the event loop; the invoice is then marked
+        ready. Raises RenderQueueFull, RenderTimeout or PDFRenderError.
+        """
+        future = asyncio.wrap_future(self.submit(invoice, key))
+        # Retrieve the outcome even when nobody is left waiting for it
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        try:
+            # Shielded: neither a timeout nor a client going away cancels the render
+            result = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise RenderTimeout() from None
+        if self.kind == 'process':
+            _pk, _number, result, error = result
+            if error:
+                raise PDFRenderError(error)
+        else:
+            await sync_to_async(pdf_cache.mark_ready)(invoice)
+        return result
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    The process-wide RenderExecutor, configured from the INVOICE_PDF_ASYNC_* settings.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = RenderExecutor(
+                    kind=getattr(settings, 'INVOICE_PDF_ASYNC_EXECUTOR', 'thread'),
+                    workers=getattr(settings, 'INVOICE_PDF_ASYNC_WORKERS', 2),
+                    queue=getattr(settings, 'INVOICE_PDF_ASYNC_QUEUE', 8),
+                    timeout=getattr(settings, 'INVOICE_PDF_ASYNC_TIMEOUT', 30),
+                )
+    return _executor
@@ -0,0 +1,175 @@
+"""
+Background pre-rendering of invoice PDFs.
+
+Saving an invoice (or replacing the signature/stamp image it uses) queues a ``PdfRenderJob``
+once the transaction commits. ``manage.py render_pdf_jobs`` claims pending jobs, renders them
+in a process pool into the on-disk PDF cache (pdf_cache.py) and records the outcome on the job
+and in ``Invoice.pdf_status``. Failed renders are retried with exponential backoff up to
+INVOICE_PDF_JOB_MAX_ATTEMPTS times; jobs left running longer than INVOICE_PDF_JOB_TIMEOUT
+seconds (a hung render or a worker that died) are taken back and retried.
+
+Downloads never wait for a job: they serve the cached file when it is there and render on
+demand otherwise. A PDF rendered on demand also marks its invoice ready (pdf_cache.mark_ready),
+as does every render when INVOICE_PDF_PRERENDER is off.
+"""
+import multiprocessing
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import bulk_pdf
+from .models import Invoice, PdfRenderJob
+
+Job = PdfRenderJob.Status
+Status = Invoice.PdfStatus
+
+
+def get_timeout():
+    return getattr(settings, 'INVOICE_PDF_JOB_TIMEOUT', 120)
+
+
+def get_max_attempts():
+    return getattr(settings, 'INVOICE_PDF_JOB_MAX_ATTEMPTS', 3)
+
+
+def enqueue(pks):
+    """
+    Queue (or re-queue) a render of the invoices with primary keys ``pks``.
+    """
+    pks = list(pks)
+    if not pks:
+        return
+    now = timezone.now()
+    PdfRenderJob.objects.bulk_create(
+        [PdfRenderJob(invoice_id=pk, status=Job.PENDING, attempts=0, run_after=now, locked_at=None, last_error='')
+         for pk in pks],
+        update_conflicts=True,
+        unique_fields=['invoice'],
+        update_fields=['status', 'attempts', 'run_after', 'locked_at', 'last_error', 'updated_at'],
+    )
+
+
+def enqueue_on_commit(pks):
+    if getattr(settings, 'INVOICE_PDF_PRERENDER', True):
+        pks = list(pks)
+        transaction.on_commit(lambda: enqueue(pks))
+
+
+def reclaim_expired(timeout=None):
+    """
+    Put jobs that have been running for longer than ``timeout`` seconds back in the queue (or
+    fail them once they are out of attempts). Returns the number of jobs reclaimed.
+    """
+    timeout = get_timeout() if timeout is None else timeout
+    expired = PdfRenderJob.objects.filter(status=Job.RUNNING, locked_at__lt=timezone.now() - timedelta(seconds=timeout))
+    reclaimed = 0
+    for job in expired:
+        reclaimed += finish(job, 'Timed out after %s seconds' % timeout)
+    return reclaimed
+
+
+def claim(limit):
+    """
+    Mark up to ``limit`` due jobs as running and return them. Each job is claimed with a
+    conditional UPDATE, so concurrent workers never pick the same job.
+    """
+    now = timezone.now()
+    candidates = PdfRenderJob.objects.filter(status=Job.PENDING, run_after__lte=now).order_by('run_after', 'pk')
+    claimed = []
+    for job in candidates[:limit]:
+        updated = PdfRenderJob.objects.filter(pk=job.pk, status=Job.PENDING).update(
+            status=Job.RUNNING, locked_at=now, attempts=F('attempts') + 1, updated_at=now,
+        )
+        if updated:
+            job.status, job.locked_at, job.attempts = Job.RUNNING, now, job.attempts + 1
+            claimed.append(job)
+    if claimed:
+        Invoice.objects.filter(pk__in=[job.invoice_id for job in claimed]).update(pdf_status=Status.RENDERING)
+    return claimed
+
+
+def finish(job, error=None):
+    """
+    Record the outcome of a claimed job; a no-op (returning 0) if the invoice was saved again
+    meanwhile and the job re-queued.
+    """
+    now = timezone.now()
+    if error is None:
+        job_values, invoice_status = {'status': Job.DONE, 'last_error': ''}, Status.READY
+    elif job.attempts < get_max_attempts():
+        # Retry after 30 s, 60 s, 120 s ...
+        retry_at = now + timedelta(seconds=30 * 2 ** (job.attempts - 1))
+        job_values, invoice_status = {'status': Job.PENDING, 'run_after': retry_at, 'last_error': error}, Status.PENDING
+    else:
+        job_values, invoice_status = {'status': Job.FAILED, 'last_error': error}, Status.FAILED
+
+    with transaction.atomic():
+        updated = PdfRenderJob.objects.filter(pk=job.pk, status=Job.RUNNING, locked_at=job.locked_at).update(
+            locked_at=None, updated_at=now, **job_values
+        )
+        if updated:
+            Invoice.objects.filter(pk=job.invoice_id).update(pdf_status=invoice_status)
+    return updated
+
+
+def run(workers=None, batch_size=None, once=False, poll_interval=2.0, stdout=None):
+    """
+    Process jobs until interrupted (or, with ``once``, until the queue is empty). Returns the
+    number of jobs processed.
+    """
+    workers = bulk_pdf.get_worker_count(workers)
+    batch_size = batch_size or workers * 4
+    pool = _start_pool(workers)
+    processed = 0
+    try:
+        while True:
+            reclaim_expired()
+            jobs = claim(batch_size)
+            if not jobs:
+                if once:
+                    return processed
+                time.sleep(poll_interval)
+                continue
+            pool = _process(jobs, pool, workers)
+            processed += len(jobs)
+            if stdout is not None:
+                stdout.write('Processed %d PDF job(s)' % len(jobs))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def _start_pool(workers):
+    if workers == 1:
+        return None
+    context = multiprocessing.get_context('spawn')
+    return context.Pool(workers, initializer=bulk_pdf._init_worker)
+
+
+def _process(jobs, pool, workers):
+    if pool is None:
+        for job in jobs:
+            finish(job, bulk_pdf.prerender_invoice(job.invoice_id)[1])
+        return pool
+
+    results = {job.pk: pool.apply_async(bulk_pdf.prerender_invoice, (job.invoice_id,)) for job in jobs}
+    deadline = time.monotonic() + get_timeout()
+    timed_out = False
+    for job in jobs:
+        try:
+            error = results[job.pk].get(timeout=max(0.0, deadline - time.monotonic()))[1]
+        except multiprocessing.TimeoutError:
+            error, timed_out = 'Timed out after %s seconds' % get_timeout(), True
+        finish(job, error)
+
+    if timed_out:
+        # A hung render cannot be cancelled on its own; replace the whole pool
+        pool.terminate()
+        pool.join()
+        pool = _start_pool(workers)
+    return pool
@@ -0,0 +1,390 @@
+"""
+Direct-draw ReportLab invoice renderer.
+
+Lays out the same invoice as invoice_preview.html + styles.css (header, client block, SAC code,
+GST table by state, round-off, amount in words, signature and stamp, bank details) straight
+onto ReportLab flowables, so no HTML or CSS is parsed on each render. Select it with
+INVOICE_PDF_BACKEND = 'invoices.pdf_reportlab.ReportLabBackend'.
+"""
+import io
+
+from django.template.defaultfilters import floatformat
+from django.utils.dateformat import format as format_date
+from django.utils.html import escape
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import Flowable, Image, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from . import images, line_items
+from .amount_words import amount_in_words
+from .gst import is_intra_state
+from .instrumentation import stage
+from .pdf import PDFRenderError, get_assets
+
+PAGE_MARGIN = 8 * mm
+CONTENT_WIDTH = A4[0] - 2 * PAGE_MARGIN
+
+# CSS pixels to points
+PX = 0.75
+
+COMPANY_DETAILS = (
+    '1, Institution of Engineers, Near PITCUL, ISBT,<br/>'
+    'Dehradun Uttarakhand.<br/>'
+    'M-7456000240/41<br/>'
+    '<b>GSTIN-</b> 05ABACS9144F1ZF &nbsp;|&nbsp; <b>SAC CODE:</b> %s'
+)
+BANK_DETAILS = (
+    '<b>Bank Account Details</b><br/>'
+    'Bank Name: Nainital Bank | Account number: 1011000000000248<br/>'
+    'IFSC Code: NTBI0DEH101 | PAN No: ABACS9144F | GST No: 05ABACS9144F1ZF'
+)
+
+
+def _style(name, **kwargs):
+    kwargs.setdefault('fontName', 'Helvetica')
+    kwargs.setdefault('fontSize', 13 * PX)
+    kwargs.setdefault('leading', kwargs['fontSize'] * 1.35)
+    return ParagraphStyle(name, **kwargs)
+
+
+STYLES = {
+    'company_name': _style('company_name', fontName='Helvetica-Bold', fontSize=22 * PX, spaceAfter=8 * PX),
+    'company_details': _style('company_details', fontSize=14 * PX, leading=14 * PX * 1.4),
+    'title': _style('title', fontName='Helvetica-Bold', fontSize=26 * PX, alignment=TA_CENTER),
+    'detail_head': _style('detail_head', fontName='Helvetica-Bold', alignment=TA_CENTER),
+    'detail_value': _style('detail_value', fontName='Helvetica-Bold', fontSize=14 * PX, alignment=TA_CENTER),
+    'text': _style('text'),
+    'description': _style('description', fontSize=10 * PX, leading=10 * PX * 1.4),
+    'table_head': _style('table_head', fontName='Helvetica-Bold', fontSize=12.5 * PX, alignment=TA_CENTER),
+    'line': _style('line', fontSize=11 * PX),
+    'amount': _style('amount', fontName='Helvetica-Bold', alignment=TA_RIGHT),
+    'words': _style('words', fontName='Helvetica-Oblique'),
+    'footer_left': _style('footer_left', fontName='Helvetica-Bold', fontSize=12 * PX),
+    'footer_right': _style('footer_right', fontSize=12 * PX, leading=12 * PX * 1.6, alignment=TA_RIGHT),
+}
+
+
+def _text(value):
+    return escape(value or '').replace('\n', '<br/>')
+
+
+def _amount(value):
+    return floatformat(value, 2)
+
+
+def _image(asset, max_width, max_height=None):
+    """
+    Flowable for the print variant of a signature/stamp read from the shared asset bundle,
+    scaled to fit.
+    """
+    url = images.variant_url(asset, 'print')
+    if not url:
+        return None
+    data = get_assets().read(url)
+    if not data:
+        return None
+    width, height = ImageReader(io.BytesIO(data)).getSize()
+    scale = min(1.0, max_width / float(width), (max_height or height) / float(height))
+    return Image(io.BytesIO(data), width=width * scale, height=height * scale)
+
+
+class PagedTable(Flowable):
+    """
+    A table laid out one page at a time: each split takes the rows that fit the space left
+    into a Table of their own, with the header on top, and hands back a PagedTable for the
+    rest. Rows are pulled from the ``rows`` iterator only as pages are filled, so rendering
+    time grows linearly with the number of rows (a single Table re-measures every remaining
+    row at each page break) and only about a page of rows is held in memory.
+    """
+
+    def __init__(self, header, rows, col_widths, style, pending=None, exhausted=False):
+        super().__init__()
+        self.header, self.rows, self.col_widths, self.style = header, rows, col_widths, style
+        # Rows pulled from the iterator but not placed yet, as (cells, estimated height)
+        self.pending = pending or []
+        self.exhausted = exhausted
+        self._header_height = None
+
+    def _table(self, rows):
+        table = Table([self.header] + rows, colWidths=self.col_widths, repeatRows=1)
+        table.setStyle(self.style)
+        return table
+
+    def _fill(self, width, height):
+        if self._header_height is None:
+            self._header_height = self._table([]).wrap(width, height)[1]
+        total = self._header_height + sum(row_height for _, row_height in self.pending)
+        while total <= height and not self.exhausted:
+            row = next(self.rows, None)
+            if row is None:
+                self.exhausted = True
+                break
+            # Measured on a one-row table, so padding and wrapping match the real layout
+            row_height = self._table([row]).wrap(width, height)[1] - self._header_height
+            self.pending.append((row, row_height))
+            total += row_height
+        return total
+
+    def wrap(self, availWidth, availHeight):
+        self.width, self.height = availWidth, self._fill(availWidth, availHeight)
+        return self.width, self.height
+
+    def split(self, availWidth, availHeight):
+        total = self._fill(availWidth, availHeight)
+        fits = len(self.pending)
+        while fits and total > availHeight:
+            fits -= 1
+            total -= self.pending[fits][1]
+        if not fits:
+            return []
+        parts = [self._table([row for row, _ in self.pending[:fits]])]
+        if self.pending[fits:] or not self.exhausted:
+            parts.append(PagedTable(self.header, self.rows, self.col_widths, self.style, self.pending[fits:], self.exhausted))
+        return parts
+
+    def draw(self):
+        table = self._table([row for row, _ in self.pending])
+        table.wrap(self.width, self.height)
+        table.drawOn(self.canv, 0, 0)
+
+
+class ReportLabBackend:
+    name = 'reportlab'
+
+    def render(self, invoice):
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(
+            buffer,
+            pagesize=A4,
+            leftMargin=PAGE_MARGIN, rightMargin=PAGE_MARGIN,
+            topMargin=PAGE_MARGIN, bottomMargin=PAGE_MARGIN,
+            title='Invoice %s' % invoice.invoice_number,
+        )
+        try:
+            with stage('pdf'):
+                doc.build(self.story(invoice))
+        except Exception as exc:
+            raise PDFRenderError(exc)
+        return buffer.getvalue()
+
+    def story(self, invoice):
+        return [
+            self.header(invoice),
+            Spacer(0, 10 * PX),
+            self.client(invoice),
+            Spacer(0, 18 * PX),
+            *(self.line_items(invoice) if invoice.line_item_count else [self.services(invoice)]),
+            self.words(invoice),
+            Spacer(0, 12 * PX),
+            self.signature(invoice),
+            Spacer(0, 18 * PX),
+            self.footer(),
+        ]
+
+    def header(self, invoice):
+        left_width = CONTENT_WIDTH * 0.63
+        right_width = CONTENT_WIDTH - left_width
+
+        details = Table(
+            [
+                [Paragraph('INVOICE NO', STYLES['detail_head']), Paragraph('DATE', STYLES['detail_head'])],
+                [
+                    Paragraph(escape(invoice.invoice_number), STYLES['detail_value']),
+                    Paragraph(format_date(invoice.invoice_date, 'd.m.Y'), STYLES['detail_value']),
+                ],
+            ],
+            colWidths=[right_width / 2] * 2,
+        )
+        details.setStyle(TableStyle([
+            ('GRID', (0, 0), (-1, -1), 2 * PX, colors.black),
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f9f9f9')),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('TOPPADDING', (0, 1), (-1, 1), 12 * PX),
+            ('BOTTOMPADDING', (0, 1), (-1, 1), 12 * PX),
+        ]))
+
+        right = Table([[Paragraph('INVOICE', STYLES['title'])], [details]], colWidths=[right_width])
+        right.setStyle(TableStyle([
+            ('LINEBELOW', (0, 0), (-1, 0), 4 * PX, colors.black),
+            ('TOPPADDING', (0, 0), (-1, 0), 20 * PX),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 20 * PX),
+            ('LEFTPADDING', (0, 1), (-1, 1), 0),
+            ('RIGHTPADDING', (0, 1), (-1, 1), 0),
+            ('TOPPADDING', (0, 1), (-1, 1), 0),
+            ('BOTTOMPADDING', (0, 1), (-1, 1), 0),
+        ]))
+
+        left = [
+            Paragraph('SLOG SOLUTIONS PVT. LTD.', STYLES['company_name']),
+            Paragraph(COMPANY_DETAILS % escape(invoice.sac_code), STYLES['company_details']),
+        ]
+        header = Table([[left, right]], colWidths=[left_width, right_width])
+        header.setStyle(TableStyle([
+            ('BOX', (0, 0), (-1, -1), 4 * PX, colors.black),
+            ('LINEAFTER', (0, 0), (0, -1), 4 * PX, colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('LEFTPADDING', (0, 0), (0, 0), 20 * PX),
+            ('TOPPADDING', (0, 0), (0, 0), 16 * PX),
+            ('BOTTOMPADDING', (0, 0), (0, 0), 16 * PX),
+            ('LEFTPADDING', (1, 0), (1, 0), 0),
+            ('RIGHTPADDING', (1, 0), (1, 0), 0),
+            ('TOPPADDING', (1, 0), (1, 0), 0),
+            ('BOTTOMPADDING', (1, 0), (1, 0), 0),
+        ]))
+        return header
+
+    def client(self, invoice):
+        block = Table(
+            [[Paragraph('%s<br/>%s' % (_text(invoice.client_name), _text(invoice.client_address)), STYLES['text'])]],
+            colWidths=[CONTENT_WIDTH],
+        )
+        block.setStyle(TableStyle([
+            ('BOX', (0, 0), (-1, -1), 2 * PX, colors.black),
+            ('LEFTPADDING', (0, 0), (-1, -1), 14 * PX),
+            ('TOPPADDING', (0, 0), (-1, -1), 12 * PX),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 12 * PX),
+        ]))
+        return block
+
+    def description(self, invoice):
+        lines = []
+        if invoice.contract_no:
+            lines.append('<b>Contract No:</b> %s' % escape(invoice.contract_no))
+        if invoice.contract_date:
+            lines.append('<b>Contract Date:</b> %s' % format_date(invoice.contract_date, 'd-M-Y'))
+        lines.append('')
+        lines.append(_text(invoice.service_description))
+        return Paragraph('<br/>'.join(lines), STYLES['description'])
+
+    def gst_rows(self, invoice):
+        if is_intra_state(invoice.state):
+            return [
+                ('CGST @ %s%%' % invoice.cgst_rate, invoice.cgst_amount),
+                ('SGST @ %s%%' % invoice.sgst_rate, invoice.sgst_amount),
+            ]
+        return [('IGST @ %s%%' % invoice.igst_rate, invoice.igst_amount)]
+
+    def services(self, invoice):
+        rows = [
+            [Paragraph('DESCRIPTION OF SERVICE', STYLES['table_head']), Paragraph('AMOUNT (GST Bifurcation)', STYLES['table_head'])],
+            [self.description(invoice), Paragraph(_amount(invoice.base_amount), STYLES['amount'])],
+        ]
+        for label, amount in self.gst_rows(invoice) + [('Round Off', invoice.round_off)]:
+            rows.append([Paragraph(escape(label), STYLES['text']), Paragraph(_amount(amount), STYLES['amount'])])
+        rows.append([Paragraph('<b>Total</b>', STYLES['text']), Paragraph(_amount(invoice.total_amount), STYLES['amount'])])
+
+        table = Table(rows, colWidths=[CONTENT_WIDTH * 0.75, CONTENT_WIDTH * 0.25], repeatRows=1)
+        table.setStyle(TableStyle([
+            ('GRID', (0, 0), (-1, -1), 1 * PX, colors.black),
+            ('BOX', (0, 0), (-1, -1), 2 * PX, colors.black),
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f0f0f0')),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ]))
+        return table
+
+    # Itemised invoices: #, description, SAC, quantity, rate, GST %, taxable value
+    LINE_COLUMNS = (0.05, 0.47, 0.09, 0.08, 0.11, 0.07, 0.13)
+    LINE_HEADERS = ('#', 'DESCRIPTION OF SERVICE', 'SAC', 'QTY', 'RATE', 'GST %', 'TAXABLE VALUE')
+    LINE_STYLE = TableStyle([
+        ('GRID', (0, 0), (-1, -1), 1 * PX, colors.black),
+        ('BOX', (0, 0), (-1, -1), 2 * PX, colors.black),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f0f0f0')),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('FONT', (0, 1), (-1, -1), 'Helvetica', 11 * PX),
+        ('ALIGN', (0, 1), (0, -1), 'RIGHT'),
+        ('ALIGN', (3, 1), (-1, -1), 'RIGHT'),
+    ])
+
+    def line_items(self, invoice):
+        """
+        The contract reference, the line-item table (header repeated on every page) and the
+        GST totals.
+        """
+        flowables = []
+        contract = []
+        if invoice.contract_no:
+            contract.append('<b>Contract No:</b> %s' % escape(invoice.contract_no))
+        if invoice.contract_date:
+            contract.append('<b>Contract Date:</b> %s' % format_date(invoice.contract_date, 'd-M-Y'))
+        if contract:
+            flowables.append(Paragraph(' &nbsp; '.join(contract), STYLES['description']))
+            flowables.append(Spacer(0, 6 * PX))
+
+        widths = [CONTENT_WIDTH * width for width in self.LINE_COLUMNS]
+        rows = (
+            [
+                str(line['position']),
+                Paragraph(_text(line['description']), STYLES['line']),
+                line['sac_code'],
+                floatformat(line['quantity'], -2),
+                _amount(line['rate']),
+                floatformat(line['gst_rate'], -2),
+                _amount(line['base_amount']),
+            ]
+            for line in line_items.display_rows(invoice)
+        )
+        header = [Paragraph(header, STYLES['table_head']) for header in self.LINE_HEADERS]
+        flowables.append(PagedTable(header, rows, widths, self.LINE_STYLE))
+
+        totals = [('Taxable Value', invoice.base_amount)]
+        totals += [(label.split(' @ ')[0], amount) for label, amount in self.gst_rows(invoice)]
+        totals += [('Round Off', invoice.round_off), ('Total', invoice.total_amount)]
+        summary = Table(
+            [[Paragraph('<b>%s</b>' % label if label == 'Total' else label, STYLES['text']),
+              Paragraph(_amount(amount), STYLES['amount'])] for label, amount in totals],
+            colWidths=[sum(widths[:-1]), widths[-1]],
+        )
+        summary.setStyle(TableStyle([
+            ('GRID', (0, 0), (-1, -1), 1 * PX, colors.black),
+            ('BOX', (0, 0), (-1, -1), 2 * PX, colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ]))
+        flowables.append(summary)
+        return flowables
+
+    def words(self, invoice):
+        block = Table(
+            [[Paragraph('(In words) Rs. %s only.' % amount_in_words(invoice.total_amount), STYLES['words'])]],
+            colWidths=[CONTENT_WIDTH],
+        )
+        block.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f8f9fa')),
+            ('LEFTPADDING', (0, 0), (-1, -1), 15 * PX),
+        ]))
+        return block
+
+    def signature(self, invoice):
+        left = [
+            Paragraph('<b>For SLOG Solutions Pvt. Ltd.</b>', STYLES['text']),
+            _image(invoice.signature, 160 * PX) or Spacer(0, 80 * PX),
+            Paragraph('<b>Authorize Signature</b>', STYLES['text']),
+        ]
+        right = ''
+        if invoice.include_stamp and invoice.stamp:
+            right = _image(invoice.stamp, 140 * PX, 120 * PX) or ''
+
+        block = Table([[left, right]], colWidths=[CONTENT_WIDTH - 160 * PX, 160 * PX])
+        block.setStyle(TableStyle([
+            ('VALIGN', (0, 0), (0, 0), 'TOP'),
+            ('VALIGN', (1, 0), (1, 0), 'MIDDLE'),
+            ('ALIGN', (1, 0), (1, 0), 'CENTER'),
+            ('LEFTPADDING', (0, 0), (0, 0), 20 * PX),
+        ]))
+        return block
+
+    def footer(self):
+        block = Table(
+            [[Paragraph('FOR NEFT/RTGS', STYLES['footer_left']), Paragraph(BANK_DETAILS, STYLES['footer_right'])]],
+            colWidths=[CONTENT_WIDTH * 0.3, CONTENT_WIDTH * 0.7],
+        )
+        block.setStyle(TableStyle([
+            ('BOX', (0, 0), (-1, -1), 2 * PX, colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('LEFTPADDING', (0, 0), (-1, -1), 20 * PX),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 20 * PX),
+        ]))
+        return block
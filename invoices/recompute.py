@@ -0,0 +1,146 @@
+"""
+Recompute the GST amounts of many invoices at once.
+
+Invoice.save() derives base, CGST/SGST or IGST and round-off from the total one row at a time.
+This runs the same calculation (gst.calculate_amounts) over a queryset of invoices read in
+chunks of ``chunk_size`` by id, optionally after correcting their GST rates or state first.
+The amounts are compared with the stored ones at the precision the database keeps (two
+decimal places, rounded as save() rounds them), and only the invoices that actually change
+are written back, one batched UPDATE per chunk. Each chunk is its own transaction and sends
+``invoices_bulk_updated``, which updates the GST summary and re-queues the PDFs.
+
+The UPDATE is a single parameterised statement run with executemany() rather than
+QuerySet.bulk_update(): bulk_update builds a CASE WHEN expression per field and row, which
+for thousands of rows costs far more than the database work itself.
+
+Itemised invoices take their amounts from their lines (line_items.py): they are skipped
+unless their state changes, in which case their lines are recomputed one invoice at a time.
+"""
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import line_items
+from .gst import AMOUNT_FIELDS, calculate_amounts
+from .gst_summary import stored_value
+from .models import Invoice
+from .signals import invoices_bulk_updated
+
+DEFAULT_CHUNK_SIZE = 2000
+RATE_FIELDS = ('cgst_rate', 'sgst_rate', 'igst_rate')
+# Fields a recompute may be told to set before recalculating
+SETTABLE_FIELDS = RATE_FIELDS + ('state',)
+LOAD_FIELDS = ('id', 'invoice_number', 'invoice_date', 'total_amount', 'state', 'line_item_count') + RATE_FIELDS + AMOUNT_FIELDS
+
+
+class RecomputeResult:
+    def __init__(self):
+        self.scanned = 0
+        self.changed = 0
+        self.itemised = 0  # itemised invoices recomputed from their lines
+        self.skipped = 0   # itemised invoices left alone
+        self.changes = []  # [(invoice_number, {field: (old, new)})], up to keep_changes invoices
+        self.dry_run = False
+
+
+def _stored(invoice, field):
+    value = getattr(invoice, field)
+    return stored_value(field, value) if field in AMOUNT_FIELDS or field in RATE_FIELDS else value
+
+
+def _apply(invoice, updates):
+    """
+    Set ``updates`` and the recalculated amounts on ``invoice``; returns ``{field: (old, new)}``
+    for the fields whose stored value changes.
+    """
+    # Loaded from the database, so already at the stored precision
+    old = {field: getattr(invoice, field) for field in updates.keys() | set(AMOUNT_FIELDS)}
+    for field, value in updates.items():
+        setattr(invoice, field, value)
+    amounts = calculate_amounts(
+        invoice.total_amount, invoice.state, invoice.cgst_rate, invoice.sgst_rate, invoice.igst_rate
+    )
+    for field, value in amounts.items():
+        setattr(invoice, field, value)
+    diff = {}
+    for field, old_value in old.items():
+        new_value = _stored(invoice, field)
+        if new_value != old_value:
+            diff[field] = (old_value, new_value)
+    return diff
+
+
+def _write(invoices, fields, using='default'):
+    # UPDATE ... WHERE <pk> = %s for every invoice, values prepared as save() would
+    connection = connections[using]
+    model_fields = [Invoice._meta.get_field(field) for field in fields]
+    sql = 'UPDATE %s SET %s WHERE %s = %%s' % (
+        connection.ops.quote_name(Invoice._meta.db_table),
+        ', '.join('%s = %%s' % connection.ops.quote_name(field.column) for field in model_fields),
+        connection.ops.quote_name(Invoice._meta.pk.column),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [field.get_db_prep_save(getattr(invoice, field.attname), connection) for field in model_fields] + [invoice.pk]
+            for invoice in invoices
+        ])
+
+
+def recompute(queryset, updates=None, dry_run=False, chunk_size=DEFAULT_CHUNK_SIZE, keep_changes=0, progress=None):
+    """
+    Recalculate the GST amounts of the invoices in ``queryset`` after setting ``updates`` (a
+    dict of SETTABLE_FIELDS) on them, and save the ones that change. With ``dry_run`` nothing
+    is written. Returns a RecomputeResult; the field-level changes of the first
+    ``keep_changes`` changed invoices are listed in ``changes``.
+    """
+    updates = dict(updates or {})
+    unknown = set(updates) - set(SETTABLE_FIELDS)
+    if unknown:
+        raise ValueError('Cannot set %s' % ', '.join(sorted(unknown)))
+    fields = list(AMOUNT_FIELDS) + [field for field in SETTABLE_FIELDS if field in updates]
+
+    result = RecomputeResult()
+    result.dry_run = dry_run
+    queryset = queryset.order_by('id').only(*LOAD_FIELDS)
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return result
+        last_id = chunk[-1].id
+        result.scanned += len(chunk)
+
+        changed, previous, itemised = [], [], []
+        for invoice in chunk:
+            if invoice.line_item_count:
+                if 'state' in updates and invoice.state != updates['state']:
+                    itemised.append(invoice)
+                else:
+                    result.skipped += 1
+                continue
+            before = {field: getattr(invoice, field) for field in LOAD_FIELDS}
+            diff = _apply(invoice, updates)
+            if not diff:
+                continue
+            changed.append(invoice)
+            previous.append(Invoice(**before))
+            if len(result.changes) < keep_changes:
+                result.changes.append((invoice.invoice_number, diff))
+        result.changed += len(changed)
+        result.itemised += len(itemised)
+
+        if not dry_run and (changed or itemised):
+            with transaction.atomic():
+                if changed:
+                    now = timezone.now()
+                    for invoice in changed:
+                        # What save() would also have changed
+                        invoice.updated_at = now
+                        invoice.pdf_status = Invoice.PdfStatus.PENDING
+                    _write(changed, fields + ['updated_at', 'pdf_status'])
+                    invoices_bulk_updated.send(sender=Invoice, instances=changed, previous=previous, fields=fields)
+                for invoice in itemised:
+                    invoice = Invoice.objects.get(pk=invoice.pk)
+                    invoice.state = updates['state']
+                    line_items.recalculate(invoice)
+        if progress:
+            progress(result)
@@ -0,0 +1,183 @@
+"""
+Full-text search over invoices (number, client, address, contract number and description).
+
+On SQLite the text is indexed in an FTS5 table, ``invoices_invoice_fts``, whose rowid is the
+invoice id. The table is kept in sync by the signal handlers in signals.py (save, delete and
+bulk creation) inside the same transaction as the write. On PostgreSQL a GIN expression index
+over the same ``to_tsvector`` the queries use makes any sync unnecessary. Any other database,
+or SQLite without FTS5, falls back to ``icontains`` lookups.
+
+Every word of the query must match, as a prefix, in any of the fields. Results are ranked by
+bm25 / ts_rank, with the invoice number and contract number weighted highest.
+
+Archived invoices (archive.py) are not indexed. ``search()`` also takes an ArchivedInvoice
+queryset and matches it with ``icontains`` lookups, newest first; the number and client name are
+columns, the other fields are read from ``data``.
+"""
+import re
+
+from django.db import connections, transaction
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from .models import ArchivedInvoice, Invoice
+
+SEARCH_FIELDS = ('invoice_number', 'client_name', 'client_address', 'contract_no', 'service_description')
+# bm25() column weights, in SEARCH_FIELDS order
+FTS_WEIGHTS = (10.0, 4.0, 2.0, 10.0, 1.0)
+FTS_TABLE = 'invoices_invoice_fts'
+POSTGRES_INDEX = 'invoice_search_idx'
+MAX_TERMS = 16
+
+# (alias, database name) -> whether the FTS5 table exists there
+_fts_tables = {}
+
+
+def terms(query):
+    return re.findall(r'\w+', query or '')[:MAX_TERMS]
+
+
+def postgres_search_vector():
+    from django.contrib.postgres.search import SearchVector
+
+    return (
+        SearchVector('invoice_number', 'contract_no', weight='A', config='simple')
+        + SearchVector('client_name', weight='B', config='simple')
+        + SearchVector('client_address', weight='C', config='simple')
+        + SearchVector('service_description', weight='D', config='simple')
+    )
+
+
+def _has_fts_table(connection):
+    key = (connection.alias, connection.settings_dict['NAME'])
+    if key not in _fts_tables:
+        with connection.cursor() as cursor:
+            _fts_tables[key] = FTS_TABLE in connection.introspection.table_names(cursor)
+    return _fts_tables[key]
+
+
+def backend(connection):
+    if connection.vendor == 'sqlite' and _has_fts_table(connection):
+        return 'fts5'
+    if connection.vendor == 'postgresql':
+        return 'postgres'
+    return 'like'
+
+
+def search(queryset, query):
+    """
+    Narrow an Invoice queryset to the invoices matching ``query``, best matches first (the
+    rank is available as ``search_rank``).
+    """
+    words = terms(query)
+    if not words:
+        return queryset.none()
+    if queryset.model is ArchivedInvoice:
+        return _search_archived(queryset, words)
+    connection = connections[queryset.db]
+    kind = backend(connection)
+
+    if kind == 'fts5':
+        # Quoted so FTS5 operators in the input are taken literally; \w+ never contains quotes
+        match = ' '.join('"%s"*' % word for word in words)
+        # The matching rowids select the invoices; the rank is then looked up for those rows only
+        matching = RawSQL('SELECT rowid FROM %s WHERE %s MATCH %%s' % (FTS_TABLE, FTS_TABLE), [match])
+        rank = RawSQL('SELECT bm25(%s, %s) FROM %s WHERE %s MATCH %%s AND rowid = %s.%s' % (
+            FTS_TABLE, ', '.join(str(weight) for weight in FTS_WEIGHTS), FTS_TABLE, FTS_TABLE,
+            connection.ops.quote_name(Invoice._meta.db_table), connection.ops.quote_name(Invoice._meta.pk.column),
+        ), [match], output_field=FloatField())
+        return queryset.filter(pk__in=matching).annotate(search_rank=rank).order_by('search_rank', '-created_at', '-id')
+
+    if kind == 'postgres':
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        vector = postgres_search_vector()
+        tsquery = SearchQuery(' & '.join('%s:*' % word for word in words), search_type='raw', config='simple')
+        return queryset.annotate(
+            search_vector=vector, search_rank=SearchRank(vector, tsquery),
+        ).filter(search_vector=tsquery).order_by('-search_rank', '-created_at', '-id')
+
+    for word in words:
+        matches = Q()
+        for field in SEARCH_FIELDS:
+            matches |= Q(**{'%s__icontains' % field: word})
+        queryset = queryset.filter(matches)
+    return queryset
+
+
+def _search_archived(queryset, words):
+    lookups = ['%s__icontains' % field if field in ('invoice_number', 'client_name') else 'data__%s__icontains' % field
+               for field in SEARCH_FIELDS]
+    for word in words:
+        matches = Q()
+        for lookup in lookups:
+            matches |= Q(**{lookup: word})
+        queryset = queryset.filter(matches)
+    return queryset.order_by('-invoice_date', '-id')
+
+
+def update_index(invoices, using='default'):
+    """
+    (Re)index ``invoices`` on SQLite; a no-op elsewhere.
+    """
+    connection = connections[using]
+    if backend(connection) != 'fts5':
+        return
+    invoices = [invoice for invoice in invoices if invoice.pk is not None]
+    if not invoices:
+        return
+    with connection.cursor() as cursor:
+        # FTS5 resolves the rowid conflict of an already indexed invoice by replacing its row
+        cursor.executemany(
+            'INSERT OR REPLACE INTO %s (rowid, %s) VALUES (%s)' % (
+                FTS_TABLE, ', '.join(SEARCH_FIELDS), ', '.join(['%s'] * (len(SEARCH_FIELDS) + 1))
+            ),
+            [[invoice.pk] + [getattr(invoice, field) or '' for field in SEARCH_FIELDS] for invoice in invoices],
+        )
+
+
+def remove_from_index(pks, using='default'):
+    connection = connections[using]
+    if backend(connection) != 'fts5':
+        return
+    with connection.cursor() as cursor:
+        _delete_rows(cursor, list(pks))
+
+
+def _delete_rows(cursor, pks):
+    # Stay well below SQLite's bound parameter limit
+    for start in range(0, len(pks), 500):
+        chunk = pks[start:start + 500]
+        cursor.execute(
+            'DELETE FROM %s WHERE rowid IN (%s)' % (FTS_TABLE, ', '.join(['%s'] * len(chunk))), chunk
+        )
+
+
+def forget_backends():
+    """
+    Forget which databases have the FTS5 table; called after migrations, which create or drop it.
+    """
+    _fts_tables.clear()
+
+
+def rebuild(using='default'):
+    """
+    Re-index every invoice from scratch. Returns the number of invoices indexed, or None when
+    the database needs no separate index maintenance.
+    """
+    connection = connections[using]
+    kind = backend(connection)
+    if kind == 'like':
+        return None
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if kind == 'postgres':
+            cursor.execute('REINDEX INDEX %s' % POSTGRES_INDEX)
+            return None
+        cursor.execute('DELETE FROM %s' % FTS_TABLE)
+        cursor.execute('INSERT INTO %s (rowid, %s) SELECT id, %s FROM %s' % (
+            FTS_TABLE, ', '.join(SEARCH_FIELDS),
+            ', '.join("COALESCE(%s, '')" % field for field in SEARCH_FIELDS), Invoice._meta.db_table,
+        ))
+        indexed = cursor.rowcount
+        cursor.execute("INSERT INTO %s (%s) VALUES ('optimize')" % (FTS_TABLE, FTS_TABLE))
+    return indexed
@@ -0,0 +1,74 @@
+"""
+Session backend: Django's cached_db store with a short-lived cache in front of the database.
+Opt in with SESSION_ENGINE = 'invoices.sessions'.
+
+``require_login_session`` reads the session on every request; with the plain database backend
+that is a ``django_session`` SELECT per page view. This store answers those reads from the
+``sessions`` cache and only goes to the database on a miss, so each session is read from SQLite
+about once per INVOICE_SESSION_CACHE_TIMEOUT seconds.
+
+The database stays the source of truth. With the default in-process LocMemCache each worker has
+its own cache, so after a logout the other workers may accept the old session until their cached
+copy expires; the timeout bounds that window (Django's own cached_db keeps entries for the
+session's whole age). Pointing the ``sessions`` cache at a shared backend such as Redis closes
+it: the logout deletes the one cached copy.
+"""
+from django.conf import settings
+from django.contrib.sessions.backends import cached_db
+from django.db import transaction
+from django.utils import timezone
+
+
+def get_cache_timeout():
+    return getattr(settings, 'INVOICE_SESSION_CACHE_TIMEOUT', 60)
+
+
+class _BoundedCache:
+    """
+    Wraps the session cache so no entry outlives ``timeout`` seconds.
+    """
+
+    def __init__(self, cache, timeout):
+        self._cache, self._timeout = cache, timeout
+
+    def _bounded(self, timeout):
+        return self._timeout if timeout is None else min(timeout, self._timeout)
+
+    def set(self, key, value, timeout=None):
+        return self._cache.set(key, value, self._bounded(timeout))
+
+    async def aset(self, key, value, timeout=None):
+        return await self._cache.aset(key, value, self._bounded(timeout))
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def __getattr__(self, name):
+        return getattr(self._cache, name)
+
+    def __repr__(self):
+        return repr(self._cache)
+
+
+class SessionStore(cached_db.SessionStore):
+    cache_key_prefix = 'invoices.sessions'
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._cache = _BoundedCache(self._cache, get_cache_timeout())
+
+
+def prune_expired(batch_size=1000):
+    """
+    Delete expired sessions from the database a batch at a time, so the write lock SQLite takes
+    is held briefly. Returns the number of sessions deleted. Cached copies expire on their own.
+    """
+    model = SessionStore.get_model_class()
+    now = timezone.now()
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            keys = list(model.objects.filter(expire_date__lt=now).values_list('pk', flat=True)[:batch_size])
+            if not keys:
+                return deleted
+            deleted += model.objects.filter(pk__in=keys).delete()[0]
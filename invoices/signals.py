@@ -0,0 +1,115 @@
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from . import gst_summary, images, pdf_cache, pdf_jobs, search
+from .models import Invoice, Signature, Stamp
+
+# Sent after Invoice.objects.bulk_create(), which bypasses save() and post_save.
+# Arguments: sender (Invoice), instances (the created invoices, with pks).
+invoices_bulk_created = Signal()
+
+# Sent after invoices were updated in bulk without save(), e.g. by recompute.py's batched UPDATE.
+# Arguments: sender (Invoice), instances (the updated invoices), previous (copies of the same
+# invoices with the values they had before, in the same order), fields (the fields written).
+invoices_bulk_updated = Signal()
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def invalidate_invoice_pdf(sender, instance, **kwargs):
+    pdf_cache.invalidate(instance.pk)
+
+
+@receiver(pre_save, sender=Invoice)
+def remember_gst_contribution(sender, instance, using='default', update_fields=None, **kwargs):
+    if gst_summary.affects_summary(update_fields):
+        gst_summary.remember_previous(instance, using=using)
+
+
+@receiver(post_save, sender=Invoice)
+def update_gst_summary(sender, instance, using='default', update_fields=None, **kwargs):
+    if gst_summary.affects_summary(update_fields):
+        gst_summary.record_save(instance, using=using, update_fields=update_fields)
+
+
+@receiver(post_delete, sender=Invoice)
+def subtract_gst_summary(sender, instance, using='default', **kwargs):
+    gst_summary.record_delete(instance, using=using)
+
+
+@receiver(invoices_bulk_created, sender=Invoice)
+def add_bulk_created_to_gst_summary(sender, instances, **kwargs):
+    gst_summary.apply(gst_summary.collect(instances))
+
+
+@receiver(post_save, sender=Invoice)
+def index_invoice(sender, instance, raw=False, using='default', update_fields=None, **kwargs):
+    if update_fields is None or set(update_fields) & set(search.SEARCH_FIELDS):
+        search.update_index([instance], using=using)
+
+
+@receiver(post_delete, sender=Invoice)
+def unindex_invoice(sender, instance, using='default', **kwargs):
+    search.remove_from_index([instance.pk], using=using)
+
+
+@receiver(post_migrate)
+def forget_search_backends(sender, **kwargs):
+    # Migrations create or drop the FTS5 table behind the search module's back
+    search.forget_backends()
+
+
+@receiver(post_save, sender=Invoice)
+def queue_invoice_pdf(sender, instance, raw=False, **kwargs):
+    if not raw:
+        pdf_jobs.enqueue_on_commit([instance.pk])
+
+
+@receiver(invoices_bulk_created, sender=Invoice)
+def queue_bulk_created_pdfs(sender, instances, **kwargs):
+    pdf_jobs.enqueue_on_commit(invoice.pk for invoice in instances)
+
+
+@receiver(invoices_bulk_created, sender=Invoice)
+def index_bulk_created(sender, instances, **kwargs):
+    search.update_index(instances)
+
+
+@receiver(invoices_bulk_updated, sender=Invoice)
+def update_gst_summary_bulk(sender, instances, previous, **kwargs):
+    gst_summary.apply(gst_summary.merge(gst_summary.collect(instances), gst_summary.collect(previous, sign=-1)))
+
+
+@receiver(invoices_bulk_updated, sender=Invoice)
+def invalidate_bulk_updated_pdfs(sender, instances, **kwargs):
+    pks = [invoice.pk for invoice in instances]
+    pdf_cache.invalidate_many(pks)
+    pdf_jobs.enqueue_on_commit(pks)
+
+
+@receiver(invoices_bulk_updated, sender=Invoice)
+def index_bulk_updated(sender, instances, fields, **kwargs):
+    if set(fields) & set(search.SEARCH_FIELDS):
+        search.update_index(instances)
+
+
+@receiver(post_save, sender=Signature)
+@receiver(post_save, sender=Stamp)
+def build_image_variants(sender, instance, raw=False, **kwargs):
+    # Made once per upload; an unchanged or duplicate image already has its variants
+    if not raw:
+        images.ensure_variants(instance)
+
+
+@receiver(post_save, sender=Signature)
+@receiver(post_save, sender=Stamp)
+def invalidate_image_pdfs(sender, instance, created=False, **kwargs):
+    # A replaced signature/stamp image changes the PDF of every invoice that uses it
+    if created:
+        return
+    lookup = 'signature' if sender is Signature else 'stamp'
+    invoices = Invoice.objects.filter(**{lookup: instance})
+    pks = list(invoices.values_list('pk', flat=True))
+    pdf_cache.invalidate_many(pks)
+    invoices.update(pdf_status=Invoice.PdfStatus.PENDING)
+    pdf_jobs.enqueue_on_commit(pks)
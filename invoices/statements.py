@@ -0,0 +1,257 @@
+"""
+Client statements: one PDF per client and period, with a cover page summarising the invoices
+followed by the invoices themselves in date order.
+
+A client is a (client_name, client_address) pair, since the name alone is usually just "TO: THE
+COMMANDING OFFICER,". Invoices whose PDF is already in the cache (pdf_cache.py) are copied
+straight from the cache files; the rest are rendered by the bulk_pdf process pool, at most
+``2 * workers`` at a time, while earlier ones are sent. The statement is written out
+(streaming.stream_pdf) one invoice at a time as the PDFs arrive, so the view starts sending
+it after the cover page and holds one invoice in memory, not the whole statement. Images
+repeated across invoices, such as the signature and stamp, are stored only once.
+
+An invoice that fails to render is replaced by a page giving the error, as the ZIP export
+lists failures in errors.txt: by then the response is under way. Every uncached invoice is
+rendered during the request, so the view refuses periods with more than
+INVOICE_STATEMENT_MAX_INVOICES invoices (``check_size``); the build_statement command has no
+limit.
+
+Invoices of closed years are listed from ArchivedInvoice and their PDFs copied from the
+archive packs (archive.py), so a statement may span a closed and an open year.
+"""
+import hashlib
+import io
+from decimal import Decimal
+from itertools import chain
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils.dateformat import format as format_date
+from django.utils.html import escape
+
+from . import archive, pdf_cache
+from .bulk_pdf import iter_rendered_pdfs
+from .models import ArchivedInvoice, Invoice
+from .pdf import PDFRenderError
+from .streaming import stream_pdf
+
+# ReportLab and pypdf are imported where they are used, so the forms that list clients do not
+# load them at startup
+
+COVER_COLUMNS = (0.06, 0.22, 0.14, 0.16, 0.14, 0.12, 0.16)
+COVER_HEADERS = ('#', 'INVOICE NO', 'DATE', 'TAXABLE VALUE', 'GST', 'ROUND OFF', 'TOTAL')
+
+
+def client_key(client_name, client_address):
+    """
+    Short stable token for a client, for form choices and URLs.
+    """
+    raw = '%s\n%s' % (client_name or '', client_address or '')
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def list_clients(queryset=None):
+    """
+    ``[(key, client_name, client_address)]`` of every distinct client, sorted by name and address.
+    Without ``queryset`` the clients of archived invoices are included.
+    """
+    if queryset is None:
+        queryset = Invoice.objects.all()
+        archived = ArchivedInvoice.objects.values_list('client_name', 'data__client_address').distinct()
+    else:
+        archived = []
+    pairs = set(queryset.values_list('client_name', 'client_address').distinct())
+    pairs.update((name, address or '') for name, address in archived)
+    return [(client_key(name, address), name, address) for name, address in sorted(pairs)]
+
+
+def _statement_querysets(client_name, client_address, date_from, date_to):
+    period = {'invoice_date__gte': date_from, 'invoice_date__lte': date_to}
+    return (
+        Invoice.objects.filter(client_name=client_name, client_address=client_address, **period)
+        .select_related('signature', 'stamp'),
+        ArchivedInvoice.objects.filter(client_name=client_name, data__client_address=client_address, **period)
+        .defer('data'),
+    )
+
+
+def statement_invoices(client_name, client_address, date_from, date_to):
+    """
+    The client's invoices dated in the period, oldest first: Invoice rows, and ArchivedInvoice
+    rows for closed years.
+    """
+    invoices, archived = _statement_querysets(client_name, client_address, date_from, date_to)
+    return sorted(chain(invoices, archived), key=lambda invoice: (invoice.invoice_date, invoice.pk))
+
+
+def max_invoices():
+    return getattr(settings, 'INVOICE_STATEMENT_MAX_INVOICES', 500)
+
+
+def check_size(client_name, client_address, date_from, date_to):
+    """
+    Raise ValidationError when the period holds more invoices than one statement may.
+    """
+    limit = max_invoices()
+    count = sum(
+        queryset.count() for queryset in _statement_querysets(client_name, client_address, date_from, date_to)
+    )
+    if limit is not None and count > limit:
+        raise ValidationError(
+            'The client has %(count)d invoices in this period; a statement can hold %(limit)d. Choose a shorter period.',
+            params={'count': count, 'limit': limit},
+        )
+
+
+def render_cover(client_name, client_address, date_from, date_to, invoices):
+    """
+    The cover page(s) as PDF bytes: the client, the period and one row per invoice with totals.
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    from .pdf_reportlab import CONTENT_WIDTH, PAGE_MARGIN, PX, STYLES, PagedTable, _amount, _text
+
+    widths = [CONTENT_WIDTH * width for width in COVER_COLUMNS]
+    totals = dict.fromkeys(('base', 'gst', 'round_off', 'total'), Decimal(0))
+    rows = []
+    for number, invoice in enumerate(invoices, 1):
+        gst = invoice.cgst_amount + invoice.sgst_amount + invoice.igst_amount
+        totals['base'] += invoice.base_amount
+        totals['gst'] += gst
+        totals['round_off'] += invoice.round_off
+        totals['total'] += invoice.total_amount
+        rows.append([
+            str(number), invoice.invoice_number, format_date(invoice.invoice_date, 'd.m.Y'),
+            _amount(invoice.base_amount), _amount(gst), _amount(invoice.round_off), _amount(invoice.total_amount),
+        ])
+    header = [Paragraph(header, STYLES['table_head']) for header in COVER_HEADERS]
+    table_style = TableStyle([
+        ('GRID', (0, 0), (-1, -1), 1 * PX, colors.black),
+        ('BOX', (0, 0), (-1, -1), 2 * PX, colors.black),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f0f0f0')),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('FONT', (0, 1), (-1, -1), 'Helvetica', 11 * PX),
+        ('ALIGN', (0, 1), (0, -1), 'RIGHT'),
+        ('ALIGN', (3, 1), (-1, -1), 'RIGHT'),
+    ])
+    summary = Table(
+        [['Total (%d invoices)' % len(rows), _amount(totals['base']), _amount(totals['gst']),
+          _amount(totals['round_off']), _amount(totals['total'])]],
+        colWidths=[sum(widths[:3])] + widths[3:],
+    )
+    summary.setStyle(TableStyle([
+        ('GRID', (0, 0), (-1, -1), 1 * PX, colors.black),
+        ('BOX', (0, 0), (-1, -1), 2 * PX, colors.black),
+        ('FONT', (0, 0), (-1, -1), 'Helvetica-Bold', 11 * PX),
+        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+    ]))
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buffer, pagesize=A4,
+        leftMargin=PAGE_MARGIN, rightMargin=PAGE_MARGIN, topMargin=PAGE_MARGIN, bottomMargin=PAGE_MARGIN,
+        title='Statement %s to %s' % (date_from, date_to),
+    )
+    doc.build([
+        Paragraph('SLOG SOLUTIONS PVT. LTD.', STYLES['company_name']),
+        Paragraph('STATEMENT OF INVOICES', STYLES['title']),
+        Spacer(0, 12 * PX),
+        Paragraph('%s<br/>%s' % (_text(client_name), _text(client_address)), STYLES['text']),
+        Spacer(0, 6 * PX),
+        Paragraph('<b>Period:</b> %s to %s' % (
+            escape(format_date(date_from, 'd.m.Y')), escape(format_date(date_to, 'd.m.Y'))
+        ), STYLES['text']),
+        Spacer(0, 12 * PX),
+        PagedTable(header, iter(rows), widths, table_style),
+        summary,
+    ])
+    return buffer.getvalue()
+
+
+def render_error_page(invoice, error):
+    """
+    A one-page PDF standing in for an invoice that could not be rendered.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import Paragraph, SimpleDocTemplate
+
+    from .pdf_reportlab import PAGE_MARGIN, STYLES, _text
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buffer, pagesize=A4,
+        leftMargin=PAGE_MARGIN, rightMargin=PAGE_MARGIN, topMargin=PAGE_MARGIN, bottomMargin=PAGE_MARGIN,
+    )
+    doc.build([
+        Paragraph('Invoice %s could not be rendered' % _text(invoice.invoice_number or str(invoice.pk)),
+                  STYLES['title']),
+        Paragraph(_text(error), STYLES['text']),
+    ])
+    return buffer.getvalue()
+
+
+def iter_invoice_pdfs(invoices, workers=None):
+    """
+    Yield ``(invoice, pdf file, error)`` for ``invoices`` in order. Archived invoices are read
+    from their packs and cached PDFs from the cache; the rest are rendered in parallel.
+    ``pdf file`` is None when rendering failed with ``error``.
+    """
+    live = [invoice for invoice in invoices if not isinstance(invoice, ArchivedInvoice)]
+    keys = {invoice.pk: pdf_cache.invoice_cache_key(invoice) for invoice in live}
+    missing = [invoice.pk for invoice in live if not pdf_cache.exists(invoice.pk, keys[invoice.pk])]
+    rendered = iter_rendered_pdfs(missing, workers)
+    missing = set(missing)
+    try:
+        for invoice in invoices:
+            if isinstance(invoice, ArchivedInvoice):
+                yield invoice, archive.open_pdf(invoice), None
+                continue
+            key = keys[invoice.pk]
+            if invoice.pk not in missing:
+                cached = pdf_cache.open_entry(invoice.pk, key)
+                if cached is None:
+                    # Evicted since it was checked: render it here
+                    try:
+                        cached = io.BytesIO(pdf_cache.get_or_render(invoice, key=key))
+                    except PDFRenderError as exc:
+                        yield invoice, None, str(exc)
+                        continue
+                yield invoice, cached, None
+                continue
+            pk, invoice_number, data, error = next(rendered)
+            yield invoice, (None if error else io.BytesIO(data)), error
+    finally:
+        rendered.close()
+
+
+def stream_statement(client_name, client_address, date_from, date_to, invoices, workers=None, errors=None):
+    """
+    Yield the statement PDF for the client and period chunk by chunk; ``invoices`` is the
+    list from statement_invoices(). Invoices that failed to render get an error page, and
+    their messages are appended to the list ``errors`` if one is given.
+    """
+    def documents():
+        yield 'Summary', io.BytesIO(render_cover(client_name, client_address, date_from, date_to, invoices))
+        for invoice, pdf, error in iter_invoice_pdfs(invoices, workers):
+            if error:
+                message = 'Invoice %s: %s' % (invoice.invoice_number or invoice.pk, error)
+                if errors is not None:
+                    errors.append(message)
+                pdf = io.BytesIO(render_error_page(invoice, error))
+            yield invoice.invoice_number, pdf
+
+    return stream_pdf(documents())
+
+
+def build_statement(client_name, client_address, date_from, date_to, output, workers=None):
+    """
+    Write the statement PDF for the client and period to the binary file ``output``; returns
+    the number of invoices in it and the messages of those that failed to render.
+    """
+    invoices = list(statement_invoices(client_name, client_address, date_from, date_to))
+    errors = []
+    for chunk in stream_statement(client_name, client_address, date_from, date_to, invoices, workers, errors):
+        output.write(chunk)
+    return len(invoices), errors
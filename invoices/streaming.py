@@ -0,0 +1,283 @@
+import hashlib
+import io
+import zipfile
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+
+class _StreamBuffer:
+    """
+    Write-only file object that hands back whatever was written since the last drain.
+    It has no tell()/seek(), so zipfile switches to streaming mode (data descriptors).
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(members, compression=zipfile.ZIP_DEFLATED):
+    """
+    Yield a ZIP archive chunk by chunk from an iterable of ``(name, data)`` pairs, so only one
+    member is held in memory at a time. ``data`` is either bytes or an iterable of byte chunks,
+    which is compressed and sent as it is produced.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, mode='w', compression=compression) as archive:
+        for name, data in members:
+            if isinstance(data, (bytes, bytearray)):
+                archive.writestr(name, data)
+            else:
+                with archive.open(name, mode='w') as member:
+                    for part in data:
+                        member.write(part)
+                        chunk = buffer.drain()
+                        if chunk:
+                            yield chunk
+            chunk = buffer.drain()
+            if chunk:
+                yield chunk
+    chunk = buffer.drain()
+    if chunk:
+        yield chunk
+
+
+async def aiter_file(file, chunk_size=64 * 1024):
+    """
+    Read ``file`` in chunks in a worker thread and yield them, closing it at the end. For
+    streaming file responses from async code: Django's ASGI handler would otherwise read the
+    whole of a synchronous iterator into memory, on a thread, before sending any of it.
+    """
+    read = sync_to_async(file.read, thread_sensitive=False)
+    try:
+        while chunk := await read(chunk_size):
+            yield chunk
+    finally:
+        await sync_to_async(file.close, thread_sensitive=False)()
+
+
+_DONE = object()
+
+
+class AsyncIterator:
+    """
+    Async iterator over the synchronous ``iterator``, each item produced by sync_to_async on
+    the request's thread (thread_sensitive), so the database queries the iterator makes use
+    one connection. For StreamingHttpResponse under ASGI, whose handler would otherwise read
+    a synchronous iterator to the end, on a thread, before sending any of it. close() closes
+    the iterator; the response calls it when it ends, fails or is abandoned.
+    """
+
+    def __init__(self, iterator):
+        self._iterator = iter(iterator)
+        self._next = sync_to_async(self._step, thread_sensitive=True)
+
+    def _step(self):
+        return next(self._iterator, _DONE)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self._next()
+        if item is _DONE:
+            raise StopAsyncIteration
+        return item
+
+    def close(self):
+        close = getattr(self._iterator, 'close', None)
+        if close is not None:
+            close()
+
+
+def streaming_content(request, iterator):
+    """
+    ``iterator`` as the content of a StreamingHttpResponse: through AsyncIterator under ASGI,
+    as it is under WSGI.
+    """
+    if isinstance(request, ASGIRequest):
+        return AsyncIterator(iterator)
+    return iterator
+
+
+def stream_file_response(request, response):
+    """
+    Under ASGI, send the file of a FileResponse through aiter_file(). Under WSGI the response
+    is left alone: the handler streams the file itself (wsgi.file_wrapper), and would have to
+    buffer an async iterator whole, with a warning.
+    """
+    if isinstance(request, ASGIRequest) and getattr(response, 'file_to_stream', None) is not None:
+        response.streaming_content = aiter_file(response.file_to_stream)
+    return response
+
+
+class _PdfStream:
+    """
+    Writes a PDF front to back into a _StreamBuffer: the pages of each source document are
+    copied as soon as it is added, and the page tree, outline, catalogue and cross-reference
+    table follow at the end, when the object numbers of all pages are known. Only the byte
+    offsets of the objects written so far are kept.
+    """
+
+    def __init__(self):
+        self.buffer = _StreamBuffer()
+        self._position = 0
+        self._offsets = [None]  # by object number; object 0 heads the free list
+        self._streams = {}  # sha256 of a written stream -> its object number
+        self._pages = []
+        self._outline = []
+        self._catalog = self._reserve()
+        self._page_tree = self._reserve()
+        self._write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+
+    def _reserve(self):
+        self._offsets.append(None)
+        return len(self._offsets) - 1
+
+    def _write(self, data):
+        self.buffer.write(data)
+        self._position += len(data)
+
+    def _write_object(self, number, obj):
+        body = io.BytesIO()
+        obj.write_to_stream(body)
+        self._offsets[number] = self._position
+        self._write(b'%d 0 obj\n%s\nendobj\n' % (number, body.getvalue()))
+
+    def add(self, title, reader):
+        """
+        Append the pages of the PdfReader ``reader``, under an outline entry ``title``.
+        """
+        from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, StreamObject
+
+        numbers = {}  # (object number, generation) in reader -> object number here
+        pending = []
+
+        def remap(obj):
+            if isinstance(obj, IndirectObject):
+                # References made here have no reader: they are already renumbered (direct
+                # objects can be shared between pages, and remapped in place more than once)
+                return obj if obj.pdf is None else IndirectObject(number_of(obj), 0, None)
+            if isinstance(obj, DictionaryObject):
+                for key, value in list(dict.items(obj)):
+                    dict.__setitem__(obj, key, remap(value))
+            elif isinstance(obj, ArrayObject):
+                for index, value in enumerate(obj):
+                    obj[index] = remap(value)
+            return obj
+
+        def number_of(reference):
+            key = reference.idnum, reference.generation
+            if key not in numbers:
+                obj = reference.get_object()
+                if isinstance(obj, StreamObject):
+                    # Written at once, so that a repeat (the signature and stamp images of
+                    # every invoice) can be pointed at the first copy instead
+                    body = io.BytesIO()
+                    remap(obj).write_to_stream(body)
+                    digest = hashlib.sha256(body.getvalue()).digest()
+                    if digest not in self._streams:
+                        self._streams[digest] = self._reserve()
+                        self._write_object(self._streams[digest], obj)
+                    numbers[key] = self._streams[digest]
+                else:
+                    numbers[key] = self._reserve()
+                    pending.append((numbers[key], obj))
+            return numbers[key]
+
+        first = len(self._pages)
+        for page in reader.pages:
+            # reader.pages holds copies of the page objects with the inherited attributes
+            # filled in; those are written in place of the originals
+            page[NameObject('/Parent')] = IndirectObject(self._page_tree, 0, None)
+            number = self._reserve()
+            if page.indirect_reference is not None:
+                numbers[page.indirect_reference.idnum, page.indirect_reference.generation] = number
+            pending.append((number, page))
+            self._pages.append(number)
+        while pending:
+            number, obj = pending.pop()
+            self._write_object(number, remap(obj))
+        if len(self._pages) > first:
+            self._outline.append((title, self._pages[first]))
+
+    def finish(self):
+        from pypdf.generic import (
+            ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject, create_string_object,
+        )
+
+        def ref(number):
+            return IndirectObject(number, 0, None)
+
+        self._write_object(self._page_tree, DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(ref(number) for number in self._pages),
+            NameObject('/Count'): NumberObject(len(self._pages)),
+        }))
+        catalog = DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): ref(self._page_tree),
+        })
+        if self._outline:
+            outlines = self._reserve()
+            items = [self._reserve() for _ in self._outline]
+            for index, (title, page) in enumerate(self._outline):
+                item = DictionaryObject({
+                    NameObject('/Title'): create_string_object(title),
+                    NameObject('/Parent'): ref(outlines),
+                    NameObject('/Dest'): ArrayObject([ref(page), NameObject('/Fit')]),
+                })
+                if index:
+                    item[NameObject('/Prev')] = ref(items[index - 1])
+                if index + 1 < len(items):
+                    item[NameObject('/Next')] = ref(items[index + 1])
+                self._write_object(items[index], item)
+            self._write_object(outlines, DictionaryObject({
+                NameObject('/Type'): NameObject('/Outlines'),
+                NameObject('/First'): ref(items[0]),
+                NameObject('/Last'): ref(items[-1]),
+                NameObject('/Count'): NumberObject(len(items)),
+            }))
+            catalog[NameObject('/Outlines')] = ref(outlines)
+            catalog[NameObject('/PageMode')] = NameObject('/UseOutlines')
+        self._write_object(self._catalog, catalog)
+
+        xref = self._position
+        self._write(b'xref\n0 %d\n0000000000 65535 f \n' % len(self._offsets))
+        self._write(b''.join(b'%010d 00000 n \n' % offset for offset in self._offsets[1:]))
+        self._write(
+            b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+            % (len(self._offsets), self._catalog, xref)
+        )
+
+
+def stream_pdf(documents):
+    """
+    Yield one PDF made of the pages of ``documents``, an iterable of ``(title, file)`` pairs,
+    chunk by chunk. Each document is read, copied out and closed before the next is taken, so
+    only one is held in memory at a time, and begins an outline (bookmark) entry ``title``.
+    Streams repeated across documents, such as images, are written once.
+    """
+    from pypdf import PdfReader
+
+    pdf = _PdfStream()
+    for title, file in documents:
+        with file:
+            pdf.add(title, PdfReader(file))
+        chunk = pdf.buffer.drain()
+        if chunk:
+            yield chunk
+    pdf.finish()
+    yield pdf.buffer.drain()
@@ -0,0 +1,54 @@
+from django import template
+from django.conf import settings
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+from invoices.amount_words import amount_in_words
+
+register = template.Library()
+
+
+@register.filter
+def in_words(value, paise=False):
+    """
+    {{ invoice.total_amount|in_words }} -> "Eleven Thousand, Eight Hundred"
+    {{ amount|in_words:True }} also spells out the paise.
+    """
+    if value in (None, ''):
+        return ''
+    return amount_in_words(value, paise=paise)
+
+
+# Bootstrap is served from static/, where `manage.py vendor_assets` puts it (checked by
+# invoices.checks), unless INVOICE_BOOTSTRAP_CDN is set (the default while static/vendor/ is
+# not there): then it loads from the CDN, pinned to the published integrity hashes.
+BOOTSTRAP_DIR = 'vendor/bootstrap-5.1.3/'
+BOOTSTRAP_CSS = BOOTSTRAP_DIR + 'css/bootstrap.min.css'
+BOOTSTRAP_JS = BOOTSTRAP_DIR + 'js/bootstrap.bundle.min.js'
+BOOTSTRAP_CDN = 'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/'
+BOOTSTRAP_CSS_INTEGRITY = 'sha384-1BmE4kWBq78iYhFldvKuhfTAU6auU8tT94WrHftjDbrCEXSU1oBoqyl2QvZ6jIW3'
+BOOTSTRAP_JS_INTEGRITY = 'sha384-ka7Sk0Gln4gmtz2MlQnikT1wXgYsOg+OMhuP+IlRH9sENBO0LRn5q+8nbTov4+1p'
+
+
+def _from_cdn():
+    return getattr(settings, 'INVOICE_BOOTSTRAP_CDN', False)
+
+
+@register.simple_tag
+def bootstrap_css():
+    if _from_cdn():
+        return format_html(
+            '<link href="{}" rel="stylesheet" integrity="{}" crossorigin="anonymous">',
+            BOOTSTRAP_CDN + BOOTSTRAP_CSS[len(BOOTSTRAP_DIR):], BOOTSTRAP_CSS_INTEGRITY,
+        )
+    return format_html('<link href="{}" rel="stylesheet">', static(BOOTSTRAP_CSS))
+
+
+@register.simple_tag
+def bootstrap_js():
+    if _from_cdn():
+        return format_html(
+            '<script src="{}" integrity="{}" crossorigin="anonymous"></script>',
+            BOOTSTRAP_CDN + BOOTSTRAP_JS[len(BOOTSTRAP_DIR):], BOOTSTRAP_JS_INTEGRITY,
+        )
+    return format_html('<script src="{}"></script>', static(BOOTSTRAP_JS))
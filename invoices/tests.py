@@ -1,3 +1,1251 @@
-from django.test import TestCase
+import codecs
+import csv
+import hashlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import FileResponse, StreamingHttpResponse
+from django.template import Context, Template
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import http_date
+from num2words import num2words
+from pypdf import PdfReader
+
+from .admin import FinancialYearListFilter, InvoiceAdmin
+from .amount_words import MAX_AMOUNT, amount_in_words, number_in_words
+from .benchmarking import sample_invoice
+from .gst import AMOUNT_FIELDS, calculate_line_amounts
+from .importers import import_invoices
+from .models import (
+    ArchivedInvoice, GstSummary, Invoice, InvoiceLineItem, InvoiceNumberSequence, Signature, Stamp,
+    reserve_invoice_numbers,
+)
+from .pagination import InvalidCursor, KeysetPaginator, encode_cursor
+from . import archive, bulk_pdf, checks, gst_summary, images, line_items, pdf, pdf_cache, recompute, search, statements
+from .pdf import PDFRenderError, get_pdf_backend
+from .streaming import stream_pdf
+
+
+def create_invoice(**fields):
+    fields.setdefault('total_amount', Decimal('11800'))
+    return Invoice.objects.create(**fields)
+
+
+class TempDirsMixin:
+    """
+    Points the PDF cache, archive and media directories at temporary directories for each test.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        overrides = override_settings(
+            INVOICE_PDF_CACHE_DIR=self.temp_dir + '/pdf_cache',
+            INVOICE_ARCHIVE_DIR=self.temp_dir + '/archive',
+            MEDIA_ROOT=self.temp_dir + '/media',
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+
+class LoginSessionMixin:
+    def setUp(self):
+        super().setUp()
+        session = self.client.session
+        session['is_authenticated'] = True
+        session.save()
+
+
+class AmountInWordsTests(SimpleTestCase):
+    """
+    amount_in_words must stay byte-identical to the num2words call it replaced.
+    """
+
+    def assertMatchesNum2words(self, n):
+        self.assertEqual(number_in_words(n), num2words(n, lang='en_IN').title(), n)
+
+    def test_every_amount_up_to_two_lakh(self):
+        for n in range(200001):
+            self.assertMatchesNum2words(n)
+
+    def test_group_boundaries(self):
+        for magnitude in range(3, 10):
+            base = 10 ** magnitude
+            for n in (base - 1, base, base + 1, base + 99, base + 100, base + 101, 2 * base + 10 ** 3):
+                if n < MAX_AMOUNT:
+                    self.assertMatchesNum2words(n)
+        self.assertMatchesNum2words(MAX_AMOUNT - 1)
+
+    def test_random_large_amounts(self):
+        rng = random.Random(2025)
+        for _ in range(20000):
+            self.assertMatchesNum2words(rng.randrange(MAX_AMOUNT))
+
+    def test_negative_and_overflow(self):
+        self.assertMatchesNum2words(-1234)
+        with self.assertRaises(OverflowError):
+            number_in_words(MAX_AMOUNT)
+
+    def test_amount_truncates_paise_like_the_invoice(self):
+        self.assertEqual(amount_in_words(Decimal('11800.99')), 'Eleven Thousand, Eight Hundred')
+
+    def test_paise(self):
+        self.assertEqual(amount_in_words(Decimal('10.50'), paise=True), 'Ten And Fifty Paise')
+        self.assertEqual(amount_in_words(Decimal('10.00'), paise=True), 'Ten')
+
+    def test_template_filter(self):
+        template = Template('{% load invoice_extras %}{{ amount|in_words }}')
+        self.assertEqual(template.render(Context({'amount': Decimal('100001')})), 'One Lakh And One')
+
+
+class PDFBackendRegressionTests(SimpleTestCase):
+    """
+    The ReportLab backend must lay out the same invoice as the xhtml2pdf template: same page
+    size, the same words in the same reading order, and the same embedded images.
+    """
+
+    def render(self, backend, invoice):
+        return PdfReader(io.BytesIO(get_pdf_backend(backend).render(invoice)))
+
+    def words(self, reader):
+        return ' '.join(page.extract_text() for page in reader.pages).split()
+
+    def images(self, reader):
+        return sum(len(page.images) for page in reader.pages)
+
+    def assertSameInvoice(self, invoice):
+        html = self.render('invoices.pdf.XHTML2PDFBackend', invoice)
+        direct = self.render('invoices.pdf_reportlab.ReportLabBackend', invoice)
+        self.assertEqual(direct.pages[0].mediabox, html.pages[0].mediabox)
+        self.assertEqual(self.words(direct), self.words(html))
+        self.assertEqual(self.images(direct), self.images(html))
+
+    def test_intra_state_invoice(self):
+        self.assertSameInvoice(sample_invoice())
+
+    def test_igst_invoice_without_stamp(self):
+        self.assertSameInvoice(sample_invoice(state='Delhi', include_stamp=False))
+
+
+class KeysetPaginatorTests(TempDirsMixin, LoginSessionMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.invoices = [create_invoice() for _ in range(5)]
+
+    def paginator(self):
+        return KeysetPaginator(Invoice.objects.all(), ordering=Invoice._meta.ordering, per_page=2)
+
+    def test_pages_forward_and_back(self):
+        paginator = self.paginator()
+        first = paginator.page()
+        second = paginator.page(after=first.next_cursor)
+        third = paginator.page(after=second.next_cursor)
+        newest_first = self.invoices[::-1]
+        self.assertEqual([list(first), list(second), list(third)], [newest_first[:2], newest_first[2:4], newest_first[4:]])
+        self.assertFalse(third.has_next())
+        self.assertEqual(list(paginator.page(before=third.previous_cursor)), newest_first[2:4])
+
+    def test_cursor_with_values_of_the_wrong_type_is_invalid(self):
+        paginator = self.paginator()
+        for values in (['abc', 1], ['2025-01-01T00:00:00+00:00', 'abc'], [None, 1], [1]):
+            with self.subTest(values=values), self.assertRaises(InvalidCursor):
+                paginator.page(after=encode_cursor(values))
+
+    def test_bad_cursor_falls_back_to_the_first_page(self):
+        response = self.client.get('/', {'after': encode_cursor(['abc', 1])})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.invoices[-1].invoice_number)
+
+    def test_bad_cursor_is_a_bad_request_in_the_api(self):
+        response = self.client.get('/api/invoices/', {'after': encode_cursor(['abc', 1])})
+        self.assertEqual(response.status_code, 400)
+
+
+class InvoiceAdminChangelistTests(TempDirsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.invoices = [
+            create_invoice(invoice_date=date(2024, 3, 10), client_name='Alpha Industries'),
+            create_invoice(invoice_date=date(2024, 5, 2), client_name='Beta Works', state='Madhya Pradesh'),
+            create_invoice(invoice_date=date(2024, 6, 1), client_name='Gamma Corp'),
+        ]
+        self.url = reverse('admin:invoices_invoice_changelist')
+
+    def changelist(self, query='', **params):
+        response = self.client.get(self.url + query, params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    @mock.patch.object(InvoiceAdmin, 'list_per_page', 2)
+    def test_keyset_pages(self):
+        first = self.changelist()
+        self.assertEqual(list(first.result_list), self.invoices[:0:-1])
+        self.assertEqual(first.result_count, 3)
+        self.assertFalse(first.keyset_page.has_previous())
+
+        response = self.client.get(self.url + first.older_url())
+        self.assertContains(response, 'Newer')
+        older = response.context['cl']
+        self.assertEqual(list(older.result_list), [self.invoices[0]])
+        self.assertFalse(older.keyset_page.has_next())
+        self.assertEqual(list(self.changelist(older.newer_url()).result_list), self.invoices[:0:-1])
+
+        response = self.client.get(self.url, {'after': 'bogus'})
+        self.assertRedirects(response, self.url + '?e=1', fetch_redirect_response=False)
+
+    def test_financial_year_filter(self):
+        spec = next(spec for spec in self.changelist().filter_specs if isinstance(spec, FinancialYearListFilter))
+        self.assertEqual(spec.lookup_choices, [('2024', 'FY 2024-25'), ('2023', 'FY 2023-24')])
+        with self.assertNumQueries(1):
+            spec.lookups(None, None)
+
+        self.assertEqual(list(self.changelist(financial_year='2023').result_list), [self.invoices[0]])
+        self.assertEqual(list(self.changelist(financial_year='2024').result_list), self.invoices[:0:-1])
+        response = self.client.get(self.url, {'financial_year': 'abc'})
+        self.assertRedirects(response, self.url + '?e=1', fetch_redirect_response=False)
+
+    def test_state_filter_keeps_keyset_paging(self):
+        cl = self.changelist(state='Madhya Pradesh')
+        self.assertEqual(list(cl.result_list), [self.invoices[1]])
+        self.assertIsNotNone(cl.keyset_page)
+
+    def test_search_uses_the_full_text_index(self):
+        with mock.patch.object(search, 'search', wraps=search.search) as full_text:
+            cl = self.changelist(q='gamma')
+        full_text.assert_called_once()
+        self.assertEqual(list(cl.result_list), [self.invoices[2]])
+        self.assertIsNone(cl.keyset_page)
+
+    @mock.patch.object(InvoiceAdmin, 'list_per_page', 2)
+    def test_column_ordering_uses_numbered_pages(self):
+        # Column 2 is invoice_date (0 is the action checkbox)
+        cl = self.changelist(o='2')
+        self.assertIsNone(cl.keyset_page)
+        self.assertEqual(list(cl.result_list), self.invoices[:2])
+        self.assertEqual(list(self.changelist(o='2', p='2').result_list), [self.invoices[2]])
+
+
+class InvoiceNumberSequenceTests(TempDirsMixin, TestCase):
+    def test_first_reservation_of_a_year_starts_at_one(self):
+        self.assertEqual(InvoiceNumberSequence.reserve(2030), 1)
+        self.assertEqual(InvoiceNumberSequence.reserve(2030), 2)
+        self.assertEqual(InvoiceNumberSequence.reserve(2031), 1)
+
+    def test_block_reservation(self):
+        self.assertEqual(reserve_invoice_numbers(3, financial_year=2030), ['SLG-2030-01', 'SLG-2030-02', 'SLG-2030-03'])
+        self.assertEqual(InvoiceNumberSequence.reserve(2030, count=5), 4)
+        self.assertEqual(InvoiceNumberSequence.reserve(2030), 9)
+
+    def test_seeded_above_numbers_issued_before_the_counter(self):
+        for number in ('SLG-2030-07', 'SLG-2030-12', 'SLG-2030-x', 'SLG-2031-40'):
+            create_invoice(invoice_number=number)
+        self.assertEqual(reserve_invoice_numbers(2, financial_year=2030), ['SLG-2030-13', 'SLG-2030-14'])
+
+    def test_concurrently_created_row_is_advanced_instead(self):
+        # Another worker inserts the year's row after our UPDATE found none
+        InvoiceNumberSequence.objects.create(financial_year=2030, last_number=4)
+        advance = InvoiceNumberSequence._advance
+        calls = []
+
+        def missed_first_update(financial_year, count):
+            calls.append(count)
+            return None if len(calls) == 1 else advance(financial_year, count)
+
+        with mock.patch.object(InvoiceNumberSequence, '_advance', side_effect=missed_first_update):
+            first = InvoiceNumberSequence.reserve(2030, count=2)
+        self.assertEqual(first, 5)
+        self.assertEqual(InvoiceNumberSequence.objects.get(financial_year=2030).last_number, 6)
+
+    def test_numbered_in_the_financial_year_of_the_invoice_date(self):
+        create_invoice(invoice_date=date(2024, 6, 1))
+        self.assertEqual(create_invoice(invoice_date=date(2025, 3, 31)).invoice_number, 'SLG-2024-02')
+        self.assertEqual(create_invoice(invoice_date=date(2025, 4, 1)).invoice_number, 'SLG-2025-01')
+
+    def test_import_numbers_each_row_in_its_year(self):
+        rows = [(2, {'invoice_date': '2024-05-02', 'total_amount': '100'}),
+                (3, {'invoice_date': '2025-05-02', 'total_amount': '100'}),
+                (4, {'invoice_date': '2024-06-02', 'total_amount': '100'})]
+        result = import_invoices(rows, keep_created=True)
+        self.assertEqual([invoice.invoice_number for invoice in result.invoices], ['SLG-2024-01', 'SLG-2025-01', 'SLG-2024-02'])
+
+    @override_settings(INVOICE_PDF_PRERENDER=False)
+    def test_create_and_edit_query_counts(self):
+        create_invoice()
+        # Savepoint, counter, insert, GST summary, search index, release
+        with self.assertNumQueries(6):
+            invoice = create_invoice()
+        invoice = Invoice.objects.get(pk=invoice.pk)
+        invoice.client_name = 'Renamed Client'
+        # Savepoint, update, search index, release
+        with self.assertNumQueries(4):
+            invoice.save()
+
+
+@override_settings(INVOICE_PDF_PRERENDER=False)
+class SearchTests(TempDirsMixin, LoginSessionMixin, TestCase):
+    def found(self, query, queryset=None):
+        return list(search.search(queryset or Invoice.objects.all(), query).values_list('pk', flat=True))
+
+    def test_index_follows_save_and_delete(self):
+        alpha = create_invoice(client_name='Alpha Industries')
+        create_invoice(client_name='Beta Works')
+        self.assertEqual(search.backend(connection), 'fts5')
+        self.assertEqual(self.found('alph'), [alpha.pk])
+
+        alpha.client_name = 'Gamma Corp'
+        alpha.save()
+        self.assertEqual(self.found('alpha'), [])
+        self.assertEqual(self.found('gamma corp'), [alpha.pk])
+
+        alpha.contract_no = 'GEMC-DELTA'
+        alpha.save(update_fields=['contract_no', 'updated_at'])
+        self.assertEqual(self.found('delta'), [alpha.pk])
+
+        alpha.delete()
+        self.assertEqual(self.found('gamma'), [])
+
+    def test_bulk_created_invoices_are_indexed(self):
+        result = import_invoices([(2, {'contract_no': 'GEMC-EPSILON', 'total_amount': '100'})], keep_created=True)
+        self.assertEqual(self.found('epsilon'), [result.invoices[0].pk])
+
+    def test_contract_number_outranks_the_description(self):
+        described = create_invoice(service_description='Zeta training')
+        contracted = create_invoice(contract_no='ZETA-1')
+        self.assertEqual(self.found('zeta'), [contracted.pk, described.pk])
+
+    def test_search_keeps_the_list_filters(self):
+        create_invoice(client_name='Alpha Industries', state='Uttarakhand')
+        wanted = create_invoice(client_name='Alpha Industries', state='Madhya Pradesh')
+        create_invoice(client_name='Beta Works', state='Madhya Pradesh')
+        response = self.client.get(reverse('invoice_list'), {'q': 'alpha', 'state': 'Madhya Pradesh'})
+        self.assertTrue(response.context['searching'])
+        self.assertEqual([invoice.pk for invoice in response.context['page']], [wanted.pk])
+
+
+class RenderAssetsRemoteTests(SimpleTestCase):
+    URI = 'https://example.com/fonts.css'
+
+    def test_failed_fetch_is_retried_after_a_while(self):
+        assets = pdf.RenderAssets()
+        with mock.patch.object(assets, '_fetch', side_effect=[None, b'body{}']) as fetch:
+            self.assertEqual(assets.resolve(self.URI), 'data:text/css;base64,')
+            # Within the retry interval renders do not wait for the network again
+            self.assertEqual(assets.resolve(self.URI), 'data:text/css;base64,')
+            self.assertEqual(fetch.call_count, 1)
+            with mock.patch.object(pdf, 'REMOTE_RETRY_SECONDS', 0):
+                self.assertEqual(assets.read(self.URI), b'body{}')
+            self.assertEqual(fetch.call_count, 2)
+
+    def test_bootstrap_from_the_cdn_resolves_to_the_vendored_copy(self):
+        assets = pdf.RenderAssets()
+        uri = 'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css'
+        self.assertEqual(pdf.vendored_uri(uri), '/static/vendor/bootstrap-5.1.3/css/bootstrap.min.css')
+        with mock.patch.object(assets, '_fetch') as fetch:
+            assets.resolve(uri)
+        fetch.assert_not_called()
+
+
+class BootstrapAssetsTests(SimpleTestCase):
+    def render(self):
+        return Template('{% load invoice_extras %}{% bootstrap_css %}{% bootstrap_js %}').render(Context())
+
+    @override_settings(INVOICE_BOOTSTRAP_CDN=False)
+    def test_served_from_static_files(self):
+        html = self.render()
+        self.assertIn('href="/static/vendor/bootstrap-5.1.3/css/bootstrap.min.css"', html)
+        self.assertIn('src="/static/vendor/bootstrap-5.1.3/js/bootstrap.bundle.min.js"', html)
+        self.assertNotIn('cdn.jsdelivr.net', html)
+
+    @override_settings(INVOICE_BOOTSTRAP_CDN=True)
+    def test_cdn_is_pinned(self):
+        html = self.render()
+        self.assertIn('https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css', html)
+        self.assertEqual(html.count('integrity="sha384-'), 2)
+
+    def test_missing_files_are_reported(self):
+        with mock.patch('invoices.checks.finders.find', return_value=None), override_settings(INVOICE_BOOTSTRAP_CDN=False):
+            self.assertEqual([e.id for e in checks.check_bootstrap_vendored(None)], ['invoices.W001'])
+            self.assertEqual([e.id for e in checks.check_bootstrap_deployed(None)], ['invoices.E001'])
+            with override_settings(INVOICE_BOOTSTRAP_CDN=True):
+                self.assertEqual(checks.check_bootstrap_vendored(None), [])
+
+    def test_the_cdn_is_the_default_until_the_files_are_vendored(self):
+        vendored = os.path.isdir(os.path.join(settings.BASE_DIR, 'static', 'vendor', 'bootstrap-5.1.3'))
+        self.assertEqual(settings.INVOICE_BOOTSTRAP_CDN, not vendored)
+        self.assertEqual(checks.check_bootstrap_vendored(None), [])
+
+    def test_pdf_leaves_out_a_missing_bootstrap(self):
+        assets = pdf.RenderAssets()
+        with mock.patch.object(pdf, 'resolve_path', return_value='/nonexistent/bootstrap.min.css'):
+            self.assertEqual(
+                assets.resolve('https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css'),
+                'data:text/css;base64,',
+            )
+
+
+@override_settings(
+    STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+    },
+    STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+    INVOICE_PDF_PRERENDER=False,
+)
+class ManifestStaticPagesTests(TempDirsMixin, LoginSessionMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        overrides = override_settings(STATIC_ROOT=self.temp_dir + '/static')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def test_pages_render_with_fingerprinted_static_files(self):
+        for name in ('invoice_list', 'create_invoice', 'import_invoices', 'gst_report', 'client_statement'):
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200, name)
+        invoice = create_invoice()
+        response = self.client.get(reverse('invoice_preview', args=[invoice.pk]))
+        self.assertContains(response, staticfiles_storage.url('css/styles.css'))
+        self.assertRegex(staticfiles_storage.url('css/styles.css'), r'/static/css/styles\.[0-9a-f]{12}\.css')
+
+
+class SessionCacheCheckTests(SimpleTestCase):
+    def test_per_process_session_cache_is_reported(self):
+        with override_settings(SESSION_ENGINE='invoices.sessions'):
+            self.assertEqual([e.id for e in checks.check_session_cache_shared(None)], ['invoices.W002'])
+        shared = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379'}
+        with override_settings(SESSION_ENGINE='invoices.sessions', CACHES={'default': shared, 'sessions': shared}):
+            self.assertEqual(checks.check_session_cache_shared(None), [])
+        with override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db'):
+            self.assertEqual(checks.check_session_cache_shared(None), [])
+
+
+@override_settings(INVOICE_PDF_PRERENDER=False)
+class PdfStatusTests(TempDirsMixin, TestCase):
+    def render(self, invoice):
+        with mock.patch.object(pdf_cache, 'render_invoice_pdf', return_value=b'%PDF-1.4'):
+            return pdf_cache.get_or_render(invoice)
+
+    def test_render_on_demand_marks_the_invoice_ready(self):
+        invoice = create_invoice()
+        self.render(Invoice.objects.get(pk=invoice.pk))
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.pdf_status, Invoice.PdfStatus.READY)
+
+    def test_render_of_a_stale_instance_does_not(self):
+        stale = create_invoice()
+        Invoice.objects.get(pk=stale.pk).save()
+        self.render(stale)
+        self.assertEqual(Invoice.objects.get(pk=stale.pk).pdf_status, Invoice.PdfStatus.PENDING)
+
+
+@override_settings(INVOICE_PDF_PRERENDER=False)
+class GstSummaryTests(TempDirsMixin, TestCase):
+    def summary(self):
+        return sorted(GstSummary.objects.filter(invoice_count__gt=0).values_list(
+            'month', 'state', 'invoice_count', *AMOUNT_FIELDS,
+        ))
+
+    def assertMatchesRebuild(self):
+        self.assertEqual(gst_summary.check(), [])
+        incremental = self.summary()
+        gst_summary.rebuild()
+        self.assertEqual(self.summary(), incremental)
+
+    def test_incremental_updates_match_a_full_rebuild(self):
+        first = create_invoice(invoice_date=date(2025, 5, 2), total_amount=Decimal('999.99'))
+        second = create_invoice(invoice_date=date(2025, 5, 20), state='Madhya Pradesh', total_amount=Decimal('5000.50'))
+        third = create_invoice(invoice_date=date(2025, 6, 1), total_amount=Decimal('1'))
+        self.assertMatchesRebuild()
+
+        # Loaded, edited and saved twice, the second time without reloading
+        invoice = Invoice.objects.get(pk=first.pk)
+        invoice.total_amount = Decimal('123456.78')
+        invoice.save()
+        invoice.state = 'Madhya Pradesh'
+        invoice.invoice_date = date(2025, 7, 1)
+        invoice.save()
+        self.assertMatchesRebuild()
+
+        second.total_amount = Decimal('11800')
+        second.save()
+        Invoice.objects.get(pk=third.pk).delete()
+        self.assertMatchesRebuild()
+
+        import_invoices([(2, {'invoice_date': '2025-05-03', 'total_amount': '2360'}),
+                         (3, {'invoice_date': '2025-08-03', 'state': 'Madhya Pradesh', 'total_amount': '590'})])
+        recompute.recompute(Invoice.objects.all(), updates={'state': 'Uttarakhand'})
+        self.assertMatchesRebuild()
+
+    def test_a_refreshed_instance_reads_the_row_back(self):
+        invoice = create_invoice(invoice_date=date(2025, 5, 2))
+        Invoice.objects.filter(pk=invoice.pk).update(total_amount=Decimal('2360'), base_amount=Decimal('2000'))
+        gst_summary.rebuild()
+        invoice.refresh_from_db()
+        invoice.total_amount = Decimal('590')
+        invoice.save()
+        self.assertMatchesRebuild()
+
+    def test_check_reports_drift(self):
+        invoice = create_invoice(invoice_date=date(2025, 5, 2), total_amount=Decimal('11800'))
+        # Behind the summary's back
+        Invoice.objects.filter(pk=invoice.pk).update(total_amount=Decimal('5900'))
+        self.assertEqual(gst_summary.check(), [
+            (date(2025, 5, 1), 'Uttarakhand', 'total_amount', Decimal('11800.00'), Decimal('5900.00')),
+        ])
+        gst_summary.rebuild()
+        self.assertEqual(gst_summary.check(), [])
+
+
+class LineAmountTests(SimpleTestCase):
+    def test_intra_state_splits_the_rate(self):
+        self.assertEqual(calculate_line_amounts('3', '333.33', '18', 'Uttarakhand'), {
+            'base_amount': Decimal('999.99'), 'cgst_amount': Decimal('90.00'),
+            'sgst_amount': Decimal('90.00'), 'igst_amount': Decimal(0),
+        })
+
+    def test_inter_state_charges_igst(self):
+        self.assertEqual(calculate_line_amounts('2', '1000.005', '18', 'Madhya Pradesh'), {
+            'base_amount': Decimal('2000.01'), 'cgst_amount': Decimal(0),
+            'sgst_amount': Decimal(0), 'igst_amount': Decimal('360.00'),
+        })
+
+
+@override_settings(INVOICE_PDF_PRERENDER=False)
+class LineItemsTests(TempDirsMixin, TestCase):
+    LINES = [
+        {'description': 'Batch 1', 'quantity': Decimal('2'), 'rate': Decimal('1000.00')},
+        {'description': 'Batch 2', 'quantity': Decimal('1'), 'rate': Decimal('499.50'), 'gst_rate': Decimal('12')},
+    ]
+
+    def test_replace_line_items_numbers_lines_and_stores_totals(self):
+        invoice = Invoice(state='Uttarakhand', total_amount=0)
+        line_items.replace_line_items(invoice, self.LINES)
+        invoice.refresh_from_db()
+        self.assertEqual(list(invoice.line_items.values_list('position', 'description')), [(1, 'Batch 1'), (2, 'Batch 2')])
+        self.assertEqual(invoice.line_item_count, 2)
+        self.assertEqual(invoice.base_amount, Decimal('2499.50'))
+        self.assertEqual(invoice.cgst_amount, Decimal('209.97'))
+        self.assertEqual(invoice.total_amount, Decimal('2919'))
+        self.assertEqual(invoice.round_off, Decimal('-0.44'))
+
+        # Replacing drops the previous lines
+        line_items.replace_line_items(invoice, self.LINES[1:])
+        self.assertEqual(list(invoice.line_items.values_list('description', flat=True)), ['Batch 2'])
+        self.assertEqual(Invoice.objects.get(pk=invoice.pk).base_amount, Decimal('499.50'))
+
+    def test_recalculate_after_a_state_change(self):
+        invoice = Invoice(state='Uttarakhand', total_amount=0)
+        line_items.replace_line_items(invoice, self.LINES)
+        # A line added without a position, e.g. in the admin
+        InvoiceLineItem.objects.create(invoice=invoice, description='Extra', rate=Decimal('100'))
+        invoice.state = 'Madhya Pradesh'
+        with mock.patch.object(line_items, 'CHUNK_SIZE', 2):
+            self.assertEqual(line_items.recalculate(invoice), 3)
+
+        self.assertEqual(list(invoice.line_items.values_list('position', flat=True)), [1, 2, 3])
+        self.assertFalse(invoice.line_items.exclude(cgst_amount=0).exists())
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.base_amount, Decimal('2599.50'))
+        self.assertEqual(invoice.cgst_amount, 0)
+        self.assertEqual(invoice.igst_amount, Decimal('437.94'))
+        self.assertEqual(invoice.total_amount, Decimal('3037'))
+
+
+class PagedTableTests(SimpleTestCase):
+    def test_rows_are_split_across_pages_with_the_header_on_each(self):
+        from reportlab.platypus import SimpleDocTemplate, TableStyle
+
+        from .pdf_reportlab import PagedTable
+
+        rows = iter([['Row %d' % n] for n in range(1, 201)])
+        buffer = io.BytesIO()
+        SimpleDocTemplate(buffer).build([
+            PagedTable(['Description'], rows, [300], TableStyle([('FONTSIZE', (0, 0), (-1, -1), 9)])),
+        ])
+
+        pages = [page.extract_text() for page in PdfReader(io.BytesIO(buffer.getvalue())).pages]
+        self.assertGreater(len(pages), 1)
+        for text in pages:
+            self.assertTrue(text.startswith('Description'))
+        cells = [line for text in pages for line in text.splitlines()[1:]]
+        self.assertEqual(cells, ['Row %d' % n for n in range(1, 201)])
+
+
+class InvoiceImportTests(TempDirsMixin, TestCase):
+    ROW = {
+        'client_name': 'TO: THE COMMANDING OFFICER,', 'client_address': 'BHOPAL', 'contract_no': 'GEMC-1',
+        'contract_date': '2025-05-02', 'service_description': 'Training', 'total_amount': '11800',
+    }
+
+    def test_row_without_a_total_is_rejected(self):
+        result = import_invoices([(2, self.ROW), (3, dict(self.ROW, total_amount=''))])
+        self.assertEqual([(row, list(errors)) for row, errors in result.errors], [(3, ['total_amount'])])
+        self.assertEqual(result.created, 0)
+        self.assertFalse(Invoice.objects.exists())
+
+
+@override_settings(INVOICE_PDF_PRERENDER=False)
+class ImportInvoicesViewTests(TempDirsMixin, LoginSessionMixin, TestCase):
+    CSV = (
+        'client_name,client_address,contract_no,total_amount\r\n'
+        'TO: THE COMMANDING OFFICER,BHOPAL,GEMC-1,11800\r\n'
+        'TO: THE COMMANDING OFFICER,BHOPAL,GEMC-2,\r\n'
+    )
+
+    def upload(self, **options):
+        data = {'file': SimpleUploadedFile('invoices.csv', self.CSV.encode(), content_type='text/csv')}
+        data.update({option: 'on' for option, value in options.items() if value})
+        return self.client.post(reverse('import_invoices'), data)
+
+    def test_an_invalid_row_rejects_the_upload(self):
+        response = self.upload()
+        self.assertContains(response, 'Fix the rows below and upload again.', status_code=400)
+        self.assertEqual(response.context['result'].errors, [(3, {'total_amount': ['This field is required.']})])
+        self.assertContains(response, '<td>3</td>', status_code=400)
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_skip_invalid_imports_the_valid_rows(self):
+        response = self.upload(skip_invalid=True)
+        self.assertContains(response, '2 row(s) read, 1 valid,')
+        self.assertContains(response, '1 invoice(s) created')
+        self.assertEqual(list(Invoice.objects.values_list('contract_no', flat=True)), ['GEMC-1'])
+
+    def test_dry_run_only_validates(self):
+        response = self.upload(dry_run=True, skip_invalid=True)
+        self.assertContains(response, 'nothing imported (dry run)')
+        self.assertEqual(response.context['result'].valid, 1)
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_other_files_are_refused(self):
+        response = self.client.post(reverse('import_invoices'), {'file': SimpleUploadedFile('invoices.txt', b'x')})
+        self.assertContains(response, 'Upload a .csv or .xlsx file.', status_code=400)
+
+
+@override_settings(INVOICE_PDF_PRERENDER=False)
+class CreateInvoiceViewTests(TempDirsMixin, LoginSessionMixin, TestCase):
+    def test_bench_scenario_posts_a_valid_form(self):
+        from .management.commands.bench_invoices import Command
+
+        command = Command()
+        command.client, command.rng = self.client, random.Random(0)
+        command.create_invoice(0)
+        self.assertEqual(Invoice.objects.count(), 1)
+
+
+@override_settings(INVOICE_PDF_PRERENDER=False)
+class InvoiceApiTests(TempDirsMixin, LoginSessionMixin, TestCase):
+    ITEM = {
+        'client_name': 'TO: THE COMMANDING OFFICER,', 'client_address': 'BHOPAL', 'contract_no': 'GEMC-1',
+        'contract_date': '2025-05-02', 'service_description': 'Training', 'total_amount': '11800',
+    }
+
+    def post_batch(self, items, **params):
+        url = '/api/invoices/batch/'
+        if params:
+            url += '?' + '&'.join('%s=%s' % item for item in params.items())
+        return self.client.post(url, items, content_type='application/json')
+
+    def test_batch_with_an_invalid_item_creates_nothing(self):
+        response = self.post_batch([self.ITEM, dict(self.ITEM, total_amount='abc'), self.ITEM])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([(e['index'], list(e['errors'])) for e in response.json()['errors']], [(1, ['total_amount'])])
+        self.assertFalse(Invoice.objects.exists())
+        # The invoice numbers reserved for the batch are rolled back too
+        self.assertFalse(InvoiceNumberSequence.objects.exists())
+
+    def test_batch_create(self):
+        response = self.post_batch([self.ITEM, dict(self.ITEM, state='Madhya Pradesh')], fields='id,invoice_number,igst_amount')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['created'], 2)
+        self.assertEqual([list(item) for item in data['results']], [['id', 'invoice_number', 'igst_amount']] * 2)
+        self.assertEqual(Invoice.objects.get(pk=data['results'][1]['id']).igst_amount, Decimal(data['results'][1]['igst_amount']))
+
+    def test_dry_run_only_validates(self):
+        response = self.post_batch([self.ITEM, self.ITEM], dry_run=1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'valid': 2, 'created': 0})
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_fields_limit_the_response_and_the_columns_loaded(self):
+        invoice = create_invoice()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/invoices/%d/' % invoice.pk, {'fields': 'invoice_number, total_amount'})
+        self.assertEqual(response.json(), {'invoice_number': invoice.invoice_number, 'total_amount': '11800.00'})
+        select = [q['sql'] for q in queries if 'FROM "invoices_invoice"' in q['sql']][0]
+        self.assertNotIn('client_address', select)
+
+        response = self.client.get('/api/invoices/', {'fields': 'id,bogus'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('bogus', response.json()['fields'][0])
+
+    def test_cursor_links_walk_the_list(self):
+        invoices = [create_invoice() for _ in range(5)]
+        response = self.client.get('/api/invoices/', {'limit': 2, 'fields': 'id', 'state': 'Uttarakhand'})
+        data = response.json()
+        self.assertIsNone(data['previous'])
+        seen = [item['id'] for item in data['results']]
+        while data['next']:
+            self.assertIn('state=Uttarakhand', data['next'])
+            data = self.client.get(data['next']).json()
+            seen += [item['id'] for item in data['results']]
+        self.assertEqual(seen, [invoice.pk for invoice in reversed(invoices)])
+
+        # And back again from the last page
+        data = self.client.get(data['previous']).json()
+        self.assertEqual([item['id'] for item in data['results']], [invoices[2].pk, invoices[1].pk])
+
+
+def render_text_pdf(text, image=None):
+    """
+    A one-page PDF with ``text`` and, if given, the PIL ``image`` on it.
+    """
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    buffer = io.BytesIO()
+    page = canvas.Canvas(buffer)
+    page.drawString(72, 720, text)
+    if image is not None:
+        page.drawImage(ImageReader(image), 72, 600, width=50, height=50)
+    page.save()
+    return buffer.getvalue()
+
+
+class StreamPdfTests(SimpleTestCase):
+    def test_pages_outline_and_shared_images(self):
+        from PIL import Image
+
+        stamp = Image.new('RGB', (40, 40), 'red')
+        documents = [(title, io.BytesIO(render_text_pdf(title, stamp))) for title in ('First', 'Second', 'Third')]
+        chunks = list(stream_pdf(iter(documents)))
+        self.assertEqual(len(chunks), 4)
+        self.assertTrue(all(document[1].closed for document in documents))
+
+        reader = PdfReader(io.BytesIO(b''.join(chunks)), strict=True)
+        self.assertEqual([page.extract_text().strip() for page in reader.pages], ['First', 'Second', 'Third'])
+        self.assertEqual(
+            [(item.title, reader.get_destination_page_number(item)) for item in reader.outline],
+            [('First', 0), ('Second', 1), ('Third', 2)],
+        )
+        images = {
+            xobject.idnum for page in reader.pages
+            for xobject in page['/Resources'].raw_get('/XObject').get_object().values()
+        }
+        self.assertEqual(len(images), 1)
+
+
+@override_settings(INVOICE_PDF_PRERENDER=False, INVOICE_STATEMENT_MAX_INVOICES=2)
+class ClientStatementViewTests(TempDirsMixin, LoginSessionMixin, TestCase):
+    def get_statement(self):
+        params = {'client': statements.client_key('Client', 'Address'), 'date_from': '2025-05-01', 'date_to': '2025-05-31'}
+        return self.client.get(reverse('client_statement'), params)
+
+    def test_statement_is_streamed_after_the_cover(self):
+        invoices = [
+            create_invoice(client_name='Client', client_address='Address', invoice_date=date(2025, 5, day))
+            for day in (2, 1)
+        ]
+        rendered = lambda pks, workers: ((pk, str(pk), render_text_pdf('Invoice %d' % pk), None) for pk in pks)
+        with mock.patch.object(statements, 'iter_rendered_pdfs', side_effect=rendered) as render:
+            response = self.get_statement()
+            self.assertIsInstance(response, StreamingHttpResponse)
+            render.assert_not_called()
+            chunks = list(response.streaming_content)
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename="statement-%s-2025-05-01-2025-05-31.pdf"' % statements.client_key('Client', 'Address'),
+        )
+        self.assertEqual(len(chunks), 4)
+
+        reader = PdfReader(io.BytesIO(b''.join(chunks)), strict=True)
+        self.assertIn('STATEMENT OF INVOICES', reader.pages[0].extract_text())
+        self.assertEqual(
+            [page.extract_text().strip() for page in reader.pages[1:]],
+            ['Invoice %d' % invoices[1].pk, 'Invoice %d' % invoices[0].pk],
+        )
+        self.assertEqual(
+            [item.title for item in reader.outline], ['Summary', invoices[1].invoice_number, invoices[0].invoice_number]
+        )
+
+    def test_invoice_that_fails_to_render_gets_an_error_page(self):
+        invoice = create_invoice(client_name='Client', client_address='Address', invoice_date=date(2025, 5, 1))
+        rendered = lambda pks, workers: ((pk, str(pk), None, 'Bad template') for pk in pks)
+        with mock.patch.object(statements, 'iter_rendered_pdfs', side_effect=rendered):
+            output = io.BytesIO()
+            count, errors = statements.build_statement(
+                'Client', 'Address', date(2025, 5, 1), date(2025, 5, 31), output
+            )
+        self.assertEqual((count, errors), (1, ['Invoice %s: Bad template' % invoice.invoice_number]))
+        text = PdfReader(output).pages[1].extract_text()
+        self.assertIn('Invoice %s could not be rendered' % invoice.invoice_number, text)
+        self.assertIn('Bad template', text)
+
+    def test_period_without_invoices(self):
+        create_invoice(client_name='Client', client_address='Address', invoice_date=date(2025, 4, 30))
+        response = self.get_statement()
+        self.assertContains(response, 'The client has no invoices in this period.')
+
+    def test_period_with_too_many_invoices_is_refused(self):
+        for day in (1, 2, 3):
+            create_invoice(client_name='Client', client_address='Address', invoice_date=date(2025, 5, day))
+        params = {'client': statements.client_key('Client', 'Address'), 'date_from': '2025-05-01', 'date_to': '2025-05-31'}
+        with mock.patch.object(statements, 'build_statement') as build:
+            response = self.client.get(reverse('client_statement'), params)
+        build.assert_not_called()
+        self.assertContains(response, 'The client has 3 invoices in this period; a statement can hold 2.', status_code=400)
+
+
+@override_settings(INVOICE_PDF_PRERENDER=False)
+class ArchiveTests(TempDirsMixin, LoginSessionMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # Packs are mapped by name; every test writes its own fy2023.pack
+        self.addCleanup(archive._maps.clear)
+
+    def read(self, name, entry):
+        with archive.PackSlice(name, entry[0], entry[1]) as pdf:
+            return pdf.read()
+
+    def test_pack_write_and_read(self):
+        with archive.PackWriter('fy2023.pack') as writer:
+            first = writer.append(1, 'A-1', b'%PDF-one')
+            second = writer.append(2, 'A-2', b'%PDF-two')
+            writer.commit()
+            third = writer.append(3, 'A-3', b'%PDF-three')
+
+        self.assertEqual(self.read('fy2023.pack', second), b'%PDF-two')
+        self.assertEqual(self.read('fy2023.pack', third), b'%PDF-three')
+        self.assertEqual(
+            [entry[:2] for entry in archive.read_index('fy2023.pack')], [[3, 'A-3'], [1, 'A-1'], [2, 'A-2']]
+        )
+        self.assertEqual(next(archive.read_index('fy2023.pack'))[2:], list(third))
+        self.assertEqual(first[2], hashlib.sha256(b'%PDF-one').hexdigest())
+
+    def test_uncommitted_tail_of_a_crashed_run_is_cut_off(self):
+        with archive.PackWriter('fy2023.pack') as writer:
+            writer.append(1, 'A-1', b'%PDF-one')
+        committed = os.path.getsize(archive.pack_path('fy2023.pack'))
+        crashed = archive.PackWriter('fy2023.pack')
+        crashed.append(2, 'A-2', b'%PDF-two')
+        crashed.file.close()  # no commit, as if the process died
+        self.assertGreater(os.path.getsize(archive.pack_path('fy2023.pack')), committed)
+
+        with archive.PackWriter('fy2023.pack') as writer:
+            self.assertEqual(writer.start, committed)
+            entry = writer.append(3, 'A-3', b'%PDF-three')
+        self.assertEqual([e[0] for e in archive.read_index('fy2023.pack')], [3, 1])
+        self.assertEqual(self.read('fy2023.pack', entry), b'%PDF-three')
+
+    def test_one_writer_at_a_time(self):
+        with archive.PackWriter('fy2023.pack'):
+            with self.assertRaises(archive.ArchiveError):
+                archive.PackWriter('fy2023.pack')
+        archive.PackWriter('fy2023.pack').close()
+
+    def create_invoices(self):
+        return [
+            create_invoice(invoice_date=date(2023, 5, 2), contract_no='GEMC-ARCH-1', total_amount=Decimal('11800')),
+            create_invoice(invoice_date=date(2024, 2, 10), state='Madhya Pradesh', total_amount=Decimal('5900')),
+            create_invoice(invoice_date=date(2024, 5, 2), contract_no='GEMC-OPEN-1'),
+        ]
+
+    def close_year(self, render=lambda pk: b'%PDF-' + str(pk).encode()):
+        rendered = lambda pks, workers: iter([(pk, str(pk), render(pk), None) for pk in pks])
+        with mock.patch.object(archive, 'iter_rendered_pdfs', side_effect=rendered):
+            self.assertEqual(archive.close_financial_year(2023, workers=1, chunk_size=1), 2)
+
+    def test_close_keeps_the_gst_summary(self):
+        invoices = self.create_invoices()
+        summary = list(GstSummary.objects.values_list('month', 'state', 'invoice_count', 'total_amount'))
+        self.assertEqual(len(summary), 3)
+        self.close_year()
+
+        self.assertEqual(list(Invoice.objects.values_list('pk', flat=True)), [invoices[2].pk])
+        self.assertEqual(ArchivedInvoice.objects.count(), 2)
+        self.assertEqual(list(GstSummary.objects.values_list('month', 'state', 'invoice_count', 'total_amount')), summary)
+        self.assertEqual(gst_summary.check(), [])
+        self.assertEqual(archive.verify(2023), [])
+        with archive.open_pdf(ArchivedInvoice.objects.get(pk=invoices[1].pk)) as pdf:
+            self.assertEqual(pdf.read(), b'%PDF-' + str(invoices[1].pk).encode())
+
+    def test_ledger_and_search_include_archived_invoices(self):
+        invoices = self.create_invoices()
+        self.close_year()
+
+        response = self.client.get(reverse('export_ledger', args=['csv']))
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode('utf-8-sig'))))[1:]
+        self.assertEqual([row[0] for row in rows], [invoice.invoice_number for invoice in invoices])
+        self.assertEqual(rows[0][3], 'GEMC-ARCH-1')
+
+        response = self.client.get(reverse('invoice_list'), {'q': 'gemc arch'})
+        self.assertEqual(list(response.context['page']), [])
+        self.assertEqual([invoice.pk for invoice in response.context['archived_matches']], [invoices[0].pk])
+
+
+    @override_settings(INVOICE_PDF_WORKERS=1)
+    def test_zip_export_includes_archived_invoices(self):
+        invoices = self.create_invoices()
+        self.close_year()
+
+        rendered = lambda pks, workers, executor: ((pk, 'OPEN', b'%PDF-open', None) for pk in pks)
+        with mock.patch.object(bulk_pdf, 'iter_rendered_pdfs', side_effect=rendered):
+            response = self.client.get(reverse('export_invoice_pdfs'))
+            content = b''.join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(content)) as zipped:
+            self.assertEqual(
+                zipped.namelist(), [invoices[1].invoice_number + '.pdf', invoices[0].invoice_number + '.pdf', 'OPEN.pdf']
+            )
+            self.assertEqual(zipped.read(invoices[0].invoice_number + '.pdf'), b'%PDF-' + str(invoices[0].pk).encode())
+
+        response = self.client.get(reverse('export_invoice_pdfs'), {'financial_year': 2023})
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as zipped:
+            self.assertEqual(len(zipped.namelist()), 2)
+
+    def test_statement_includes_archived_invoices(self):
+        invoices = self.create_invoices()
+        self.close_year(render=lambda pk: render_text_pdf('Archived %d' % pk))
+        client = (invoices[0].client_name, invoices[0].client_address)
+        self.assertIn(statements.client_key(*client), [key for key, name, address in statements.list_clients()])
+
+        rendered = lambda pks, workers: ((pk, str(pk), render_text_pdf('Open %d' % pk), None) for pk in pks)
+        with mock.patch.object(statements, 'iter_rendered_pdfs', side_effect=rendered):
+            output = io.BytesIO()
+            count, errors = statements.build_statement(*client, date(2023, 4, 1), date(2025, 3, 31), output)
+        self.assertEqual((count, errors), (3, []))
+        reader = PdfReader(output)
+        self.assertEqual(
+            [page.extract_text().strip() for page in reader.pages[1:]],
+            ['Archived %d' % invoices[0].pk, 'Archived %d' % invoices[1].pk, 'Open %d' % invoices[2].pk],
+        )
+        self.assertIn('Total (3 invoices)', reader.pages[0].extract_text())
+
+    def test_api_lists_and_shows_archived_invoices(self):
+        invoices = self.create_invoices()
+        self.close_year()
+
+        data = self.client.get('/api/invoices/', {'limit': 2, 'fields': 'id'}).json()
+        seen = [item['id'] for item in data['results']]
+        while data['next']:
+            data = self.client.get(data['next']).json()
+            seen += [item['id'] for item in data['results']]
+        self.assertEqual(seen, [invoices[2].pk, invoices[1].pk, invoices[0].pk])
+        # Back from the archive to the open years
+        data = self.client.get(data['previous']).json()
+        self.assertEqual([item['id'] for item in data['results']], [invoices[2].pk])
+        self.assertIsNone(data['previous'])
+
+        data = self.client.get('/api/invoices/', {'financial_year': 2023, 'fields': 'id'}).json()
+        self.assertEqual([item['id'] for item in data['results']], [invoices[1].pk, invoices[0].pk])
+        self.assertIsNone(data['previous'])
+
+        response = self.client.get('/api/invoices/%d/' % invoices[0].pk, {'fields': 'invoice_number,contract_no'})
+        self.assertEqual(response.json(), {'invoice_number': invoices[0].invoice_number, 'contract_no': 'GEMC-ARCH-1'})
+        self.assertEqual(self.client.get('/api/invoices/999999/').status_code, 404)
+
+
+@override_settings(INVOICE_PDF_PRERENDER=False)
+class PdfDownloadTests(TempDirsMixin, LoginSessionMixin, TestCase):
+    def cache(self, invoice):
+        key = pdf_cache.invoice_cache_key(invoice)
+        pdf_cache.put(invoice.pk, key, b'%PDF-cached')
+
+    def test_cached_pdf_is_streamed_from_the_cache_file(self):
+        invoice = create_invoice()
+        self.cache(invoice)
+        response = self.client.get(reverse('download_invoice_pdf', args=[invoice.pk]))
+        self.assertIsInstance(response, FileResponse)
+        self.assertFalse(response.is_async)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-cached')
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="%s.pdf"' % invoice.invoice_number)
+        response.close()
+
+    async def test_cached_pdf_is_read_asynchronously_under_asgi(self):
+        invoice = await sync_to_async(create_invoice)()
+        await sync_to_async(self.cache)(invoice)
+        self.async_client.cookies = self.client.cookies
+        response = await self.async_client.get(reverse('download_invoice_pdf', args=[invoice.pk]))
+        self.assertTrue(response.is_async)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'%PDF-cached')
+        response.close()
+
+    def test_render_then_304_until_the_invoice_is_edited(self):
+        invoice = create_invoice()
+        url = reverse('download_invoice_pdf', args=[invoice.pk])
+        with mock.patch.object(pdf_cache, 'render_invoice_pdf', return_value=b'%PDF-rendered') as render:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, b'%PDF-rendered')
+            etag = response['ETag']
+            self.assertEqual(response['Last-Modified'], http_date(int(invoice.updated_at.timestamp())))
+            self.assertEqual(Invoice.objects.get(pk=invoice.pk).pdf_status, Invoice.PdfStatus.READY)
+            self.assertEqual(len(os.listdir(pdf_cache.get_cache_dir())), 1)
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(render.call_count, 1)
+
+            invoice.client_name = 'Renamed Client'
+            invoice.save()
+            self.assertEqual(os.listdir(pdf_cache.get_cache_dir()), [])
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            self.assertEqual(render.call_count, 2)
+
+    def test_evict_removes_least_recently_used_entries(self):
+        for pk, age in ((1, 300), (2, 100), (3, 200)):
+            pdf_cache.put(pk, 'key', b'x' * 100)
+            path = pdf_cache._entry_path(pk, 'key')
+            os.utime(path, (time.time() - age, time.time() - age))
+        # A hit makes the oldest entry the most recently used
+        self.assertEqual(pdf_cache.get(1, 'key'), b'x' * 100)
+        pdf_cache.evict(max_bytes=150)
+        self.assertEqual(os.listdir(pdf_cache.get_cache_dir()), [os.path.basename(pdf_cache._entry_path(1, 'key'))])
+
+
+
+@override_settings(INVOICE_PDF_PRERENDER=False, INVOICE_PDF_WORKERS=1)
+class BulkExportTests(TempDirsMixin, LoginSessionMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        slots = mock.patch.object(bulk_pdf, '_export_slots', threading.BoundedSemaphore(1))
+        self.slots = slots.start()
+        self.addCleanup(slots.stop)
+
+    def render(self, invoice, *args, **kwargs):
+        if invoice.client_name == 'Broken':
+            raise PDFRenderError('bad markup')
+        return b'%PDF-' + invoice.invoice_number.encode()
+
+    def test_zip_lists_the_pdfs_in_order_and_the_failures(self):
+        invoices = [create_invoice(client_name=name) for name in ('First', 'Broken', 'Last')]
+        ordered = list(Invoice.objects.filter(client_name__in=['First', 'Last']))
+        with mock.patch.object(pdf_cache, 'render_invoice_pdf', side_effect=self.render):
+            response = self.client.get(reverse('export_invoice_pdfs'))
+            content = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+
+        with zipfile.ZipFile(io.BytesIO(content)) as zf:
+            names = zf.namelist()
+            self.assertEqual(names, ['%s.pdf' % invoice.invoice_number for invoice in ordered] + ['errors.txt'])
+            self.assertEqual(zf.read(names[0]), b'%PDF-' + ordered[0].invoice_number.encode())
+            self.assertEqual(
+                zf.read('errors.txt').decode(), '%s (id %s): bad markup\n' % (invoices[1].invoice_number, invoices[1].pk)
+            )
+        # The finished download gave its slot back
+        self.assertTrue(self.slots.acquire(blocking=False))
+
+    def test_exports_beyond_the_limit_are_refused(self):
+        invoice = create_invoice()
+        first = self.client.get(reverse('export_invoice_pdfs'), {'pk': invoice.pk})
+        busy = self.client.get(reverse('export_invoice_pdfs'), {'pk': invoice.pk})
+        self.assertEqual(busy.status_code, 503)
+        self.assertEqual(busy['Retry-After'], str(bulk_pdf.RETRY_AFTER))
+
+        # An abandoned download is closed without being read, which also frees the slot
+        first.close()
+        with mock.patch.object(pdf_cache, 'render_invoice_pdf', side_effect=self.render):
+            response = self.client.get(reverse('export_invoice_pdfs'), {'pk': invoice.pk})
+            self.assertEqual(response.status_code, 200)
+            b''.join(response.streaming_content)
+
+    def test_a_shared_executor_is_left_running(self):
+        rendered = lambda pk: (pk, str(pk), b'%PDF', None)
+        with ThreadPoolExecutor(max_workers=2) as executor, mock.patch.object(bulk_pdf, 'render_invoice', rendered):
+            results = bulk_pdf.iter_rendered_pdfs(range(10), workers=2, executor=executor)
+            self.assertEqual([next(results)[0] for _ in range(3)], [0, 1, 2])
+            results.close()
+            self.assertEqual(executor.submit(rendered, 11).result()[0], 11)
+
+    async def test_zip_is_streamed_asynchronously_under_asgi(self):
+        invoice = await sync_to_async(create_invoice)()
+        self.async_client.cookies = self.client.cookies
+        with mock.patch.object(pdf_cache, 'render_invoice_pdf', side_effect=self.render):
+            response = await self.async_client.get(reverse('export_invoice_pdfs'))
+            self.assertTrue(response.is_async)
+            content = b''.join([chunk async for chunk in response.streaming_content])
+        with zipfile.ZipFile(io.BytesIO(content)) as zf:
+            self.assertEqual(zf.namelist(), ['%s.pdf' % invoice.invoice_number])
+        # Closing the response closed the export and gave its slot back
+        self.assertTrue(self.slots.acquire(blocking=False))
+
+
+@override_settings(INVOICE_PDF_PRERENDER=False)
+class LedgerExportTests(TempDirsMixin, LoginSessionMixin, TestCase):
+    HEADER = ['Invoice No', 'Invoice Date', 'Client', 'Contract No', 'State', 'Base Amount', 'CGST', 'SGST', 'IGST',
+              'Round Off', 'Total']
+
+    def setUp(self):
+        super().setUp()
+        self.later = create_invoice(invoice_date=date(2025, 6, 1), client_name='=HYPERLINK("x")', total_amount=Decimal('999.99'))
+        self.earlier = create_invoice(
+            invoice_date=date(2025, 5, 2), state='Madhya Pradesh', contract_no='GEMC-1', total_amount=Decimal('11800'),
+        )
+
+    def total(self):
+        return sum(Invoice.objects.values_list('total_amount', flat=True))
+
+    def export(self, fmt, **params):
+        response = self.client.get(reverse('export_ledger', args=[fmt]), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="invoice-ledger.%s"' % fmt)
+        return b''.join(response.streaming_content)
+
+    def test_csv(self):
+        content = self.export('csv')
+        self.assertTrue(content.startswith(codecs.BOM_UTF8))
+        rows = list(csv.reader(io.StringIO(content.decode('utf-8-sig'))))
+        self.assertEqual(rows[0], self.HEADER)
+        self.assertEqual(rows[1], [
+            self.earlier.invoice_number, '2025-05-02', self.earlier.client_name, 'GEMC-1', 'Madhya Pradesh',
+            '10000.00', '0.00', '0.00', '1800.00', '0.00', '11800.00',
+        ])
+        self.assertEqual(rows[2][:5], [self.later.invoice_number, '2025-06-01', '\'=HYPERLINK("x")', '', 'Uttarakhand'])
+        # The amounts add up to the invoice total on every row
+        for row in rows[1:]:
+            self.assertEqual(sum(Decimal(value) for value in row[5:10]), Decimal(row[10]))
+        self.assertEqual(sum(Decimal(row[10]) for row in rows[1:]), self.total())
+
+    def test_csv_keeps_the_list_filters(self):
+        rows = list(csv.reader(io.StringIO(self.export('csv', state='Uttarakhand').decode('utf-8-sig'))))
+        self.assertEqual([row[0] for row in rows[1:]], [self.later.invoice_number])
+
+    def test_xlsx(self):
+        from openpyxl import load_workbook
+
+        sheet = load_workbook(io.BytesIO(self.export('xlsx')), read_only=True).active
+        rows = list(sheet.iter_rows(values_only=True))
+        self.assertEqual(list(rows[0]), self.HEADER)
+        self.assertEqual(rows[1][:5], (self.earlier.invoice_number, datetime(2025, 5, 2), self.earlier.client_name,
+                                       'GEMC-1', 'Madhya Pradesh'))
+        self.assertEqual(rows[1][5:], (10000, 0, 0, 1800, 0, 11800))
+        self.assertEqual(rows[2][2], '=HYPERLINK("x")')
+        self.assertAlmostEqual(sum(row[10] for row in rows[1:]), float(self.total()))
+
+    async def test_ledger_is_streamed_asynchronously_under_asgi(self):
+        self.async_client.cookies = self.client.cookies
+        response = await self.async_client.get(reverse('export_ledger', args=['csv']))
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(content, await sync_to_async(self.export)('csv'))
+
+
+@override_settings(INVOICE_PDF_PRERENDER=False)
+class RecomputeTests(TempDirsMixin, TestCase):
+    TOTALS = ('11800', '999.99', '5000.50', '123456.78', '1')
+
+    def create_pairs(self):
+        # Two identical invoices per case: one for recompute(), one for save()
+        pairs = []
+        for state in ('Uttarakhand', 'Madhya Pradesh'):
+            for total in self.TOTALS:
+                pairs.append([create_invoice(state=state, total_amount=Decimal(total)) for _ in range(2)])
+        return pairs
+
+    def amounts(self, invoice):
+        return Invoice.objects.values_list(*AMOUNT_FIELDS).get(pk=invoice.pk)
+
+    def test_matches_save(self):
+        pairs = self.create_pairs()
+        ids = [recomputed.pk for recomputed, _ in pairs]
+        updates = {'cgst_rate': Decimal('6'), 'sgst_rate': Decimal('6'), 'igst_rate': Decimal('12')}
+        result = recompute.recompute(Invoice.objects.filter(pk__in=ids), updates=updates, chunk_size=3)
+        self.assertEqual((result.scanned, result.changed), (10, 10))
+
+        for recomputed, saved in pairs:
+            saved = Invoice.objects.get(pk=saved.pk)
+            for field, value in updates.items():
+                setattr(saved, field, value)
+            saved.save()
+            self.assertEqual(self.amounts(recomputed), self.amounts(saved), recomputed.total_amount)
+        self.assertEqual(gst_summary.check(), [])
+
+    def test_dry_run_lists_the_changes_and_writes_nothing(self):
+        invoice = create_invoice(state='Madhya Pradesh', total_amount=Decimal('11800'))
+        intra_state = create_invoice(state='Uttarakhand', total_amount=Decimal('11800'))
+        before = self.amounts(invoice)
+
+        result = recompute.recompute(
+            Invoice.objects.all(), updates={'igst_rate': Decimal('12')}, dry_run=True, keep_changes=5
+        )
+        self.assertTrue(result.dry_run)
+        self.assertEqual((result.scanned, result.changed), (2, 2))
+        self.assertEqual(result.changes, [
+            (invoice.invoice_number, {
+                'igst_rate': (Decimal('18.00'), Decimal('12.00')),
+                'base_amount': (Decimal('10000.00'), Decimal('10535.71')),
+                'igst_amount': (Decimal('1800.00'), Decimal('1264.29')),
+            }),
+            # The intra-state invoice pays CGST + SGST; only the rate it would carry changes
+            (intra_state.invoice_number, {'igst_rate': (Decimal('18.00'), Decimal('12.00'))}),
+        ])
+        self.assertEqual(self.amounts(invoice), before)
+        self.assertEqual(Invoice.objects.get(pk=invoice.pk).igst_rate, Decimal('18.00'))
+
+
+@override_settings(INVOICE_PDF_PRERENDER=False)
+class ContentAddressedImageTests(TempDirsMixin, TestCase):
+    def png(self, color):
+        from PIL import Image
+
+        output = io.BytesIO()
+        Image.new('RGB', (40, 20), color).save(output, 'PNG')
+        return output.getvalue()
+
+    def expected_name(self, directory, data):
+        return '%s/%s.png' % (directory, hashlib.sha256(data).hexdigest())
+
+    def test_field_file_save(self):
+        red, blue = self.png('red'), self.png('blue')
+        first = Signature(name='First')
+        first.image.save('x.png', ContentFile(red))
+        second = Signature(name='Second')
+        second.image.save('x.png', ContentFile(blue))
+
+        self.assertEqual(first.image.name, self.expected_name('signatures', red))
+        self.assertEqual(second.image.name, self.expected_name('signatures', blue))
+        self.assertEqual(Signature.objects.get(pk=second.pk).content_hash, hashlib.sha256(blue).hexdigest())
+        with second.image.open('rb') as f:
+            self.assertEqual(f.read(), blue)
+        self.assertTrue(images.variant_storage.exists(images.variant_name(second, 'print')))
+
+    def test_model_assignment(self):
+        red = self.png('red')
+        stamp = Stamp.objects.create(name='Stamp', image=ContentFile(red, name='Scan.PNG'))
+        duplicate = Stamp.objects.create(name='Again', image=ContentFile(red, name='other.png'))
+
+        self.assertEqual(stamp.image.name, self.expected_name('stamps', red))
+        self.assertEqual(duplicate.image.name, stamp.image.name)
+        self.assertEqual(duplicate.content_hash, hashlib.sha256(red).hexdigest())
+        self.assertEqual(os.listdir(os.path.join(self.temp_dir, 'media', 'stamps')), [os.path.basename(stamp.image.name)])
+
+        # Replacing the image of an existing asset
+        blue = self.png('blue')
+        stamp.image = ContentFile(blue, name='new.png')
+        stamp.save()
+        stamp.refresh_from_db()
+        self.assertEqual((stamp.image.name, stamp.content_hash), (self.expected_name('stamps', blue), hashlib.sha256(blue).hexdigest()))
@@ -1,12 +1,21 @@
 from django.urls import path
-from . import views
+from . import api, instrumentation, views
 
 urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('', views.invoice_list, name='invoice_list'),
     path('invoice/<int:pk>/pdf/', views.download_invoice_pdf, name='download_invoice_pdf'),
+    path('invoice/export/pdf/', views.export_invoice_pdfs, name='export_invoice_pdfs'),
     path('invoice/<int:pk>/delete/', views.invoice_delete, name='invoice_delete'),
     path('create/', views.create_invoice, name='create_invoice'),
+    path('invoice/export/ledger.<str:fmt>', views.export_ledger, name='export_ledger'),
+    path('import/', views.import_invoices, name='import_invoices'),
     path('preview/<int:pk>/', views.invoice_preview, name='invoice_preview'),
+    path('reports/statement/', views.client_statement, name='client_statement'),
+    path('reports/gst/', views.gst_report, name='gst_report'),
+    path('api/invoices/', api.invoice_list, name='api_invoice_list'),
+    path('api/invoices/batch/', api.invoice_batch_create, name='api_invoice_batch_create'),
+    path('api/invoices/<int:pk>/', api.invoice_detail, name='api_invoice_detail'),
+    path('metrics', instrumentation.metrics, name='metrics'),
 ]
@@ -1,34 +1,45 @@
-from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse
-from .models import Invoice, Signature
-from .forms import InvoiceForm
-from num2words import num2words
-from django.contrib.auth.decorators import login_required, permission_required
-# ReportLab imports (kept in case you still use other reportlab views)
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-import io
-from django.views.decorators.http import require_POST
-from django.urls import reverse
-from django.contrib.auth import authenticate, login, logout
-from django.contrib.auth.models import User
-from django.contrib import messages
-from django.shortcuts import redirect, render
-from django.contrib.auth.decorators import login_required
+# PDF rendering lives in pdf.py (xhtml2pdf) / pdf_reportlab.py, cached on disk by pdf_cache.py
+import mimetypes
+import os
+import stat
+from datetime import timedelta
 from functools import wraps
-from django.shortcuts import redirect
-# xhtml2pdf imports (new)
-from django.template.loader import get_template
+from urllib.parse import quote
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
 from django.conf import settings
-from xhtml2pdf import pisa
-import os
+from django.contrib import messages
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.paginator import Paginator
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect, render
+from django.urls import reverse
+from django.utils import timezone
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, quote_etag
+from django.views.decorators.http import require_POST
+
+from . import archive, bulk_pdf, gst_summary, importers, ledger, line_items, pdf_cache, pdf_executor, statements
+from .forms import (
+    GstReportForm, InvoiceFilterForm, InvoiceForm, InvoiceImportUploadForm, InvoiceLineItemFormSet, StatementForm,
+)
+from .instrumentation import stage
+from .models import ArchivedInvoice, Invoice, financial_year_for
+from .pagination import InvalidCursor, KeysetPaginator
+from .pdf import PDFRenderError, build_invoice_context
+from .streaming import stream_file_response, streaming_content
 
 # ======== Simple Hardcoded Login ========
 def require_login_session(view_func):
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _async_wrapped(request, *args, **kwargs):
+            if not await request.session.aget("is_authenticated"):
+                return redirect('login')
+            return await view_func(request, *args, **kwargs)
+        return _async_wrapped
+
     @wraps(view_func)
     def _wrapped(request, *args, **kwargs):
         if not request.session.get("is_authenticated"):
@@ -79,103 +90,335 @@ def create_invoice(request):
         return redirect('login')
     if request.method == 'POST':
         form = InvoiceForm(request.POST)
-        if form.is_valid():
-            invoice = form.save()
-            return redirect('invoice_preview', pk=invoice.pk)
+        line_formset = InvoiceLineItemFormSet(request.POST, prefix='lines')
+        if form.is_valid() and line_formset.is_valid():
+            invoice = form.save(commit=False)
+            lines = [line_form.save(commit=False) for line_form in line_formset if line_form.has_changed()]
+            if lines:
+                # Itemised: the totals come from the lines
+                line_items.replace_line_items(invoice, lines)
+                return redirect('invoice_preview', pk=invoice.pk)
+            if invoice.total_amount is not None:
+                invoice.save()
+                return redirect('invoice_preview', pk=invoice.pk)
+            form.add_error('total_amount', 'Enter the total amount, or add line items below.')
     else:
         form = InvoiceForm()
+        line_formset = InvoiceLineItemFormSet(prefix='lines')
     
-    return render(request, 'invoices/create_invoice.html', {'form': form})
+    return render(request, 'invoices/create_invoice.html', {'form': form, 'line_formset': line_formset})
 
 @require_login_session
-def invoice_preview(request, pk):
-    invoice = get_object_or_404(Invoice, pk=pk)
-    
-    # Convert amount to words
-    amount_in_words = num2words(int(invoice.total_amount), lang='en_IN').title()
+def import_invoices(request):
+    """
+    Create invoices in bulk from an uploaded CSV/XLSX file, reporting errors per row. An upload
+    rejected as a whole (an invalid row without skip_invalid) is answered with 400.
+    """
+    result = None
+    status = 200
+    if request.method == 'POST':
+        form = InvoiceImportUploadForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            result = importers.import_invoices(
+                importers.iter_rows(upload.file, upload.name),
+                dry_run=form.cleaned_data['dry_run'],
+                skip_invalid=form.cleaned_data['skip_invalid'],
+            )
+            if result.errors and not result.created and not result.dry_run:
+                status = 400
+        else:
+            status = 400
+    else:
+        form = InvoiceImportUploadForm()
+
+    return render(request, 'invoices/import_invoices.html', {'form': form, 'result': result}, status=status)
+
+def _preview_context(invoice, line_rows=None):
+    # Everything the preview template reads, fetched up front so that rendering it in an async
+    # view never touches the database
+    if line_rows is None and invoice.line_item_count:
+        line_rows = list(line_items.display_rows(invoice))
+    return build_invoice_context(invoice, line_rows)
+
+@require_login_session
+async def invoice_preview(request, pk):
+    with stage('orm'):
+        invoice = await Invoice.objects.select_related('signature', 'stamp').filter(pk=pk).afirst()
+        if invoice is None:
+            # Closed financial years live in the archive
+            archived = await aget_object_or_404(ArchivedInvoice, pk=pk)
+            invoice, line_rows = await sync_to_async(archive.to_invoice)(archived)
+        else:
+            line_rows = None
     
-    context = {
-        'invoice': invoice,
-        'amount_in_words': amount_in_words,
-    }
+    # Same context as the PDF (includes the amount in words)
+    context = await sync_to_async(_preview_context)(invoice, line_rows)
     
-    return render(request, 'invoices/invoice_preview.html', context)
+    with stage('template'):
+        return render(request, 'invoices/invoice_preview.html', context)
+
+# Only the columns the invoice list table shows; skips the large description/address fields
+INVOICE_LIST_FIELDS = ('id', 'invoice_number', 'invoice_date', 'client_name', 'total_amount', 'created_at')
+
+def _search_page(filter_form, invoices, number):
+    # Search results are ordered by relevance, so they are paged by number instead of keyset.
+    # The search backends and Paginator are synchronous; the rows and counts are all fetched
+    # here so the template does not query
+    invoices = filter_form.filter(invoices)
+    page = Paginator(invoices, settings.INVOICE_LIST_PAGE_SIZE).get_page(number)
+    page.object_list = list(page.object_list)
+    return page
+
+# Search matches from closed financial years listed under the results
+ARCHIVED_MATCHES = 20
+
+def _archived_matches(filter_form):
+    # Archived invoices are not in the invoices table, so the paged results never include them
+    archived = ArchivedInvoice.objects.only('id', 'invoice_number', 'invoice_date', 'client_name', 'total_amount')
+    return list(filter_form.filter(archived)[:ARCHIVED_MATCHES])
 
 @require_login_session
-def invoice_list(request):
-    # if not logged in via our simple session flag, send to login page
-    if not request.session.get("is_authenticated"):
-        return redirect('login')
+async def invoice_list(request):
+    invoices = Invoice.objects.only(*INVOICE_LIST_FIELDS)
+    filter_form = InvoiceFilterForm(request.GET)
+
+    searching = filter_form.is_valid() and bool(filter_form.cleaned_data['q'])
+    archived_matches = []
+    if searching:
+        page = await sync_to_async(_search_page)(filter_form, invoices, request.GET.get('page'))
+        archived_matches = await sync_to_async(_archived_matches)(filter_form)
+    else:
+        if filter_form.is_valid():
+            invoices = filter_form.filter(invoices)
+        paginator = KeysetPaginator(invoices, ordering=Invoice._meta.ordering, per_page=settings.INVOICE_LIST_PAGE_SIZE)
+        try:
+            page = await paginator.apage(after=request.GET.get('after'), before=request.GET.get('before'))
+        except InvalidCursor:
+            page = await paginator.apage()
+
+    # Filters are carried over to the next/previous page links
+    filter_query = request.GET.copy()
+    for param in ('after', 'before', 'page'):
+        filter_query.pop(param, None)
 
-    invoices = Invoice.objects.all()
-    return render(request, 'invoices/invoice_list.html', {'invoices': invoices})
+    with stage('template'):
+        return render(request, 'invoices/invoice_list.html', {
+            'invoices': page,
+            'page': page,
+            'filter_form': filter_form,
+            'filter_query': filter_query.urlencode(),
+            'searching': searching,
+            'archived_matches': archived_matches,
+            'archived_limit': ARCHIVED_MATCHES,
+        })
 
 
 
-# Helper for xhtml2pdf to find static and media files
-def link_callback(uri, rel):
+def _render_unavailable(message, status):
+    response = HttpResponse(message, status=status, content_type='text/plain')
+    response['Retry-After'] = pdf_executor.RETRY_AFTER
+    return response
+
+@require_login_session
+async def download_invoice_pdf(request, pk):
     """
-    Convert HTML URIs to absolute system paths so xhtml2pdf can access static/media files.
+    Generates a PDF using xhtml2pdf (pisa) from the same template used for preview.
+    Rendered PDFs are streamed from the on-disk cache (see pdf_cache.py), where the background
+    job worker (pdf_jobs.py) puts them after each save; only when that has not happened yet is
+    the PDF rendered, by the bounded render pool (pdf_executor.py) so the event loop keeps
+    serving other requests meanwhile. When the pool is saturated or the PDF takes too long the
+    answer is 503 or 504 with Retry-After. The cache key doubles as the ETag so repeat
+    downloads are answered with 304 without touching the renderer.
     """
-    # If uri is a media url, map to MEDIA_ROOT
-    if uri.startswith(settings.MEDIA_URL):
-        path = uri.replace(settings.MEDIA_URL, '')
-        return os.path.join(settings.MEDIA_ROOT, path)
+    with stage('orm'):
+        invoice = await Invoice.objects.select_related('signature', 'stamp').filter(pk=pk).afirst()
+    if invoice is None:
+        response = await sync_to_async(archived_invoice_pdf)(request, pk)
+        return stream_file_response(request, response)
 
-    # If uri is a static url, map to STATIC_ROOT if available, otherwise to project static folder
-    if uri.startswith(settings.STATIC_URL):
-        path = uri.replace(settings.STATIC_URL, '')
-        if getattr(settings, 'STATIC_ROOT', None):
-            return os.path.join(settings.STATIC_ROOT, path)
-        # fallback to static folder in BASE_DIR
-        return os.path.join(settings.BASE_DIR, 'static', path)
+    # Stats the template, stylesheet and images; the first call also loads the PDF backend
+    key = await sync_to_async(pdf_cache.invoice_cache_key, thread_sensitive=False)(invoice)
+    etag = quote_etag(key)
+    last_modified = int(invoice.updated_at.timestamp())
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        with stage('cache'):
+            cached = await sync_to_async(pdf_cache.open_entry, thread_sensitive=False)(invoice.pk, key)
+        if cached is not None:
+            # Streamed from the cache file rather than read into memory
+            response = stream_file_response(request, FileResponse(cached, content_type='application/pdf'))
+        else:
+            try:
+                with stage('render_wait'):
+                    pdf_bytes = await pdf_executor.get_executor().render(invoice, key)
+            except pdf_executor.RenderQueueFull:
+                return _render_unavailable('Too many PDFs are being generated right now; please try again shortly.', 503)
+            except pdf_executor.RenderTimeout:
+                return _render_unavailable('The PDF is still being generated; please try again shortly.', 504)
+            except PDFRenderError as exc:
+                # Return a readable error (useful while developing)
+                return HttpResponse('We had errors while generating the PDF: <pre>%s</pre>' % exc, status=500)
+            response = HttpResponse(pdf_bytes, content_type='application/pdf')
+        response['Content-Disposition'] = 'inline; filename="%s.pdf"' % invoice.invoice_number
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Let browsers keep the file but always revalidate, so edits show up immediately
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def archived_invoice_pdf(request, pk):
+    """
+    The PDF of an archived invoice, streamed from its slice of the year's pack file. Archived
+    PDFs never change, so browsers may keep them.
+    """
+    archived = get_object_or_404(
+        ArchivedInvoice.objects.only('invoice_number', 'pack', 'pack_offset', 'pack_length', 'sha256'), pk=pk
+    )
+    etag = quote_etag(archived.sha256[:32])
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = FileResponse(archive.open_pdf(archived), content_type='application/pdf')
+        response['Content-Disposition'] = 'inline; filename="%s.pdf"' % archived.invoice_number
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
 
-    # return unchanged for absolute paths or external URLs
-    return uri
 
 @require_login_session
-def download_invoice_pdf(request, pk):
+def export_invoice_pdfs(request):
     """
-    Generates a PDF using xhtml2pdf (pisa) from the same template used for preview.
-    This inlines the contents of static/css/styles.css so the PDF matches the browser preview.
+    Download the PDFs of every invoice matching the filter (date range, state, financial year
+    or ?pk=1,2,3) as one ZIP, streamed while the shared process pool renders it. Invoices of
+    closed years are copied from their archive packs. When INVOICE_PDF_EXPORTS exports are
+    already running the answer is 503 with Retry-After.
     """
-    invoice = get_object_or_404(Invoice, pk=pk)
+    form = InvoiceFilterForm(request.GET)
+    if not form.is_valid():
+        return HttpResponse('Invalid export filter: %s' % form.errors.as_text(), status=400)
 
-    # Build context same as preview
-    amount_in_words = num2words(int(invoice.total_amount), lang='en_IN').title()
-    context = {
-        'invoice': invoice,
-        'amount_in_words': amount_in_words,
-    }
-
-    # Load the HTML template (same template used for preview)
-    template = get_template('invoices/invoice_preview.html')
-    html = template.render(context)
-
-    # Read the CSS file from static and inline it (xhtml2pdf cannot reliably fetch CSS over HTTP)
-    css_path = os.path.join(settings.BASE_DIR, 'static', 'css', 'styles.css')
-    css_text = ''
-    if os.path.exists(css_path):
-        try:
-            with open(css_path, 'r', encoding='utf-8') as f:
-                css_text = f.read()
-        except Exception:
-            css_text = ''
-
-    # Prepend the CSS to the rendered HTML
-    html_with_css = '<style>%s</style>\n%s' % (css_text, html)
-
-    # Create PDF
-    result = io.BytesIO()
-    pdf_status = pisa.CreatePDF(
-        src=io.BytesIO(html_with_css.encode('utf-8')),
-        dest=result,
-        link_callback=link_callback
+    pks = list(form.filter(Invoice.objects.all()).values_list('pk', flat=True))
+    archived = form.filter(ArchivedInvoice.objects.all()).only('invoice_number', 'pack', 'pack_offset', 'pack_length')
+    try:
+        export = bulk_pdf.ZipExport(pks, archive.iter_zip_members(archived.iterator(chunk_size=2000)))
+    except bulk_pdf.ExportBusy:
+        response = HttpResponse(
+            'Too many exports are running right now; please try again shortly.', status=503, content_type='text/plain'
+        )
+        response['Retry-After'] = bulk_pdf.RETRY_AFTER
+        return response
+    response = StreamingHttpResponse(streaming_content(request, export), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="invoices.zip"'
+    return response
+
+
+LEDGER_FORMATS = {
+    'csv': (ledger.stream_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (ledger.stream_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+@require_login_session
+def export_ledger(request, fmt):
+    """
+    Stream the invoice ledger (amounts by invoice) matching the list filters as CSV or XLSX,
+    archived invoices of closed years included.
+    """
+    if fmt not in LEDGER_FORMATS:
+        raise Http404('Unknown ledger format')
+    form = InvoiceFilterForm(request.GET)
+    if not form.is_valid():
+        return HttpResponse('Invalid export filter: %s' % form.errors.as_text(), status=400)
+
+    stream, content_type = LEDGER_FORMATS[fmt]
+    rows = (form.filter(Invoice.objects.all()), form.filter(ArchivedInvoice.objects.all()))
+    response = StreamingHttpResponse(streaming_content(request, stream(*rows)), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="invoice-ledger.%s"' % fmt
+    return response
+
+
+@require_login_session
+def gst_report(request):
+    """
+    GST totals (base, CGST, SGST, IGST, round-off) by month and state for one financial year,
+    read from the incrementally maintained summary table.
+    """
+    form = GstReportForm(request.GET)
+    if form.is_valid():
+        financial_year, state = form.cleaned_data['financial_year'], form.cleaned_data['state']
+    else:
+        financial_year, state = financial_year_for(timezone.now().date()), None
+    report = gst_summary.report(financial_year, state=state)
+    return render(request, 'invoices/gst_report.html', {'form': form, 'report': report})
+
+
+@require_login_session
+def client_statement(request):
+    """
+    A client's invoices for a period merged into one PDF behind a summary cover page, sent as
+    it is written (statements.stream_statement); StatementForm caps the number of invoices
+    (statements.check_size).
+    """
+    if 'client' not in request.GET:
+        today = timezone.now().date()
+        last_month_end = today.replace(day=1) - timedelta(days=1)
+        form = StatementForm(initial={'date_from': last_month_end.replace(day=1), 'date_to': last_month_end})
+        return render(request, 'invoices/client_statement.html', {'form': form})
+
+    form = StatementForm(request.GET)
+    if not form.is_valid():
+        return render(request, 'invoices/client_statement.html', {'form': form}, status=400)
+
+    data = form.cleaned_data
+    invoices = list(statements.statement_invoices(
+        data['client_name'], data['client_address'], data['date_from'], data['date_to']
+    ))
+    if not invoices:
+        form.add_error(None, 'The client has no invoices in this period.')
+        return render(request, 'invoices/client_statement.html', {'form': form})
+
+    statement = statements.stream_statement(
+        data['client_name'], data['client_address'], data['date_from'], data['date_to'], invoices
     )
+    response = StreamingHttpResponse(streaming_content(request, statement), content_type='application/pdf')
+    filename = 'statement-%s-%s-%s.pdf' % (data['client'], data['date_from'], data['date_to'])
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
 
-    if pdf_status.err:
-        # Return a readable error (useful while developing)
-        return HttpResponse('We had errors while generating the PDF: <pre>%s</pre>' % pdf_status.err, status=500)
 
-    result.seek(0)
-    return HttpResponse(result.getvalue(), content_type='application/pdf')
+def serve_media(request, path):
+    """
+    Uploaded signature and stamp images, for logged-in users (and admin staff, whose change
+    forms link to them) only. Browsers may reuse an image
+    for INVOICE_MEDIA_MAX_AGE seconds and then revalidate it (ETag / If-Modified-Since); with
+    INVOICE_MEDIA_ACCEL_REDIRECT set, nginx sends the file once the login has been checked.
+    """
+    if not (request.session.get('is_authenticated') or request.user.is_staff):
+        return redirect('login')
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat_result = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('No such file')
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise Http404('No such file')
+
+    etag = quote_etag('%x-%x' % (stat_result.st_mtime_ns, stat_result.st_size))
+    last_modified = int(stat_result.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        accel_prefix = getattr(settings, 'INVOICE_MEDIA_ACCEL_REDIRECT', '')
+        if accel_prefix:
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + quote(path)
+        else:
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, max-age=%d' % getattr(settings, 'INVOICE_MEDIA_MAX_AGE', 3600)
+    return response